@@ -1,20 +1,36 @@
 #!/usr/bin/env python
+import contextlib
 import itertools
+import random
+import time
 
 from playerproxy import Player, main
-from cards import CARDS
+from cards import DEFAULT_DECK, get_deck, iter_bits
 from protocol import BufMessager
+from countcache import CounterCache
+from dealcount import CountTimeout, CountTooLarge
+from sampler import DealSampler
+from openings import OPENINGS, hand_shape
+import movebudget
+import parallelcount
+try:
+    import planner
+except ImportError:                                 # NumPy is not installed, suggest greedily
+    planner = None
 
 # import crash_on_ipy
 
 class Card:
-    def __init__(self, name, type):
+    def __init__(self, name, type, index):
         self.name = name                    # name of this card - String (ex. "Mu", "Re", and "Ba")
-        self.possible_owners = []           # all of the players who have not disproved this card - List[Players]
+        self.index = index                  # position of this card in cards.CARD_NAMES - Int
+        self.bit = 1 << index               # mask with only this card set - Int
+        self.possible_owners = 0            # mask of the ids of the players who have not disproved this card - Int
         self.owner = None                   # owner of this card - Player
         self.in_solution = False            # if this card is in the solution - Boolean
         self.disproved_to = set()           # players who have disproved the card - {Player}
         self.type = type                    # type of the card - CardType (type1/suspect, type2/weapon, etc...)
+        self.players = ()                   # every player of the game indexed by id - List[PlayerInfo]
 
     def __repr__(self):
         return self.name
@@ -22,25 +38,40 @@ class Card:
     def log(self, *args, **kwargs):
         pass
 
+    def mark_dirty(self, cards, players):
+        pass
+
+    def save(self, obj, *names):
+        pass
+
     def set_owner(self, owner):
         assert self.owner is None           # Check if this card already has an owner
-        assert self in owner.may_have       # Check if this card has not already been disproved by the owner-input
-        for player in self.possible_owners: # Remove this card from the "may_have" set of every player who has not
-            player.may_have.remove(self)    # disproved this card
-        self.possible_owners.clear()        # Empty this card's "possible_owners" list
+        assert owner.may_have & self.bit    # Check if this card has not already been disproved by the owner-input
+        self.mark_dirty(self.bit, self.possible_owners | owner.bit)     # Every player who may have had this card changes
+        self.save(self, 'possible_owners', 'owner')
+        self.save(owner, 'must_have')
+        self.save(self.type, 'rest_count')
+        for player_id in iter_bits(self.possible_owners):   # Remove this card from the "may_have" mask of every
+            self.save(self.players[player_id], 'may_have')
+            self.players[player_id].may_have &= ~self.bit   # player who has not disproved this card
+        self.possible_owners = 0            # Empty this card's "possible_owners" mask
         self.owner = owner                  # Set the owner of this card to the owner-input
-        owner.must_have.add(self)           # Add this card to the "must_have" set of the owner-input
+        owner.must_have |= self.bit         # Add this card to the "must_have" mask of the owner-input
         self.type.rest_count -= 1           # Lower the "rest_count" of this card's CardType by 1 to indicate that
                                             # there is one less card of this type without a known owner.
 
     def set_as_solution(self):
         # import pdb; pdb.set_trace()
         assert self.owner is None           # Check if this card has an owner
+        self.save(self, 'possible_owners', 'in_solution')
+        self.save(self.type, 'solution', 'rest_count')
         self.type.solution = self           # Set this card as the solution of this card's CardType
         self.in_solution = True             # Set this card's "in_solution" variable to True
-        for player in self.possible_owners: # Remove this card from the "may_have" set of every player who has not
-            player.may_have.remove(self)    # disproved this card
-        self.possible_owners.clear()        # Empty this card's "possible_owners" list
+        self.mark_dirty(self.bit, self.possible_owners)
+        for player_id in iter_bits(self.possible_owners):   # Remove this card from the "may_have" mask of every
+            self.save(self.players[player_id], 'may_have')
+            self.players[player_id].may_have &= ~self.bit   # player who has not disproved this card
+        self.possible_owners = 0            # Empty this card's "possible_owners" mask
         self.type.rest_count -= 1           # Lower the "rest_count" of this card's CardType by 1
 
     def __hash__(self):
@@ -48,9 +79,11 @@ class Card:
 
 
 class CardType:
-    def __init__(self, type_id):
+    def __init__(self, type_id, deck):
         self.type_id = type_id                                          # number of this CardType - Int (1 -> suspect, 2 -> weapon, etc...)
-        self.cards = [Card(name, self) for name in CARDS[type_id]]      # list of the cards of this CardType - List
+        self.cards = [Card(name, self, index) for index, name in        # list of the cards of this CardType - List
+                      enumerate(deck.categories[type_id], deck.first_indexes[type_id])]
+        self.mask = deck.type_masks[type_id]                            # mask of the cards of this CardType - Int
         self.rest_count = len(self.cards)                               # number of cards in this CardType without a known owner - Int
         self.solution = None                                            # the card of this CardType in the solution - Player
 
@@ -58,76 +91,112 @@ class CardType:
 class PlayerInfo:
     def __init__(self, id):
         self.id = id                        # the position of this Player in terms of the order of the card dealing - Int
-        self.must_have = set()              # set of cards this player must have / has disproved - Set
-        self.may_have = set()               # set of cards this any player has not disproved - Set
-        self.selection_groups = []          # list of sets of cards, in which at least this player MUST have one - List(Set(Card))
+        self.bit = 1 << id                  # mask with only this player set, used in Card.possible_owners - Int
+        self.must_have = 0                  # mask of cards this player must have / has disproved - Int
+        self.may_have = 0                   # mask of cards this any player has not disproved - Int
+        self.selection_groups = []          # list of masks of cards, in which at least this player MUST have one - List(Int)
         self.n_cards = None                 # number of cards this player has in their hand - Int
+        self.seen_may = 0                   # "may_have" mask at the end of the last "update" - Int
+        self.watched = 0                    # mask of the cards the selection groups are watched by, see "update" - Int
+        self.recheck = 0                    # mask of the cards of the selection groups added since the last "update" - Int
+        self.cards = ()                     # every card of the game indexed by Card.index - List[Card]
 
     def __hash__(self):
         return hash(self.id)
 
     def set_have_not_card(self, card):
-        if card in self.may_have:
-            self.may_have.remove(card)          # remove the card-input from this Player's "may_have" set
-            card.possible_owners.remove(self)   # and remove this Player from the card-input's "possible_owners" list
+        if self.may_have & card.bit:
+            self.mark_dirty(0, self.bit)
+            self.save(self, 'may_have')
+            self.save(card, 'possible_owners')
+            self.may_have &= ~card.bit          # remove the card-input from this Player's "may_have" mask
+            card.possible_owners &= ~self.bit   # and remove this Player from the card-input's "possible_owners" mask
 
     def log(self, *args, **kwargs):
         pass
 
+    def mark_dirty(self, cards, players):
+        pass
+
+    def save(self, obj, *names):
+        pass
+
+    def add_selection_group(self, group):
+        # group - mask of the cards of a suggestion this player disproved without showing the card - Int
+        self.save(self, 'selection_groups', 'watched', 'recheck')
+        self.selection_groups = self.selection_groups + [group]     # a new list, the old one may be on the undo trail
+        self.watched |= group                   # checked by the next "update" as if its cards just left "may_have"
+        self.recheck |= group
+        self.mark_dirty(0, self.bit)
+
     def update(self):
-        static = False
-        updated = False
-        while not static:
-            static = True
-            if len(self.must_have) == self.n_cards:             # If every card in Player's hand is known
-                if not self.may_have:                           # If the Player has no cards in "may_have" set
+        # Runs the rules about this player until they deduce nothing new. Only
+        # the cards that left "may_have" since the last call can make a
+        # selection group down to one card, and only the cards the groups
+        # watch are looked at for that, so an update of a player whose
+        # watched cards are all still possible does not go through the groups.
+        # return - mask of the cards this player was removed from the possible owners of since the last call - Int
+        self.save(self, 'seen_may', 'recheck')
+        start = self.seen_may
+        lost = self.recheck
+        self.recheck = 0
+        while True:
+            if self.must_have.bit_count() == self.n_cards:      # If every card in Player's hand is known
+                if not self.may_have:                           # If the Player has no cards in "may_have" mask
                     break
-                for card in self.may_have:                      # Remove this Player from the "possible_owners" list of every every card Player owns
-                    card.possible_owners.remove(self)
-                self.may_have.clear()                           # Empty the "may_have" set of this player
-                static = False
-                updated = True
-
-            if len(self.must_have) + len(self.may_have) == self.n_cards:
+                self.save(self, 'may_have')
+                for i in iter_bits(self.may_have):              # Remove this Player from the "possible_owners" mask of every every card Player owns
+                    self.save(self.cards[i], 'possible_owners')
+                    self.cards[i].possible_owners &= ~self.bit
+                self.may_have = 0                               # Empty the "may_have" mask of this player
+                self.mark_dirty(0, self.bit)
+
+            if self.may_have and self.must_have.bit_count() + self.may_have.bit_count() == self.n_cards:
                 # If this number of unknown cards in the Player's hand is equal to the number of cards that this player could possibly have (not in solution or already disproved), this Player must own all of these unknown cards
-                static = False
-                updated = True
-                for card in list(self.may_have):                # Set the owner of all of these "may_have" cards to this Player
-                    card.set_owner(self)
-
-            #filter through the sets in the selection_groups
-            new_groups = []
-            for group in self.selection_groups:
-                group1 = []
-                for card in group:
-                    if card in self.must_have:                  # Discard the sets that contain a card this Player already owns
-                        break
-                    if card in self.may_have:                   # Keep the cards in every set that have been denied or disproved
-                        group1.append(card)                     # by another player already owns
-                else:
-                    if len(group1) == 1:                        # If only 1 card remains in a set this Player must have this card
-                        group1[0].set_owner(self)
-                        updated = True
-                        static = False
-                    elif group1:                                # Otherwise keep the sets in the "selection_groups" list
-                        new_groups.append(group1)
-            self.selection_groups = new_groups
-
-            if len(self.must_have) + 1 == self.n_cards:
+                for i in iter_bits(self.may_have):              # Set the owner of all of these "may_have" cards to this Player
+                    self.cards[i].set_owner(self)
+
+            lost |= self.seen_may & ~self.may_have
+            self.seen_may = self.may_have
+            if lost & self.watched:                             # some group may have one card left
+                self.check_groups()
+
+            if self.must_have.bit_count() + 1 == self.n_cards:
                 # There is only one card remaining to for the Player to disprove, so this card must be in every selection group
-                cards = self.may_have.copy()
-                for group in self.selection_groups:         # Find the intersection between Player's "may_have" set and
-                    if self.must_have.isdisjoint(group):    # every "selection_groups" set that does
-                        cards.intersection_update(group)    # not contain a card in "must_have" set
-
-                for card in self.may_have - cards:          # Remove every other card in the Player's "may_have" set
-                    static = False
-                    updated = True
-                    self.set_have_not_card(card)
-
-        # assert self.must_have.isdisjoint(self.may_have)
-        # assert len(self.must_have | self.may_have) >= self.n_cards
-        return updated
+                cards = self.may_have
+                for group in self.selection_groups:             # Find the intersection between Player's "may_have" mask and
+                    if not group & self.must_have:              # every "selection_groups" mask that does
+                        cards &= group                          # not contain a card in "must_have" mask
+
+                for i in iter_bits(self.may_have & ~cards):     # Remove every other card in the Player's "may_have" mask
+                    self.set_have_not_card(self.cards[i])
+
+            lost = self.seen_may & ~self.may_have               # the cards the groups or the last rule removed
+            if not lost:
+                break
+
+        self.seen_may = self.may_have
+        # assert not self.must_have & self.may_have
+        # assert (self.must_have | self.may_have).bit_count() >= self.n_cards
+        return start & ~self.may_have
+
+    def check_groups(self):
+        #filter through the masks in the selection_groups
+        self.save(self, 'selection_groups', 'watched')
+        new_groups = []
+        self.watched = 0
+        for group in self.selection_groups:
+            if group & self.must_have:                          # Discard the groups that contain a card this Player already owns
+                continue
+            group &= self.may_have                              # Keep the cards in every group that have not been denied or disproved
+            if group and not group & (group - 1):               # If only 1 card remains in a group this Player must have this card
+                self.cards[group.bit_length() - 1].set_owner(self)
+            elif group:                                         # Otherwise keep the groups in the "selection_groups" list
+                new_groups.append(group)
+                low = group & -group                            # and watch two of their cards, the group can not
+                rest = group ^ low                              # get down to one card before one of them goes
+                self.watched |= low | rest & -rest
+        self.selection_groups = new_groups
 
 
 class Suggestion:
@@ -140,117 +209,317 @@ class Suggestion:
 
 
 class AI01(Player):
+    accuse_threshold = 0.35                         # accuse the most likely candidate solution when its probability is above this (None -> never guess)
+    count_exactly = True                            # count the deals of every candidate in "filter_solutions", otherwise they are sampled when needed
+    count_tries = 200000                            # steps a DealCounter may take at most (about 0.4 s, the default deck takes 50000 at most), the counts are sampled when it needs more
+    sample_time = 0.005                             # seconds the DealSampler may take to estimate the probabilities when the counts are not exact
+    plan_worlds = 0                                 # worlds the planner scores the suggestions over (0 -> suggest greedily), off by default for its cost, see planner.py
+    deck = DEFAULT_DECK                             # cards.Deck played when "reset" is not given one
+    opening_table = OPENINGS                        # openings.OpeningTable of the first state and suggestion (None -> compute them)
+    count_pool = parallelcount.from_env()           # parallelcount.CountPool to count the candidates in (None -> in this process)
+    rng = None                                      # random.Random of the planner, the sampler and the opening suggestions (None -> unseeded), seeded by tournament.py
+    count_cache = None                              # countcache.CounterCache the DealCounters are kept in across turns (None -> one of the player's own, countcache.SHARED -> shared by every player of the process)
+    move_budgets = movebudget.from_env()            # seconds every handler may take by command, see movebudget.py (None -> no limit)
+    deadline = None                                 # time.time() by which the message being handled has to be answered (None -> no limit)
+
+    def make_handlers(self):
+        handlers = super().make_handlers()
+        if self.move_budgets:
+            movebudget.install(self, handlers, self.move_budgets)
+        return handlers
+
     def prepare(self):
         self.set_verbosity(0)                       #????????????????????????????
 
-    def reset(self, player_count, player_id, card_names):
+    def reset(self, player_count, player_id, card_names, deck=None):
         #self - AI01_Player class
         #player_count - number of players in the game
         #player_id - placement of the AI in the order of players (1 is the first player to draw a card)
         #card_names - list of cards in AI01's hand - [String]
+        #deck - cards.Deck or the names of the cards of every card type, "self.deck" if None
         self.log('reset', 'id=', player_id, card_names)
         self.fail_count = 0
         self.suggest_count = 0
-        self.card_types = [CardType(i) for i in range(len(CARDS))]                  # list of all CardTypes
-        self.cards = list(itertools.chain(*(ct.cards for ct in self.card_types)))   # list of all Cards
+        self.propagation_steps = 0                                      # players and cards whose rules "update" ran
+        self.deals_tried = 0                                            # steps taken by the DealCounters of this game
+        self.count_overflows = 0                                        # counts given up on for having too many deals
+        self.cache_hits = 0                                             # DealCounters "get_counter" found in "count_cache"
+        self.cache_misses = 0                                           # and that it had to make
+        self.count_timeouts = 0                                         # counts given back unfinished at the deadline of "count_pool" or of the move
+        self.budgeted_moves = 0                                         # messages handled with a budget of "move_budgets"
+        self.move_overruns = 0                                          # and that took longer than it anyway
+        self.move_cutoffs = 0                                           # counts of "filter_solutions" cut off or put off by the deadline of the move
+        self.move_fallbacks = 0                                         # suggestions and accusations made without the planner or the probabilities for lack of time
+        deck = self.game_deck = get_deck(deck or self.deck)             # deck of this game, its tables are shared by every game played with it
+        self.card_types = [CardType(i, deck) for i in range(len(deck.categories))]     # list of all CardTypes
+        self.cards = list(itertools.chain(*(ct.cards for ct in self.card_types)))   # list of all Cards, indexed by Card.index
+        self.players = [PlayerInfo(i) for i in range(player_count)]     # list of players
+        self.trail = []                                                 # (undo function, *arguments) of every change since the first checkpoint, see "checkpoint"
+        self.checkpoints = []                                           # what "rollback" needs to go back to every open checkpoint
         for card in self.cards:     #????????
             card.log = self.log
+            card.mark_dirty = self.mark_dirty
+            card.save = self.save
+            card.players = self.players
         self.card_map = {card.name: card for card in self.cards}        # dictionary of every card with the cards name attribute as the keys and the corresponding card object as the item
         self.owned_cards = [self.card_map[name] for name in card_names] # use this dictionary to add every card in the "card_names" list of card strings to a list of card objects
-        self.players = [PlayerInfo(i) for i in range(player_count)]     # list of players
+        self.dirty_cards = 0                                            # mask of the cards that got an owner or were found in the solution since the last "filter_solutions"
+        self.dirty_players = 0                                          # mask of the ids of the players whose knowledge changed since the last "filter_solutions"
+        self.queue_cards = deck.all_cards                                    # mask of the cards whose rules "update" has to run, every card at first
+        self.queue_players = (1 << player_count) - 1                    # mask of the ids of the players whose rules "update" has to run, every player at first
         for player in self.players: #?????????
             player.log = self.log
+            player.mark_dirty = self.mark_dirty
+            player.save = self.save
+            player.cards = self.cards
         self.player = self.players[player_id]                           # assign the AI01's Player object to player attribute
-        for card in self.cards:                                         # add every Player to every Card's "possible_owners" list
-            card.possible_owners = list(self.players)
-        n_avail_cards = len(self.cards) - len(CARDS)                    # number of cards not in the solution (always 18)
+        for card in self.cards:                                         # add every Player to every Card's "possible_owners" mask
+            card.possible_owners = (1 << player_count) - 1
+        n_avail_cards = deck.n_dealt                                    # number of cards not in the solution (18 with the default deck)
         for player in self.players:
-            player.may_have = set(self.cards)                           # add every Card to every Player's "may_have" set
+            player.may_have = deck.all_cards                            # add every Card to every Player's "may_have" mask
+            player.seen_may = deck.all_cards
             player.n_cards = n_avail_cards // player_count \
                 + (player.id < n_avail_cards % player_count)            # assign the number of cards in each Player's hand according to their position in dealing order
         for card in self.owned_cards:                                   # set the AI's Player object as the owner of every Card the AI owns
             card.set_owner(self.player)
         for card in self.cards:                                         # for every card the AI does not own call the "set_have_not_card" function for the AI Player object
-            if card not in self.owned_cards:
+            if not card.bit & self.player.must_have:
                 self.player.set_have_not_card(card)
         self.suggestions = []                                           # list of suggestions the (AI/every player) has made ??????
-        self.avail_suggestions = set(itertools.product(*CARDS))         # set of tuples of every String permutation of suspect, weapon, room
-        self.possible_solutions = {                                     # dictionary with one of the tuples in "avail_suggestions" as the key and the integer 1 as the itme
-            tuple(self.get_cards_by_names(cards)): 1
-            for cards in self.avail_suggestions
-        }
+        self.avail_suggestions = set(deck.suggestions)                  # set of tuples of every String permutation of suspect, weapon, room
+        self.join = 0                                                   # mask of the cards that are in every one of the "possible_solutions"
+        self.counts_exact = self.count_exactly                          # if the items of "possible_solutions" are the exact numbers of deals
+        self.uncounted = 0                                              # number of the available cards when the deals were too many to count, 0 if they were not
+        self.type_live_count = [len(type.cards) for type in self.card_types]   # number of cards of every CardType that are in some candidate solution
+        self.in_opening = True                                          # if nothing is known but the hand, see "opening_suggestion"
+        template = self.opening_table and self.opening_table.template(deck, player_count, player_id)
+        if template and template['n_cards'][player_id] == len(self.owned_cards):
+            self.start_from(template)
+        else:
+            self.possible_solutions = dict.fromkeys(deck.solutions, 1)  # dictionary with the mask of every candidate solution as the key and the number of deals in which it is the solution as the item (counted by "filter_solutions")
+            self.solutions_by_card = [set(sols) for sols in deck.solutions_by_card]     # the candidate solutions that contain every card, indexed by Card.index - List({Int})
         self.filter_solutions()                                         # ??????
 
-    def filter_solutions(self):
-        new_solutions = {}
-        # assert self.possible_solutions
-
-        join = next(iter(self.possible_solutions))  #random key(/solution triple) from "possible_solutions" dictionary
+    def start_from(self, template):
+        # Sets the candidates and their counts from the template of the seat
+        # (see openings.py) instead of counting them, every candidate without
+        # a card of the hand has the same number of deals.
+        hand = self.player.must_have
+        count = template['deals'] if self.count_exactly else 1
+        self.possible_solutions = {sol: count for sol in self.game_deck.solutions if not sol & hand}
+        self.solutions_by_card = [{sol for sol in sols if not sol & hand} for sols in self.game_deck.solutions_by_card]
+        for type in self.card_types:
+            live = [card for card in type.cards if self.solutions_by_card[card.index]]
+            self.type_live_count[type.type_id] = len(live)
+            if len(live) == 1:
+                self.join |= live[0].bit
+        self.dirty_cards = 0                                            # what "filter_solutions" would have done with them is done
+        self.dirty_players = 0
+
+    def mark_dirty(self, cards, players):
+        # cards - mask of the cards that got an owner or were found in the solution - Int
+        # players - mask of the ids of the players whose knowledge changed - Int
+        self.dirty_cards |= cards
+        self.dirty_players |= players
+        self.queue_cards |= cards
+        self.queue_players |= players
+
+    def save(self, obj, *names):
+        # Puts the current values of the names-input attributes of obj on the
+        # undo trail, if there is a checkpoint to go back to.
+        if self.checkpoints:
+            for name in names:
+                self.trail.append((setattr, obj, name, getattr(obj, name)))
+
+    def checkpoint(self):
+        # Every change of what is known from here on can be undone by "rollback"
+        # (or kept with "commit"), checkpoints can be nested. The cost is one
+        # trail entry per change, so hypothetical messages can be tried out
+        # without copying the state:
+        #   with self.hypothetical():
+        #       self.suggestion(3, cards, 1)
+        #       ...
+        self.checkpoints.append((len(self.trail), len(self.suggestions), self.dirty_cards, self.dirty_players,
+                                 self.queue_cards, self.queue_players, self.join, list(self.type_live_count),
+                                 self.counts_exact, self.uncounted, self.in_opening))
+
+    def rollback(self):
+        # Undoes every change since the last checkpoint and drops it.
+        (n_trail, n_suggestions, self.dirty_cards, self.dirty_players,
+         self.queue_cards, self.queue_players, self.join, self.type_live_count,
+         self.counts_exact, self.uncounted, self.in_opening) = self.checkpoints.pop()
+        trail = self.trail
+        while len(trail) > n_trail:
+            undo, *args = trail.pop()
+            undo(*args)
+        del self.suggestions[n_suggestions:]
+
+    def commit(self):
+        # Keeps the changes since the last checkpoint and drops it.
+        self.checkpoints.pop()
+        if not self.checkpoints:
+            self.trail.clear()
+
+    @contextlib.contextmanager
+    def hypothetical(self):
+        # Everything done in the with block is undone at its end.
+        self.checkpoint()
+        try:
+            yield self
+        finally:
+            self.rollback()
+
+    def remove_solution(self, sol):
+        # sol - mask of the candidate solution to remove from "possible_solutions" - Int
+        count = self.possible_solutions.pop(sol, None)
+        if count is None:
+            return
+        if self.checkpoints:
+            self.trail.append((self.possible_solutions.__setitem__, sol, count))
+        for i in iter_bits(sol):
+            card = self.cards[i]
+            solutions = self.solutions_by_card[i]
+            solutions.remove(sol)
+            if self.checkpoints:
+                self.trail.append((solutions.add, sol))
+            if solutions:
+                continue
+            type_id = card.type.type_id                                         # the last candidate with "card" is gone
+            self.type_live_count[type_id] -= 1
+            if self.type_live_count[type_id] == 1:                              # only one card of the type is left in the candidates, so it is in all of them
+                self.join |= next(c.bit for c in card.type.cards if self.solutions_by_card[c.index])
 
-        for sol in self.possible_solutions:
-            for card, type in zip(sol, self.card_types):
-                if card.owner or type.solution and card is not type.solution:
-                    # This candidate can not be a solution because it has a
-                    # card that has owner or this type is solved.
-                    break
-            else:
-                count = self.check_solution(sol)
-                if count:
-                    new_solutions[sol] = count
-                    join = tuple(((x is y) and x) for x, y in zip(join, sol))   # 3-item tuple (each item corresponding to a CardType) with either a Card or False depending on whether a card in "join" intersects between all "possible_solutions"
+    def filter_solutions(self):
+        # Only the candidates with a card that got an owner or whose type got
+        # solved since the last call are removed, and the counts are redone
+        # only if what is known about some player changed.
+        dirty_cards, self.dirty_cards = self.dirty_cards, 0
+        dirty_players, self.dirty_players = self.dirty_players, 0
+
+        dead = 0                                    # mask of the cards that can no longer be in the solution
+        for i in iter_bits(dirty_cards):
+            card = self.cards[i]
+            if card.owner is not None:              # a card that has owner
+                dead |= card.bit
+            elif card.in_solution:                  # or every card of a solved type except its solution
+                dead |= card.type.mask & ~card.bit
+        for i in iter_bits(dead):
+            for sol in list(self.solutions_by_card[i]):
+                self.remove_solution(sol)
+
+        if dirty_players and self.count_exactly and self.out_of_time():     # counted in the next move
+            self.dirty_players |= dirty_players
+            self.counts_exact = False
+            self.move_cutoffs += 1
+            dirty_players = 0
+        with (self.get_counter() if dirty_players and self.count_exactly else contextlib.nullcontext()) as counter:
+            n_avail = counter.avail.bit_count() if counter else 0
+            n_tried = counter.n_tried if counter else 0                     # a counter from the cache has taken steps already
+            if counter and not (self.uncounted and n_avail >= self.uncounted):     # after too many deals, not before the owner of some card is known
+                solutions = list(self.possible_solutions)
+                try:
+                    counts = self.count_solutions(counter, solutions)
+                    self.uncounted = 0
+                except CountTooLarge:                   # too many to count, every candidate is kept
+                    counts = ()
+                    self.uncounted = n_avail
+                    self.count_overflows += 1
+                    self.log('too many deals to count')
+                except CountTimeout:                    # the deadline of the move, the counts finished by then are kept
+                    counts = counter.known_counts(solutions)
+                self.deals_tried += counter.n_tried - n_tried
+                self.counts_exact = not self.uncounted and None not in counts
+                if not self.counts_exact and counts:
+                    self.count_timeouts += 1
+                    self.log('counts cut off by the deadline')
+                    if self.out_of_time():              # of the move, the others are counted again in the next one
+                        self.dirty_players |= dirty_players
+                        self.move_cutoffs += 1
+                for sol, count in zip(solutions, counts):       # number of deals in which "sol" is the solution
+                    if count is None:                   # cut off by a deadline, kept as it was
+                        continue
+                    if count:
+                        if self.checkpoints:
+                            self.trail.append((self.possible_solutions.__setitem__, sol, self.possible_solutions[sol]))
+                        self.possible_solutions[sol] = count
+                    else:
+                        self.remove_solution(sol)
 
-        self.possible_solutions = new_solutions
         updated = False
-        for card in join:                                                       # if one of the items in the "join" tuple is not False (e.i. is a Card object) and is not already a solution, that item must be a Card in the solution
-            if card and not card.in_solution:
+        for i in iter_bits(self.join):                                          # every card in the "join" mask that is not already a solution must be a Card in the solution
+            card = self.cards[i]
+            if not card.in_solution:
                 card.set_as_solution()
                 updated = True
-                self.log('found new target', card, 'in', join)
+                self.log('found new target', card, 'in', self.get_cards_by_mask(self.join))
 
         # self.dump()
         return updated
 
-    def check_solution(self, solution):
-        """
-        This must be called after each player is updated.
-        """
-        players = self.players
-        avail_cards = set(card for card in self.cards if card.possible_owners)  # set of cards that have no known owners and are not known to be in the solution (e.i could be in the solution)
-        avail_cards -= set(solution)                                            # set of available cards assuming no one owns the solution-input cards (e.i. the solution is correct)
-        if len(avail_cards) >= 10:                                              # return 1 because solution is still possible (idk why 10 is significant)
-            return 1
-        count = 0
-
-        def resolve_player(i, avail_cards):
-            nonlocal count
-            if i == len(players):                                               # if all players have been resolved the solution-input could be correct
-                count += 1
-                return
-            player = players[i]                                                 # a Player object corresponding to the i-input integer
-            n_take = player.n_cards - len(player.must_have)                     # number of cards "player" has which are unknown
-            cards = avail_cards & player.may_have                               # the cards available to "player" assuming the solution-input is correct (avaible cards for all players - cards rejected by "player")
-            for choice in map(set, itertools.combinations(cards, n_take)):      # iterates over the permutations of "n_take" number of cards from "cards" (i.e all the permutations of unknown cards the "player" might have)
-                player_cards = player.must_have | choice                        # get the union of every permutation and the known cards of "player"
-                for group in player.selection_groups:
-                    if player_cards.isdisjoint(group):                          # if a selection group does not contain one of the cards in these permutation-intersections then the solution-input is incorrent because "player" would have to own one of the cards in the solution-input
-                        # Invalid choice
-                        break
-                else:
-                    resolve_player(i + 1, avail_cards - choice)                 # "resolve" the next player
-
-        resolve_player(0, avail_cards)                                          # start resolving players
-        return count
+    def count_solutions(self, counter, solutions):
+        # Counts the candidates in counter, or in count_pool if there is one (the steps of its workers go in deals_tried).
+        # return - the number of deals in which every candidate is the solution, None for the ones not counted - [Int]
+        if self.count_pool is None:
+            return counter.count_solutions(solutions)       # shared by every candidate, so the counts of equal sub-deals are reused
+        counts, worker_tried = self.count_pool.count_solutions(counter, *self.get_knowledge(), solutions)
+        self.deals_tried += worker_tried
+        return counts
+
+    @contextlib.contextmanager
+    def get_counter(self):
+        # yield - a DealCounter over what is currently known about every player, which may
+        # have counted the same knowledge before and may take count_tries more steps, for
+        # the with block only (the counter may be shared with other games, see countcache.py) - DealCounter
+        cache = self.count_cache
+        if cache is None:
+            cache = self.count_cache = CounterCache()
+        with cache.lend(*self.get_knowledge(), self.count_tries, self.deadline) as (counter, hit):
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+            yield counter
+
+    def get_knowledge(self):
+        # return - (n_take, may_have, selection_groups) of every player and the mask of the available cards - ([(Int, Int, [Int])], Int)
+        avail_cards = 0                                                         # mask of cards that have no known owners and are not known to be in the solution (e.i could be in the solution)
+        for player in self.players:
+            avail_cards |= player.may_have
+        return [
+            (player.n_cards - player.must_have.bit_count(),                     # number of cards "player" has which are unknown
+             player.may_have,
+             [group for group in player.selection_groups if not group & player.must_have])
+            for player in self.players
+        ], avail_cards
+
+    def out_of_time(self, margin=0):
+        # return - if the deadline of the move is less than margin seconds away - Boolean
+        return self.deadline is not None and time.time() + margin > self.deadline
+
+    def solution_probabilities(self):
+        # return - dictionary with every candidate in "possible_solutions" as the key and its probability as the item - {Int: Float}
+        solutions = list(self.possible_solutions)
+        if self.counts_exact:                                                   # the items of "possible_solutions" are the exact numbers of deals
+            weights = [self.possible_solutions[sol] for sol in solutions]
+        else:
+            sampler = DealSampler(*self.get_knowledge(), solutions, self.rng)
+            weights = sampler.estimate(time_budget=self.sample_time)
+        total = sum(weights)
+        if not total:
+            return {}
+        return {sol: weight / total for sol, weight in zip(solutions, weights)}
 
     def suggest1(self):
         choices = []
         for type in self.card_types:
             choices.append([])
             if type.solution:                                                   # if the CardType has a solution the list is extended to the cards in the player's hand that are of the CardType
-                choices[-1].extend(self.player.must_have & set(type.cards))
+                choices[-1].extend(self.get_cards_by_mask(self.player.must_have & type.mask))
             else:                                                               # otherwise the list is extended to the unknown cards of CardType ordered by the number of "possible_owners" each card has (order low to high)
                 choices[-1].extend(sorted(
                     (card for card in type.cards if card.owner is None),
-                    key=lambda card: len(card.possible_owners)))
+                    key=lambda card: card.possible_owners.bit_count()))
 
         for sgi in sorted(itertools.product(*map(lambda x:range(len(x)), choices)),
                 key=sum):
@@ -266,22 +535,61 @@ class AI01(Player):
         return sg
 
     def suggest(self):
+        self.suggest_count += 1
+        if planner is not None and self.plan_worlds:
+            # suggests what tells the most about the solution, unless nothing is expected to
+            sg = self.opening_suggestion() if self.in_opening else None
+            if sg is not None:
+                self.avail_suggestions.discard(sg)
+                return sg
+            gain = 0
+            if not self.out_of_time():
+                try:
+                    sg, gain = planner.plan(self, self.plan_worlds, self.rng)
+                except CountTimeout:
+                    sg = None
+            if sg is None:                                                      # no time to plan, suggest greedily
+                self.move_fallbacks += 1
+            elif gain > 1e-9:
+                self.avail_suggestions.discard(sg)
+                return sg
         #suggests the card from each card type with the least amount of possible owners, but no known owner
         sg = []
         for type in self.card_types:
             card = min((card for card in type.cards if card.owner is None),
-                key=lambda card: len(card.possible_owners))
+                key=lambda card: card.possible_owners.bit_count())
             sg.append(card.name)
         sg = tuple(sg)
 
         if sg not in self.avail_suggestions:
             sg = self.avail_suggestions.pop()
+            self.fail_count += 1
         else:
             self.avail_suggestions.remove(sg)
         return sg
 
-    def suggestion(self, player_id, cards, disprove_player_id=None, card=None): '''handle suggestions'''
+    def opening_suggestion(self):
+        # return - the suggestion of the opening table for the shape of the hand, None if it has none - (String)
+        if self.opening_table is None:
+            return None
+        deck = self.game_deck
+        hand = self.player.must_have
+        opening = self.opening_table.opening(deck, len(self.players), self.player.id, hand_shape(deck, hand))
+        if not opening or opening['gain'] <= 1e-9:
+            return None
+        sg = []
+        for type, own in zip(self.card_types, opening['own']):          # any card of the type from (or not from) the hand,
+            cards = self.get_cards_by_mask(type.mask & (hand if own else ~hand))   # they are all alike so far
+            if not cards:
+                return None
+            sg.append((self.rng or random).choice(cards).name)
+        sg = tuple(sg)
+        return sg if sg in self.avail_suggestions else None
+
+    def suggestion(self, player_id, cards, disprove_player_id=None, card=None):
+        '''handle suggestions'''
         #only instance of Suggestion
+        self.in_opening = False
         sg = Suggestion(
             self.players[player_id],
             self.get_cards_by_names(cards),
@@ -301,38 +609,43 @@ class AI01(Player):
                 if sg.dcard.owner is None:
                     sg.dcard.set_owner(sg.dplayer)
             else:                                                               # otherwise add a selection group of (sg.cards) to the disproving player
-                sg.dplayer.selection_groups.append(sg.cards)
-            self.possible_solutions.pop(tuple(sg.cards), None)                  # remove the (sg.cards) triple from the "possible_solutions" dictionary
+                sg.dplayer.add_selection_group(self.get_mask(sg.cards))
+            self.remove_solution(self.get_mask(sg.cards))                       # remove the (sg.cards) triple from the "possible_solutions" dictionary
 
         self.update()
 
     def update(self):
-        static = False
-        while not static:
-            static = True
-            for card in self.cards:                                             # iterate through every card
-                if card.owner is not None or card.in_solution:                  # if card has known owner or is in solution skip to next card
-                    continue
-                if len(card.possible_owners) == 0 and card.type.solution is None:   # if the card has no possible owners it must be the solution
-                    card.set_as_solution()
-                    static = False
-
-            for type in self.card_types:                                        # iterate through every cardtype
-                if type.solution is not None:                                   # if the cardType has a solution skip to next cardtype
-                    continue
-                if type.rest_count == 1:                                        # if there is only 1 unknown card of cardtype is must be the solution
-                    card = next(card for card in type.cards if card.owner is None)
-                    card.set_as_solution()
-                    static = False
-
-            for player in self.players:                                         # iterate through every player
-                if player is self.player:                                       # skip if the player is the AI
-                    continue
-                if player.update():                                             # update the player
-                    static = False
-
-            if self.filter_solutions():                                         # filter the solutions
-                static = False
+        # Runs the rules until nothing new is deduced. "mark_dirty" queues the
+        # players and the cards whose knowledge changed and only their rules
+        # are run again, the candidates are filtered once the rules are done.
+        while True:
+            if self.queue_players:                                              # the players whose masks or groups changed
+                queue, self.queue_players = self.queue_players, 0
+                self.propagation_steps += queue.bit_count()
+                for i in iter_bits(queue):
+                    player = self.players[i]
+                    if player is self.player:                                   # skip the rules if the player is the AI
+                        self.save(player, 'seen_may')
+                        self.queue_cards |= player.seen_may & ~player.may_have
+                        player.seen_may = player.may_have
+                    else:                                                       # the cards that lost a possible owner are checked next
+                        self.queue_cards |= player.update()
+
+            elif self.queue_cards:                                              # the cards that lost a possible owner or got one
+                queue, self.queue_cards = self.queue_cards, 0
+                self.propagation_steps += queue.bit_count()
+                for i in iter_bits(queue):
+                    card = self.cards[i]
+                    type = card.type
+                    if type.solution is not None:                               # if the cardType has a solution skip to next card
+                        continue
+                    if card.owner is None and not card.possible_owners:         # if the card has no possible owners it must be the solution
+                        card.set_as_solution()
+                    elif type.rest_count == 1:                                  # if there is only 1 unknown card of cardtype is must be the solution
+                        next(card for card in type.cards if card.owner is None).set_as_solution()
+
+            elif not self.filter_solutions():                                   # filter the solutions
+                break
 
     def iter_players(self, start_id, end_id):
         # start_id - id of the player after the suggestion player
@@ -348,24 +661,29 @@ class AI01(Player):
             return [type.solution.name for type in self.card_types]
         possible_solutions = self.possible_solutions
         if len(possible_solutions) == 1:                                        # if there is only 1 possible solution make an accusation of that solution
-            return next(possible_solutions.values())
-
-        # most_possible = max(self.possible_solutions, key=self.possible_solutions.get)
-        # total = sum(self.possible_solutions.values())
-        # # self.log('rate:', self.possible_solutions[most_possible] / total)
-        # if self.possible_solutions[most_possible] > 0.7 * total:
-        #     self.log('guess', most_possible)
-        #     return [card.name for card in most_possible]
+            return [card.name for card in self.get_cards_by_mask(next(iter(possible_solutions)))]
+
+        if self.accuse_threshold is not None and not self.counts_exact and self.out_of_time(self.sample_time):
+            self.move_fallbacks += 1                                            # no time to sample the probabilities, only accuse when sure
+        elif self.accuse_threshold is not None:
+            probabilities = self.solution_probabilities()
+            if probabilities:
+                most_possible = max(probabilities, key=probabilities.get)
+                self.log('rate:', probabilities[most_possible])
+                if probabilities[most_possible] > self.accuse_threshold:
+                    self.log('guess', self.get_cards_by_mask(most_possible))
+                    return [card.name for card in self.get_cards_by_mask(most_possible)]
 
         return None
 
-    def disprove(self, suggest_player_id, cards): '''handle the role to disprove'''
+    def disprove(self, suggest_player_id, cards):
+        '''handle the role to disprove'''
         # suggest_player_id - id number of the Player who made the suggestion
         # cards - list of cards in the suggestion - [Card]
         # return - "name" attribute the card the AI will use to disprove the suggestion - String
         cards = self.get_cards_by_names(cards)                          # cards in the suggestion - [Cards]
         sg_player = self.players[suggest_player_id]                     # player who made the suggestion - Player
-        cards = [card for card in cards if card in self.owned_cards]    # cards in the suggestion that the AI owns
+        cards = [card for card in cards if card.bit & self.player.must_have]    # cards in the suggestion that the AI owns
         for card in cards:                                              # if the AI has already disproved one of the cards to the player who made the suggestion, reveal that card again
             if sg_player in card.disproved_to:
                 return card.name
@@ -375,9 +693,10 @@ class AI01(Player):
         # player_id - id number of the Player who made the accusation
         # cards - list of cards in the accusation - [Card]
         # is_win - was the accusation accurate - Boolean
+        self.in_opening = False
         if not is_win:                                                  # if the accusation was incorrect
-            cards = tuple(self.get_cards_by_names(cards))
-            self.possible_solutions.pop(cards, None)                    # remove the solution from "possible_solutions" dictionary
+            cards = self.get_cards_by_names(cards)
+            self.remove_solution(self.get_mask(cards))                  # remove the solution from "possible_solutions" dictionary
 
 # NOTE: uncomment the code below so that the cards in the accusation are removed from the may_have list of the accuser
 # follows the reasonable but not 100% accurate assumption that a player would never make an accusation with cards they have in their hand
@@ -395,22 +714,51 @@ class AI01(Player):
         # names - iterable container with the names of some collection of cards - {String} or [String]
         return [self.card_map[name] for name in names]                  # return a list of the Card's correspinding to the names-input - [Card]
 
+    def get_cards_by_mask(self, mask):
+        # mask - bitmask of some collection of cards - Int
+        return [self.cards[i] for i in iter_bits(mask)]                 # return a list of the Card's whose bits are set in the mask-input - [Card]
+
+    def get_mask(self, cards):
+        # cards - iterable container with some collection of cards - [Card] or (Card)
+        mask = 0
+        for card in cards:
+            mask |= card.bit
+        return mask                                                     # return the bitmask of the cards-input - Int
+
+    def counters(self):
+        return {
+            'fail_count': self.fail_count,
+            'suggest_count': self.suggest_count,
+            'propagation_steps': self.propagation_steps,
+            'deals_tried': self.deals_tried,
+            'count_overflows': self.count_overflows,
+            'count_cache_hits': self.cache_hits,
+            'count_cache_misses': self.cache_misses,
+            'count_timeouts': self.count_timeouts,
+            'budgeted_moves': self.budgeted_moves,
+            'move_overruns': self.move_overruns,
+            'move_cutoffs': self.move_cutoffs,
+            'move_fallbacks': self.move_fallbacks,
+        }
+
     def dump(self):                                                     # a lot of logging
+        if not self._verbosity:                                         # which nobody would read
+            return
         self.log()
         for player in self.players:
             self.log('player:', player.id, player.n_cards,
-                sorted(player.must_have, key=lambda x: x.name),
-                sorted(player.may_have, key=lambda x: x.name),
+                sorted(self.get_cards_by_mask(player.must_have), key=lambda x: x.name),
+                sorted(self.get_cards_by_mask(player.may_have), key=lambda x: x.name),
                 '\n    ',
-                player.selection_groups)
+                [self.get_cards_by_mask(group) for group in player.selection_groups])
         self.log('current:', [type.solution for type in self.card_types])
         self.log('possible_solutions:', len(self.possible_solutions))
         for sol, count in self.possible_solutions.items():
-            self.log('  ', sol, count)
+            self.log('  ', self.get_cards_by_mask(sol), count)
         self.log('id|', end='')
 
         def end():
-            return ' | ' if card.name in [g[-1] for g in CARDS] else '|'
+            return ' | ' if card.name in [g[-1] for g in self.game_deck.categories] else '|'
 
         for card in self.cards:
             self.log(card.name, end=end())
@@ -419,7 +767,7 @@ class AI01(Player):
             self.log(' *'[player.id == self.player.id] + str(player.id), end='|')
             for card in self.cards:
                 self.log(
-                    ' ' + 'xo'[player in card.possible_owners or player is card.owner],
+                    ' ' + 'xo'[bool(card.possible_owners & player.bit) or player is card.owner],
                     end=end())
             self.log()
 
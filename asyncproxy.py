@@ -0,0 +1,199 @@
+"""
+asyncio runtime for playerproxy.Player.
+
+Any number of players share one event loop, each with its own connection.
+The players keep their synchronous handle_* methods and _handlers table:
+the runtime reads a message with an async messager, calls the handler and
+writes out whatever the handler sent. Handlers that do the deduction work
+can be run in an executor, so one slow update() does not hold up the
+messages of the other seats.
+
+The executor of main is a ThreadPoolExecutor, and update/filter_solutions
+are pure Python, so with the GIL the threads only interleave the seats
+(the loop gets to answer the quick commands while a long update runs) and
+do not add throughput: the seats together still use one core. A process
+pool would have to pickle the player both ways for every message. To
+use more cores, count the candidates in worker processes instead
+(PLAYER_COUNT_WORKERS, see parallelcount.py), which only ships the
+knowledge of the players and the counts.
+"""
+import asyncio
+import concurrent.futures
+
+import metrics
+import protocol2
+import transcript
+
+OFFLOAD = frozenset(('reset', 'suggestion', 'accusation'))     # handlers that run AI01.update/filter_solutions
+
+
+class AsyncMessager:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def send(self, msg):
+        raise NotImplementedError
+
+    async def recv(self):
+        raise NotImplementedError
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+class AsyncLineMessager(AsyncMessager):
+    async def send(self, msg):
+        self.writer.write(msg.encode() + b'\n')
+        await self.writer.drain()
+
+    async def recv(self):
+        line = await self.reader.readline()
+        if not line:
+            raise EOFError('connection closed by peer')
+        return line.decode().rstrip('\r\n')
+
+
+class AsyncBufMessager(AsyncMessager):
+    """
+    Newline framed like protocol.BufMessager: sent messages stay in the
+    transport buffer and are drained once before the next recv.
+    """
+
+    async def send(self, msg):
+        self.writer.write(msg.encode() + b'\n')
+
+    async def recv(self):
+        await self.writer.drain()
+        try:
+            line = await self.reader.readuntil(b'\n')
+        except asyncio.IncompleteReadError:
+            raise EOFError('connection closed by peer') from None
+        return line[:-1].decode().rstrip('\r')
+
+    async def close(self):
+        await self.writer.drain()
+        await super().close()
+
+
+class Outbox:
+    """Messager given to the player: collects what the handlers send."""
+
+    def __init__(self):
+        self.messages = []
+        self.closed = False
+
+    def send(self, msg):
+        self.messages.append(msg)
+
+    def recv(self):
+        raise RuntimeError('the asyncio runtime receives the messages')
+
+    def close(self):
+        self.closed = True
+
+
+class AsyncRuntime:
+    def __init__(self, executor=None, offload=OFFLOAD, metrics=None, transcripts=None):
+        # executor - executor to run the offload-input handlers in, None runs every handler on the loop
+        # offload - names of the commands whose handlers are run in the executor - {String}
+        # metrics - metrics.Metrics to instrument the players with, None to leave them as they are
+        # transcripts - transcript.TranscriptWriter to record the games of the players in, if any
+        self.executor = executor
+        self.offload = offload
+        self.metrics = metrics
+        self.transcripts = transcripts
+
+    async def connect(self, player_class, name, addr, messager_class=AsyncBufMessager):
+        # Connect a new player_class player named name to addr and play until done.
+        reader, writer = await asyncio.open_connection(*addr)
+        player = player_class(name)
+        if self.metrics is not None:
+            metrics.instrument(player, self.metrics)
+        if self.transcripts is not None:
+            player.transcript = self.transcripts.recorder(player)
+        await self.run(player, messager_class(reader, writer))
+
+    async def run(self, player, messager):
+        loop = asyncio.get_running_loop()
+        outbox = Outbox()
+        player.messager = outbox
+        player.send(player.hello())
+        player._quit = False
+        first = True
+        try:
+            while True:
+                for msg in outbox.messages:
+                    await messager.send(msg)
+                outbox.messages.clear()
+                if outbox.closed or player._quit:
+                    break
+                msg = await messager.recv()
+                if first and player.protocol >= 2 and msg == protocol2.ACCEPT:
+                    await self.run_v2(player, messager)
+                    break
+                first = False
+                if player.transcript is not None:
+                    player.transcript.recv(msg)
+                cmd, *args = msg.split()
+                handler = player._handlers.get(cmd)
+                if handler is None:
+                    player.log('unknown command:', cmd, 'msg:', msg)
+                    continue
+                if player._verbosity > 0:
+                    player.log('recv:[{}]'.format(msg))
+                if self.executor is not None and cmd in self.offload:
+                    await loop.run_in_executor(self.executor, handler, *args)
+                else:
+                    handler(*args)
+        finally:
+            await messager.close()
+
+    async def run_v2(self, player, messager):
+        loop = asyncio.get_running_loop()
+        session = protocol2.Session(lambda game: player, max_games=1)
+        while True:
+            try:
+                frame = await messager.recv()
+            except EOFError:
+                break
+            if self.executor is not None:   # every command of a frame is handled in one go
+                answer = await loop.run_in_executor(self.executor, session.handle, frame)
+            else:
+                answer = session.handle(frame)
+            if answer is not None:
+                await messager.send(answer)
+
+    async def serve(self, player_class, names, addr, messager_class=AsyncBufMessager):
+        # Play one game for every name in names concurrently.
+        await asyncio.gather(*(
+            self.connect(player_class, name, addr, messager_class) for name in names))
+
+
+def main(player_class, messager_class=AsyncBufMessager):
+    # python <module> name port [seats [threads]]
+    import sys
+    name = sys.argv[1]
+    port = int(sys.argv[2])
+    seats = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    threads = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    names = [name] if seats == 1 else ['{}{}'.format(name, i) for i in range(seats)]
+    executor = concurrent.futures.ThreadPoolExecutor(threads) if threads else None     # interleaves the seats, one core still (see above)
+    writer = metrics.from_env()             # PLAYER_METRICS=<prefix> times the handlers of every seat
+    transcripts = transcript.from_env()     # PLAYER_TRANSCRIPT=<path> records their games
+    runtime = AsyncRuntime(executor, metrics=writer and writer.metrics, transcripts=transcripts)
+    try:
+        asyncio.run(runtime.serve(player_class, names, ('localhost', port), messager_class))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if writer is not None:
+            writer.stop()
+        if transcripts is not None:
+            transcripts.close()
+
+
+if __name__ == '__main__':
+    from AIPlayer import AI01
+    main(AI01)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+"""
+Batched deduction over the games of many seats.
+
+A BatchSolver keeps what is known in every game it holds as NumPy arrays
+of card masks, bit i for card i as everywhere else (see cards.Deck): the
+"may" and "must" masks of every player of every game, the mask of the
+cards found in the solution, and the selection groups of every player
+padded to the same number of groups with empty masks. It runs the rules
+of PlayerInfo.update and AI01.update on all the games with new messages
+at once: every sweep is a handful of array operations over the batch,
+repeated until no game deduces anything new. The cost of a message is
+writing a few elements, the sweep is shared by every game that had one
+since the last sweep.
+
+BatchPlayer is the Player of a seat in such a solver. It only records the
+messages, the solver sweeps when a player has to decide (suggest, accuse)
+or asks for its knowledge, so in a daemon the games of every seat that got
+a message in the meantime are swept together:
+
+    python batchsolver.py name port [connections [threads]]
+
+plays the seats of daemon.py with BatchPlayers. The candidate solutions
+are not counted (that is AI01.filter_solutions), a BatchPlayer suggests
+and accuses as AI01 does without the planner and the accusation threshold.
+"""
+import threading
+
+import numpy as np
+
+from cards import DEFAULT_DECK, get_deck, iter_bits
+from playerproxy import Player
+
+if hasattr(np, 'bitwise_count'):
+    popcount = np.bitwise_count
+else:                                       # NumPy < 2.0
+    _BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(masks):
+        masks = np.ascontiguousarray(masks, dtype=np.uint64)
+        return _BYTE_COUNTS[masks.view(np.uint8)].reshape(*masks.shape, 8).sum(-1, dtype=np.uint8)
+
+
+def lowest_bit(masks):
+    return masks & (~masks + np.uint64(1))
+
+
+class BatchSolver:
+    def __init__(self, deck, player_count, capacity=64, n_groups=8):
+        self.deck = deck = get_deck(deck)
+        if len(deck.names) > 64:
+            raise ValueError('a BatchSolver holds decks of 64 cards at most')
+        self.player_count = player_count
+        sizes = [deck.n_dealt // player_count + (i < deck.n_dealt % player_count) for i in range(player_count)]
+        self.hand_sizes = np.array(sizes, dtype=np.uint8)          # number of cards of every player
+        self.type_masks = np.array(deck.type_masks, dtype=np.uint64)
+        self.all_cards = np.uint64(deck.all_cards)
+        self.may = np.zeros((capacity, player_count), dtype=np.uint64)         # cards every player may have
+        self.must = np.zeros((capacity, player_count), dtype=np.uint64)        # cards every player has
+        self.solution = np.zeros(capacity, dtype=np.uint64)                    # cards found in the solution
+        self.groups = np.zeros((capacity, player_count, n_groups), dtype=np.uint64)    # selection groups, padded with 0
+        self.n_groups = np.zeros((capacity, player_count), dtype=np.int32)     # groups of every player in "groups"
+        self.pending = np.zeros(capacity, dtype=bool)                           # the game got a message since the last sweep
+        self.free = list(range(capacity - 1, -1, -1))                           # slots of no game
+        self.lock = threading.Lock()                                            # for the seats played in threads
+        self.n_sweeps = 0
+        self.n_swept = 0                    # games swept, all sweeps together
+
+    def grow(self):
+        capacity = len(self.pending)
+        for name in ('may', 'must', 'solution', 'groups', 'n_groups', 'pending'):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+        self.free.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def add(self, player_id, hand):
+        # hand - mask of the cards of the player of the seat - Int
+        # return - the slot of the new game - Int
+        with self.lock:
+            if not self.free:
+                self.grow()
+            slot = self.free.pop()
+            self.may[slot] = self.deck.all_cards & ~hand
+            self.may[slot, player_id] = 0
+            self.must[slot] = 0
+            self.must[slot, player_id] = hand
+            self.solution[slot] = 0
+            self.groups[slot] = 0
+            self.n_groups[slot] = 0
+            self.pending[slot] = True
+            return slot
+
+    def remove(self, slot):
+        with self.lock:
+            self.pending[slot] = False
+            self.free.append(slot)
+
+    def suggestion(self, slot, seat_id, player_id, cards, disprove_player_id=None, card=0):
+        # cards - mask of the suggested cards, card - mask of the card shown to seat_id, 0 if none
+        with self.lock:
+            n = self.player_count
+            end_id = player_id if disprove_player_id is None else disprove_player_id
+            not_cards = np.uint64(self.deck.all_cards & ~cards)
+            for k in range(1, n):           # the players between the suggester and the disprover have none of the cards
+                i = (player_id + k) % n
+                if i == end_id:
+                    break
+                if i != seat_id:
+                    self.may[slot, i] &= not_cards
+            if disprove_player_id is not None:
+                if card:
+                    if not int(np.bitwise_or.reduce(self.must[slot])) & card:
+                        self.must[slot, disprove_player_id] |= np.uint64(card)
+                else:
+                    k = self.n_groups[slot, disprove_player_id]
+                    if k == self.groups.shape[2]:
+                        self.groups = np.concatenate([self.groups, np.zeros_like(self.groups)], axis=2)
+                    self.groups[slot, disprove_player_id, k] = cards
+                    self.n_groups[slot, disprove_player_id] = k + 1
+            self.pending[slot] = True
+
+    def sweep(self):
+        # Runs the rules on every pending game until none of them deduces anything new.
+        with self.lock:
+            games = np.flatnonzero(self.pending)
+            if not games.size:
+                return
+            self.pending[games] = False
+            self.n_sweeps += 1
+            self.n_swept += games.size
+            k = int(self.n_groups[games].max())
+            may, must, solution = self.propagate(
+                self.may[games], self.must[games], self.solution[games], self.groups[games, :, :k])
+            self.may[games], self.must[games], self.solution[games] = may, must, solution
+
+    def propagate(self, may, must, solution, groups):
+        # may, must - games x players masks, solution - games masks, groups - games x players x groups masks
+        # return - may, must and solution once the rules deduce nothing new
+        n_cards = self.hand_sizes
+        type_masks = self.type_masks
+        zero = np.uint64(0)
+        real = groups != 0                                          # not padding
+        has_groups = groups.shape[2] > 0
+        while True:
+            old_may, old_must, old_solution = may, must, solution
+            owned = np.bitwise_or.reduce(must, axis=1)
+            may = may & ~(owned | solution)[:, None]                # a card has one place
+            n_must = popcount(must)
+            may = np.where(n_must < n_cards, may, zero)             # every card of the hand is known
+            exact = (may != 0) & (n_must + popcount(may) == n_cards)    # the hand is every card the player may have
+            must = np.where(exact, must | may, must)
+            may = np.where(exact, zero, may)
+
+            if has_groups:
+                open_ = real & (groups & must[:, :, None] == 0)     # groups without a card of the hand
+                left = groups & may[:, :, None]
+                single = open_ & (popcount(left) == 1)              # a group down to one card
+                must = must | np.bitwise_or.reduce(np.where(single, left, zero), axis=2)
+                may = may & ~np.bitwise_or.reduce(must, axis=1)[:, None]
+                open_ = real & (groups & must[:, :, None] == 0)
+                left = groups & may[:, :, None]
+                common = np.bitwise_and.reduce(np.where(open_, left, self.all_cards), axis=2)
+                last = popcount(must) + 1 == n_cards                # one unknown card, in every open group
+                may = np.where(last, may & common, may)
+
+            owned = np.bitwise_or.reduce(must, axis=1)
+            may = may & ~owned[:, None]
+            unknown = self.all_cards & ~owned & ~solution
+            nobody = unknown & ~np.bitwise_or.reduce(may, axis=1)   # cards no player may have
+            by_type = unknown[:, None] & type_masks                 # games x types
+            found = np.where(popcount(by_type) == 1, by_type, nobody[:, None] & type_masks)
+            found = np.where(solution[:, None] & type_masks, zero, lowest_bit(found))     # one card of an unsolved type
+            solution = solution | np.bitwise_or.reduce(found, axis=1)
+            may = may & ~solution[:, None]
+
+            if (np.array_equal(may, old_may) and np.array_equal(must, old_must)
+                    and np.array_equal(solution, old_solution)):
+                return may, must, solution
+
+    def knowledge(self, slot):
+        # return - (must_have, may_have) of every player and the mask of the solution cards found - ([(Int, Int)], Int)
+        self.sweep()
+        with self.lock:
+            return ([(int(must), int(may)) for must, may in zip(self.must[slot], self.may[slot])],
+                    int(self.solution[slot]))
+
+
+SOLVERS = {}                                # (deck, player_count) -> BatchSolver of the process
+
+
+def get_solver(deck, player_count):
+    key = (deck, player_count)
+    solver = SOLVERS.get(key)
+    if solver is None:
+        solver = SOLVERS[key] = BatchSolver(deck, player_count)
+    return solver
+
+
+class BatchPlayer(Player):
+    deck = DEFAULT_DECK                     # cards.Deck played when "reset" is not given one
+    slot = None                             # of the game in "solver", None between games
+
+    def reset(self, player_count, player_id, card_names, deck=None):
+        self.done()
+        deck = self.game_deck = get_deck(deck or self.deck)
+        self.solver = get_solver(deck, player_count)
+        self.player_id = player_id
+        self.hand = deck.mask(card_names)
+        self.slot = self.solver.add(player_id, self.hand)
+        self.avail_suggestions = set(deck.suggestions)
+        self.disproved_to = {}              # card index -> ids of the players it was shown to
+
+    def suggest(self):
+        deck = self.game_deck
+        players, _ = self.knowledge()
+        owned = 0
+        for must, _ in players:
+            owned |= must
+        sg = []
+        for names, first in zip(deck.categories, deck.first_indexes):     # as AI01 without the planner
+            i = min((i for i in range(first, first + len(names)) if not owned >> i & 1),
+                    key=lambda i: sum(may >> i & 1 for _, may in players))
+            sg.append(deck.names[i])
+        sg = tuple(sg)
+        if sg not in self.avail_suggestions:
+            return self.avail_suggestions.pop()
+        self.avail_suggestions.remove(sg)
+        return sg
+
+    def suggestion(self, player_id, cards, disprove_player_id=None, card=None):
+        deck = self.game_deck
+        self.solver.suggestion(self.slot, self.player_id, player_id, deck.mask(cards),
+                               disprove_player_id, deck.mask([card]) if card else 0)
+
+    def disprove(self, suggest_player_id, cards):
+        index = self.game_deck.index
+        cards = [index[name] for name in cards if self.hand >> index[name] & 1]
+        for i in cards:                     # the card this player was shown already, or the most shown one
+            if suggest_player_id in self.disproved_to.get(i, ()):
+                break
+        else:
+            i = max(cards, key=lambda i: len(self.disproved_to.get(i, ())))
+        self.disproved_to.setdefault(i, set()).add(suggest_player_id)
+        return self.game_deck.names[i]
+
+    def accuse(self):
+        _, solution = self.knowledge()
+        if solution.bit_count() == len(self.game_deck.categories):
+            return [self.game_deck.names[i] for i in iter_bits(solution)]
+        return None
+
+    def accusation(self, player_id, cards, is_win):
+        pass
+
+    def done(self):
+        if self.slot is not None:
+            self.solver.remove(self.slot)
+            self.slot = None
+
+    def knowledge(self):
+        # return - see BatchSolver.knowledge
+        return self.solver.knowledge(self.slot)
+
+
+if __name__ == '__main__':
+    from daemon import main
+    main(BatchPlayer)
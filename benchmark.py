@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+"""
+Replay benchmark for AI01.
+
+A transcript is the exact stream of messages Player.run receives for one
+seat of one game, one message per line. Replaying it calls the same
+_handlers as a live game, without a server, and times every handler and
+the time spent inside update, filter_solutions and
+DealCounter.count_solutions (which counts all the candidates of a turn).
+
+    python benchmark.py record                      re-record transcripts/
+    python benchmark.py run [-o out.json] [files]   replay and report (.txt or transcript.py .trn files)
+    python benchmark.py run --scale                 also replay games with larger decks
+    python benchmark.py compare base.json new.json  fail on a regression
+
+Besides the recorded transcripts, `run` replays synthetic late-game
+streams in which the seat never suggests and every suggestion is disproved
+without showing it a card, which piles up selection groups and is the
+worst case for counting deals. With --scale it also replays them for more
+players and larger decks (up to 10 players and tens of thousands of
+candidate solutions), which the messages can not tell the player, so the
+player is given the deck before the replay, and reports the latencies of
+every one of these decks on its own besides the ones of all the games.
+"""
+import argparse
+import array
+import glob
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import transcript
+from cards import DEFAULT_DECK, make_deck
+from referee import Game
+
+TRANSCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'transcripts')
+SECTIONS = ('update', 'filter_solutions', 'count_solutions')
+SYNTHETIC = [(3, 0, 30), (4, 0, 40), (5, 1, 50), (6, 2, 60)]  # (player_count, seed, n_suggestions)
+SCALED = [                                  # (player_count, seed, n_suggestions, cards of every type)
+    (6, 0, 60, (9, 9, 12)),                 # 30 cards, 972 candidates
+    (8, 0, 80, (10, 10, 10, 8)),            # 38 cards, 8000 candidates
+    (10, 0, 100, (10, 10, 12, 12)),         # 44 cards, 14400 candidates
+]
+
+
+class TranscriptRecorder:
+    """
+    Stands in for a player in a referee.Game, forwarding every call to the
+    player and writing down the message the server would have sent for it.
+    """
+
+    def __init__(self, player):
+        self.player = player
+        self.messages = []
+
+    def reset(self, player_count, player_id, cards, *deck):
+        self.messages.append(' '.join(['reset', str(player_count), str(player_id), *cards]))
+        self.player.reset(player_count, player_id, cards, *deck)     # the deck is not in the message, see replay
+
+    def suggest(self):
+        self.messages.append('suggest')
+        return self.player.suggest()
+
+    def suggestion(self, player_id, cards, disprove_player_id=None, card=None):
+        self.messages.append(format_suggestion(player_id, cards, disprove_player_id, card))
+        self.player.suggestion(player_id, cards, disprove_player_id, card)
+
+    def disprove(self, suggest_player_id, cards):
+        self.messages.append(' '.join(['disprove', str(suggest_player_id), *cards]))
+        return self.player.disprove(suggest_player_id, cards)
+
+    def accuse(self):
+        self.messages.append('accuse')
+        return self.player.accuse()
+
+    def accusation(self, player_id, cards, is_win):
+        self.messages.append(' '.join(['accusation', str(player_id), *cards, '+' if is_win else '-']))
+        self.player.accusation(player_id, cards, is_win)
+
+    def done(self):
+        self.messages.append('done')
+        self.player.done()
+
+
+def format_suggestion(player_id, cards, disprove_player_id=None, card=None):
+    msg = ' '.join(['suggestion', str(player_id), *cards,
+                    '-' if disprove_player_id is None else str(disprove_player_id)])
+    return msg + ' ' + card if card else msg
+
+
+def record(player_class, player_count, seed, seat):
+    # return - the messages seat receives in the game dealt under seed - [String]
+    players = [player_class('p{}'.format(i)) for i in range(player_count)]
+    recorder = TranscriptRecorder(players[seat])
+    players[seat] = recorder
+    Game(players, seed=seed).play()
+    return recorder.messages
+
+
+def synthetic_late_game(player_count, seed, n_suggestions, seat=0, deck=DEFAULT_DECK):
+    # return - messages for seat in a game where only the other players
+    # suggest and nobody ever shows seat a card - [String]
+    rng = random.Random(seed)
+    categories = deck.categories
+    solution = [rng.choice(names) for names in categories]
+    rest = [name for names in categories for name in names if name not in solution]
+    rng.shuffle(rest)
+    hands = [set(rest[i::player_count]) for i in range(player_count)]
+    messages = [' '.join(['reset', str(player_count), str(seat), *sorted(hands[seat])])]
+    others = [i for i in range(player_count) if i != seat]
+    for k in range(n_suggestions):
+        i = others[k % len(others)]
+        cards = [rng.choice(names) for names in categories]
+        for step in range(1, player_count):
+            j = (i + step) % player_count
+            if hands[j].intersection(cards):
+                if j == seat:
+                    messages.append(' '.join(['disprove', str(i), *cards]))
+                messages.append(format_suggestion(i, cards, j))
+                break
+        else:
+            messages.append(format_suggestion(i, cards))
+        if k % len(others) == 0:                    # what seat would do on its own turns, without playing them
+            messages.append('suggest')
+            messages.append('accuse')
+    messages.append('done')
+    return messages
+
+
+class NullMessager:
+    def __init__(self, sock=None):
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+    def recv(self):
+        raise EOFError
+
+    def close(self):
+        pass
+
+
+class Timer:
+    def __init__(self):
+        self.samples = {}                   # name -> durations in nanoseconds - {String: array('q')}
+
+    def add(self, name, ns):
+        self.samples.setdefault(name, array.array('q')).append(ns)
+
+    def merge(self, other):
+        for name, samples in other.samples.items():
+            self.samples.setdefault(name, array.array('q')).extend(samples)
+
+    def report(self):
+        # return - the summaries of the handlers and of the SECTIONS - {String: {String: {String: Float}}}
+        return {
+            'handlers': {name: summarize(self.samples[name])
+                         for name in sorted(self.samples) if name.startswith('handle_')},
+            'sections': {name: summarize(self.samples[name])
+                         for name in SECTIONS if self.samples.get(name)},
+        }
+
+    def wrap(self, name, func):
+        perf_counter_ns = time.perf_counter_ns
+        add = self.samples.setdefault(name, array.array('q')).append
+
+        def timed(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add(perf_counter_ns() - start)
+        return timed
+
+
+def replay(player_class, messages, timer, deck=DEFAULT_DECK):
+    from dealcount import DealCounter
+    player = player_class('bench')
+    player.messager = NullMessager()
+    player.deck = deck                              # "reset" messages do not say which deck is played
+    for name in SECTIONS[:2]:                       # AI01 methods, timed on this instance only
+        if hasattr(player, name):
+            setattr(player, name, timer.wrap(name, getattr(player, name)))
+    count_solutions = DealCounter.count_solutions
+    DealCounter.count_solutions = timer.wrap('count_solutions', count_solutions)
+    try:
+        perf_counter_ns = time.perf_counter_ns
+        for msg in messages:
+            cmd, *args = msg.split()
+            handler = player._handlers[cmd]
+            start = perf_counter_ns()
+            handler(*args)
+            timer.add('handle_' + cmd, perf_counter_ns() - start)
+    finally:
+        DealCounter.count_solutions = count_solutions
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    n = len(samples)
+
+    def pct(p):                                 # nearest-rank percentile
+        return samples[min(n - 1, max(0, -(-p * n // 100) - 1))] / 1e6
+    return {
+        'n': n,
+        'p50_ms': pct(50),
+        'p99_ms': pct(99),
+        'max_ms': samples[-1] / 1e6,
+        'total_ms': sum(samples) / 1e6,
+    }
+
+
+def load_transcripts(paths):
+    # yield - (name, messages, deck) of every text transcript and of every
+    # game of every binary one (see transcript.py), read as they are replayed
+    for path in paths:
+        if path.endswith('.trn'):
+            reader = transcript.TranscriptReader(path)
+            try:
+                for k, game in enumerate(reader):
+                    yield '{}#{}'.format(os.path.basename(path), k), game.received(), game.deck
+            finally:
+                reader.close()
+        else:
+            with open(path) as f:
+                yield os.path.basename(path), [line.rstrip('\n') for line in f if line.strip()], DEFAULT_DECK
+
+
+def run(paths, repeat=1, synthetic=True, scale=False):
+    from AIPlayer import AI01
+    generated = []                          # (name, messages, deck) of the synthetic games
+    scaled = []                             # names of the games with larger decks, reported on their own too
+    if synthetic:
+        generated += [('synthetic-p{}-s{}-n{}'.format(*args), synthetic_late_game(*args), DEFAULT_DECK)
+                      for args in SYNTHETIC]
+    if scale:
+        for player_count, seed, n_suggestions, sizes in SCALED:
+            deck = make_deck(sizes)
+            scaled.append('synthetic-p{}-s{}-n{}-{}'.format(player_count, seed, n_suggestions, deck))
+            generated.append((scaled[-1], synthetic_late_game(player_count, seed, n_suggestions, 0, deck), deck))
+    timer = Timer()
+    game_timers = {name: Timer() for name in scaled}
+    start = time.perf_counter()
+    n_games = 0
+    for _ in range(repeat):
+        for name, messages, deck in itertools.chain(load_transcripts(paths), generated):
+            game_timer = Timer()
+            replay(AI01, messages, game_timer, deck)
+            timer.merge(game_timer)
+            if name in game_timers:
+                game_timers[name].merge(game_timer)
+            n_games += 1
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'transcripts': [os.path.basename(path) for path in paths] + [name for name, _, _ in generated],
+            'games': n_games // max(repeat, 1),
+            'repeat': repeat,
+            'seconds': time.perf_counter() - start,
+        },
+        **timer.report(),
+        'scaled': {name: game_timer.report() for name, game_timer in game_timers.items()},
+    }
+
+
+def compare(base, new, threshold, floor_ms):
+    # return - a line for every metric of new that is more than threshold
+    # times (and floor_ms more than) its value in base - [String]
+    failures = []
+    reports = [('', base, new)] + [(game + ' ', base['scaled'][game], report)
+                                   for game, report in new.get('scaled', {}).items() if game in base.get('scaled', {})]
+    for prefix, base_report, new_report in reports:
+        for group in ('handlers', 'sections'):
+            for name, stats in new_report[group].items():
+                if name not in base_report[group]:
+                    continue
+                for key in ('p50_ms', 'p99_ms', 'max_ms'):
+                    old, cur = base_report[group][name][key], stats[key]
+                    if cur > old * threshold and cur - old > floor_ms:
+                        failures.append('{}{} {}: {:.3f} -> {:.3f} ms ({:.2f}x)'.format(
+                            prefix, name, key, old, cur, cur / old if old else float('inf')))
+    return failures
+
+
+def print_report(result):
+    print('{:<24}{:>8}{:>11}{:>11}{:>11}{:>12}'.format('', 'n', 'p50 ms', 'p99 ms', 'max ms', 'total ms'))
+    for group in ('handlers', 'sections'):
+        for name, stats in result[group].items():
+            print('{:<24}{n:>8}{p50_ms:>11.3f}{p99_ms:>11.3f}{max_ms:>11.3f}{total_ms:>12.1f}'.format(name, **stats))
+    for game, report in result.get('scaled', {}).items():
+        print(game)
+        for group in ('handlers', 'sections'):
+            for name, stats in report[group].items():
+                print('  {:<22}{n:>8}{p50_ms:>11.3f}{p99_ms:>11.3f}{max_ms:>11.3f}{total_ms:>12.1f}'.format(name, **stats))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='replay benchmark for AI01')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('record', help='record the transcripts of seeded self-play games')
+    p.add_argument('--games', type=int, default=2, help='games per player count')
+    p = commands.add_parser('run', help='replay transcripts and report latencies')
+    p.add_argument('paths', nargs='*', help='transcripts to replay, .txt or .trn (default: transcripts/*.txt)')
+    p.add_argument('-o', '--output', help='write the results as JSON to this file')
+    p.add_argument('-r', '--repeat', type=int, default=1)
+    p.add_argument('--no-synthetic', dest='synthetic', action='store_false')
+    p.add_argument('--scale', action='store_true', help='also replay synthetic games with larger decks')
+    p = commands.add_parser('compare', help='exit with 1 if new is slower than base')
+    p.add_argument('base')
+    p.add_argument('new')
+    p.add_argument('-t', '--threshold', type=float, default=1.25, help='allowed slowdown factor')
+    p.add_argument('--floor-ms', type=float, default=0.05, help='ignore slowdowns smaller than this')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        from AIPlayer import AI01
+        os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+        for player_count in range(3, 7):
+            for seed in range(args.games):
+                seat = seed % player_count
+                path = os.path.join(TRANSCRIPT_DIR, 'p{}-s{}-seat{}.txt'.format(player_count, seed, seat))
+                with open(path, 'w') as f:
+                    f.writelines(msg + '\n' for msg in record(AI01, player_count, seed, seat))
+                print(path)
+    elif args.command == 'run':
+        result = run(args.paths or sorted(glob.glob(os.path.join(TRANSCRIPT_DIR, '*.txt'))),
+                     args.repeat, args.synthetic, args.scale)
+        print_report(result)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(result, f, indent=2)
+    else:
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        failures = compare(base, new, args.threshold, args.floor_ms)
+        for line in failures:
+            print('REGRESSION', line)
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
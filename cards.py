@@ -1,5 +1,127 @@
+import itertools
+import string
+
 CARDS = (
     (('Gr', 'Mu', 'Pe', 'Pl', 'Sc', 'Wh')),
     (('Ca', 'Kn', 'Pi', 'Re', 'Ro', 'Wr')),
     (('Ba', 'Bi', 'Co', 'Di', 'Ha', 'Ki', 'Li', 'Lo', 'St')),
 )
+
+
+def iter_bits(mask):
+    """Yield the index of every set bit of mask, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class Deck:
+    """
+    The cards of every card type of a game, and the tables about them that
+    do not change from game to game. Use get_deck, which builds the tables
+    of a deck once and shares them between all the games played with it.
+
+    Every card is numbered by its position in the flattened card types, so
+    any set of cards fits in one int bitmask: bit i is set <-> names[i] is
+    in it. A candidate solution is the mask of one card of every type.
+    """
+
+    def __init__(self, categories):
+        self.categories = tuple(tuple(names) for names in categories)   # names of the cards of every card type - ((String))
+        self.names = tuple(itertools.chain(*self.categories))           # name of every card by index - (String)
+        self.index = {name: i for i, name in enumerate(self.names)}     # index of every card by name - {String: Int}
+        if len(self.index) != len(self.names):
+            raise ValueError('card names are not unique')
+        self.first_indexes = tuple(itertools.accumulate(
+            (len(names) for names in self.categories), initial=0))[:-1] # index of the first card of every card type - (Int)
+        self.type_masks = tuple(                                        # mask of the cards of every card type - (Int)
+            sum(1 << self.index[name] for name in names) for names in self.categories)
+        self.all_cards = (1 << len(self.names)) - 1
+        self.n_dealt = len(self.names) - len(self.categories)           # number of cards dealt to the players
+        self._solutions = None
+        self._suggestions = None
+        self._solutions_by_card = None
+
+    def __repr__(self):
+        return 'Deck({})'.format('x'.join(str(len(names)) for names in self.categories))
+
+    def __reduce__(self):                   # pickled by its cards, the tables are shared again when unpickled
+        return get_deck, (self.categories,)
+
+    def mask(self, names):
+        """Bitmask of the cards with the given names."""
+        mask = 0
+        for name in names:
+            mask |= 1 << self.index[name]
+        return mask
+
+    @property
+    def solutions(self):
+        # mask of every possible solution, in the order of itertools.product - (Int)
+        if self._solutions is None:
+            solutions = [0]
+            for type_mask in self.type_masks:
+                bits = [1 << i for i in iter_bits(type_mask)]
+                solutions = [sol | bit for sol in solutions for bit in bits]
+            self._solutions = tuple(solutions)
+        return self._solutions
+
+    @property
+    def suggestions(self):
+        # names of the cards of every possible suggestion, in the same order as "solutions" - ((String))
+        if self._suggestions is None:
+            self._suggestions = tuple(itertools.product(*self.categories))
+        return self._suggestions
+
+    @property
+    def solutions_by_card(self):
+        # the possible solutions with every card, by card index - ((Int))
+        if self._solutions_by_card is None:
+            by_card = [[] for _ in self.names]
+            for sol in self.solutions:
+                for i in iter_bits(sol):
+                    by_card[i].append(sol)
+            self._solutions_by_card = tuple(tuple(sols) for sols in by_card)
+        return self._solutions_by_card
+
+
+_decks = {}                                 # card types -> Deck, see get_deck
+
+
+def get_deck(categories=CARDS):
+    """
+    The Deck of the names of the cards of every card type, the same object
+    for equal card types. A Deck is returned as it is.
+    """
+    if isinstance(categories, Deck):
+        return categories
+    key = tuple(tuple(names) for names in categories)
+    deck = _decks.get(key)
+    if deck is None:
+        deck = _decks[key] = Deck(key)
+    return deck
+
+
+def make_deck(sizes):
+    """
+    Deck with sizes[t] cards of card type t, named by the letter of the
+    type and a number ('A0', 'A1', ..., 'B0', ...), for larger variants.
+    """
+    return get_deck(
+        tuple('{}{}'.format(string.ascii_uppercase[t], i) for i in range(size))
+        for t, size in enumerate(sizes))
+
+
+DEFAULT_DECK = get_deck(CARDS)
+
+# The tables of the default deck, kept for the code that only plays it.
+CARD_NAMES = DEFAULT_DECK.names
+CARD_INDEX = DEFAULT_DECK.index
+TYPE_MASKS = DEFAULT_DECK.type_masks
+ALL_CARDS = DEFAULT_DECK.all_cards
+
+
+def card_mask(names):
+    """Bitmask of the cards with the given names."""
+    return DEFAULT_DECK.mask(names)
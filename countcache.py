@@ -0,0 +1,139 @@
+"""
+Cross-turn cache of DealCounters.
+
+A DealCounter only depends on what is known about the players, and the
+same knowledge comes back: the planner samples from the knowledge that
+filter_solutions just counted, a rollback (AI01.hypothetical) goes back
+to a state that was counted before, and a turn that tells nothing leaves
+the state as it was. The cache keeps the counters, with the counts and
+the memo they already have, keyed by a canonical form of the knowledge
+in which the order of the players does not matter, the masks are cut
+down to the available cards and the selection groups that another group
+of the player implies are left out, so equivalent states share a counter.
+
+The cache is bounded by the number of counters and by the number of
+states they memoize (checked whenever a counter is added), and evicts
+the least recently used counters first. One cache can be shared by the
+players of concurrent games (see AI01.count_cache), the counts are the
+same whichever game made the counter. The counters are lent: the budget
+of the borrower is set once it holds the lock of the counter, which it
+keeps until the end of the with block, so the budget, the memo and
+n_tried of a counter only change for one game at a time.
+"""
+import collections
+import contextlib
+import threading
+
+from dealcount import DealCounter
+
+
+def canonical(players, avail):
+    # players - (n_take, may_have, selection_groups) of every player, as DealCounter takes them
+    # return - (key of the knowledge, id of the player at every position of the key) - (Tuple, (Int))
+    normalized = []
+    for player_id, (n_take, may_have, groups) in enumerate(players):
+        may_have &= avail
+        groups = sorted({group & may_have for group in groups}, key=int.bit_count)
+        kept = []
+        for group in groups:                # a group with all the cards of a smaller one says nothing more
+            if not any(small & ~group == 0 for small in kept):
+                kept.append(group)
+        normalized.append(((n_take, may_have, tuple(sorted(kept))), player_id))
+    normalized.sort()
+    return (avail, tuple(p for p, _ in normalized)), tuple(player_id for _, player_id in normalized)
+
+
+class Relabeled:
+    """
+    A DealCounter made for the players in another order: the same counts,
+    and the hands "sample" draws are given back in the order of the caller.
+    """
+
+    def __init__(self, counter, order):
+        self.counter = counter
+        self.order = order                  # id of the player of every position of the counter - (Int)
+
+    def __getattr__(self, name):
+        return getattr(self.counter, name)
+
+    def __setattr__(self, name, value):
+        if name in ('counter', 'order'):
+            super().__setattr__(name, value)
+        else:
+            setattr(self.counter, name, value)
+
+    def sample(self, rest, rng):
+        hands = self.counter.sample(rest, rng)
+        if hands is None:
+            return None
+        relabeled = [0] * len(hands)
+        for position, player_id in enumerate(self.order):
+            relabeled[player_id] = hands[position]
+        return relabeled
+
+
+def counter_size(counter):
+    # return - number of the states counter memoizes - Int
+    return counter.n_visited + len(counter._by_classes) + len(counter._choices)
+
+
+class CounterCache:
+    def __init__(self, max_entries=64, max_states=500000):
+        self.max_entries = max_entries      # counters kept at most
+        self.max_states = max_states        # states memoized by all of them together at most (but for the newest)
+        self.entries = collections.OrderedDict()    # key -> DealCounter, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __reduce__(self):                   # pickled empty, see Player.__getstate__
+        return CounterCache, (self.max_entries, self.max_states)
+
+    @contextlib.contextmanager
+    def lend(self, players, avail, max_tries=None, deadline=None):
+        # Lends the DealCounter of the knowledge for the with block, no other thread uses it meanwhile.
+        # yield - the counter with a budget of max_tries more steps until the deadline,
+        #         and if it came from the cache - (DealCounter, Boolean)
+        key, order = canonical(players, avail)
+        with self.lock:
+            counter = self.entries.get(key)
+            hit = counter is not None
+            if hit:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                counter = DealCounter(list(key[1]), avail, max_tries, deadline)
+                counter.lock = threading.RLock()
+                self.misses += 1
+                self.entries[key] = counter
+                self.evict()
+        with counter.lock:
+            counter.budget(max_tries, deadline)
+            if order != tuple(range(len(order))):
+                counter = Relabeled(counter, order)
+            yield counter, hit
+
+    def evict(self):
+        total = sum(counter_size(counter) for counter in self.entries.values())
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or total > self.max_states):
+            _, counter = self.entries.popitem(last=False)
+            total -= counter_size(counter)
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'states': sum(counter_size(counter) for counter in self.entries.values()),
+            }
+
+
+SHARED = CounterCache(max_entries=1024, max_states=5000000)     # for the players that share theirs, see AI01.count_cache
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+"""
+Long-lived player daemon.
+
+Keeps a pool of persistent connections to the game server and plays any
+number of seats over each of them. Every message in either direction
+starts with the id of the seat it is for (the server picks the ids, e.g.
+'g17.2' for seat 2 of game 17):
+
+    <seat> reset 4 2 Gr Ca Ba      ->  <seat> ok
+    <seat> suggest                 ->  <seat> suggest Pl Ro Ha
+    <seat> done                    ->  <seat> dead
+
+A 'reset' for an unknown seat takes a player from the pool of finished
+ones (or makes a new one) and 'done' puts it back, so a new game costs a
+dictionary lookup instead of starting a process and connecting.
+
+A malformed message or a handler that raises is logged on stderr and the
+daemon goes on with the next message. The seats of a connection that is
+lost are dropped, the server does not finish their games.
+"""
+import asyncio
+import concurrent.futures
+import sys
+import traceback
+
+import metrics
+import transcript
+from asyncproxy import OFFLOAD, AsyncBufMessager, Outbox
+
+
+class Seat:
+    def __init__(self, player):
+        self.player = player
+        self.outbox = Outbox()
+        self.lock = asyncio.Lock()          # a seat handles one message at a time
+        player.messager = self.outbox
+
+
+class Daemon:
+    RECONNECT_DELAY = 1.0                   # seconds to wait before opening a lost connection again
+    MAX_IDLE_PLAYERS = 1024                 # finished players kept for reuse at most
+
+    def __init__(self, player_class, name, addr, n_connections=1,
+                 executor=None, offload=OFFLOAD, messager_class=AsyncBufMessager, metrics=None,
+                 transcripts=None):
+        self.player_class = player_class
+        self.name = name
+        self.addr = addr
+        self.n_connections = n_connections
+        self.executor = executor
+        self.offload = offload
+        self.messager_class = messager_class
+        self.metrics = metrics              # metrics.Metrics every new player is instrumented with, if any
+        self.transcripts = transcripts      # transcript.TranscriptWriter the games are recorded in, if any
+        self.seats = {}                     # seat id -> Seat of every game being played
+        self.idle = []                      # players of finished games, ready for the next reset
+        self.games = 0                      # number of games started
+        self.players_made = 0               # number of players made, which numbers their names
+
+    def get_seat(self, seat_id, cmd):
+        seat = self.seats.get(seat_id)
+        if seat is None:
+            if cmd != 'reset':
+                return None
+            if self.idle:
+                player = self.idle.pop()
+            else:
+                player = self.player_class('{}-{}'.format(self.name, self.players_made))
+                self.players_made += 1
+                if self.metrics is not None:
+                    metrics.instrument(player, self.metrics)
+                if self.transcripts is not None:
+                    player.transcript = self.transcripts.recorder(player)
+            seat = self.seats[seat_id] = Seat(player)
+            self.games += 1
+        return seat
+
+    def log_error(self, what, exc):
+        # The daemon has no log file of its own, its errors go to stderr.
+        print('{}: {}'.format(self.name, what), file=sys.stderr)
+        traceback.print_exception(exc, file=sys.stderr)
+
+    def task_done(self, task):
+        # Done callback of the tasks of the seats, for the errors "handle" lets through.
+        if not task.cancelled() and task.exception() is not None:
+            self.log_error('seat task failed', task.exception())
+
+    def release(self, seat_id):
+        seat = self.seats.pop(seat_id)
+        if len(self.idle) < self.MAX_IDLE_PLAYERS:
+            self.idle.append(seat.player)
+
+    async def handle(self, messager, seat_id, cmd, args, connection_seats):
+        # connection_seats - ids of the seats played over the connection of the messager - {String}
+        seat = self.get_seat(seat_id, cmd)
+        if seat is None:
+            return
+        connection_seats.add(seat_id)
+        player = seat.player
+        handler = player._handlers.get(cmd)
+        if handler is None:
+            player.log('unknown command:', cmd)
+            return
+        async with seat.lock:
+            if player.transcript is not None:
+                player.transcript.recv(' '.join([cmd, *args]))
+            try:
+                if self.executor is not None and cmd in self.offload:
+                    await asyncio.get_running_loop().run_in_executor(self.executor, handler, *args)
+                else:
+                    handler(*args)
+            except Exception as exc:        # only this seat's message is lost
+                player.log('error in', cmd, args, repr(exc))
+                self.log_error('{} {} failed'.format(seat_id, cmd), exc)
+            for msg in seat.outbox.messages:
+                await messager.send('{} {}'.format(seat_id, msg))
+            seat.outbox.messages.clear()
+            if seat.outbox.closed:          # handle_done closes the messager
+                seat.outbox.closed = False
+                self.release(seat_id)
+                connection_seats.discard(seat_id)
+
+    async def serve_connection(self, index):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(*self.addr)
+            except OSError:
+                await asyncio.sleep(self.RECONNECT_DELAY)
+                continue
+            messager = self.messager_class(reader, writer)
+            tasks = set()
+            connection_seats = set()
+            try:
+                await messager.send('{} daemon {}'.format(self.name, index))
+                while True:
+                    msg = await messager.recv()
+                    try:
+                        seat_id, cmd, *args = msg.split()
+                    except ValueError:      # blank, or a seat id alone
+                        print('{}: malformed message: {!r}'.format(self.name, msg), file=sys.stderr)
+                        continue
+                    if self.executor is None:
+                        await self.handle(messager, seat_id, cmd, args, connection_seats)
+                    else:                   # other seats go on while this one is in the executor
+                        task = asyncio.create_task(self.handle(messager, seat_id, cmd, args, connection_seats))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                        task.add_done_callback(self.task_done)
+            except (EOFError, OSError):
+                pass
+            finally:
+                for task in tasks:
+                    task.cancel()
+                for seat_id in connection_seats:    # not reused, a handler may still run in the executor
+                    self.seats.pop(seat_id, None)
+                try:
+                    await messager.close()
+                except OSError:
+                    pass
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+    async def run(self):
+        await asyncio.gather(*(self.serve_connection(i) for i in range(self.n_connections)))
+
+
+def main(player_class):
+    # python daemon.py name port [connections [threads]]
+    name = sys.argv[1]
+    port = int(sys.argv[2])
+    n_connections = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    threads = int(sys.argv[4]) if len(sys.argv) > 4 else 0
+    executor = concurrent.futures.ThreadPoolExecutor(threads) if threads else None     # interleaves the seats, one core still (see asyncproxy.py)
+    writer = metrics.from_env()             # PLAYER_METRICS=<prefix> times the handlers of every seat
+    transcripts = transcript.from_env()     # PLAYER_TRANSCRIPT=<path> records their games
+    daemon = Daemon(player_class, name, ('localhost', port), n_connections, executor,
+                    metrics=writer and writer.metrics, transcripts=transcripts)
+    try:
+        asyncio.run(daemon.run())
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if writer is not None:
+            writer.stop()
+        if transcripts is not None:
+            transcripts.close()
+
+
+if __name__ == '__main__':
+    from AIPlayer import AI01
+    main(AI01)
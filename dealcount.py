@@ -0,0 +1,356 @@
+import time
+from bisect import bisect_right
+from math import comb, factorial
+
+from cards import iter_bits
+
+CHECK_STEPS = 4096                                      # steps between two looks at the clock of a counter with a deadline
+ESTIMATE_SLACK = 1000                                   # estimate_steps over the steps a count takes, a count is not started above this times its budget
+
+
+class CountTooLarge(Exception):
+    """Raised by a DealCounter that would take more steps than its max_tries."""
+
+
+class CountTimeout(Exception):
+    """Raised by a DealCounter that is still counting at its deadline."""
+
+
+class DealCounter:
+    """
+    Counts the deals of the unknown cards that agree with what is known about
+    every player.
+
+    players - one (n_take, may_have, selection_groups) tuple per player, where
+              n_take is the number of cards of the player that are not known
+              yet, may_have the mask of cards the player may still have and
+              selection_groups the masks the player must have a card from
+    avail   - mask of the cards that have no known owner and are not known to
+              be in the solution
+
+    Cards that the same players may have and that are in the same selection
+    groups can be swapped in any deal, so they are counted together as one
+    class and a hand is a number of cards taken from every class. Counts are
+    memoized on (player, cards left in every class), which lets the counts for
+    all the candidate solutions share the work below the first player whose
+    choices differ.
+
+    The number of states grows quickly with the number of classes, which a
+    large deck with many selection groups can make too slow to count, so
+    the counts raise CountTooLarge after max_tries steps of trying hands,
+    if it is given. "budget" gives a counter that is used again (see
+    countcache.py) as many more steps, what it memoized is kept.
+
+    Before counting, count_solutions estimates the steps from the sizes of
+    the classes and the hands of the players (estimate_steps, an upper
+    bound that is tens to thousands of times the steps actually taken) and
+    raises CountTooLarge at once when it is more than ESTIMATE_SLACK times
+    the steps left, so a count that can not finish does not use up its
+    budget first.
+
+    With a deadline (a time.time() value) the counts raise CountTimeout
+    once it has passed, the clock is read every CHECK_STEPS steps. Only
+    finished counts are memoized, so whatever was counted before is kept
+    and a later count goes on from there.
+    """
+
+    def __init__(self, players, avail, max_tries=None, deadline=None):
+        self.avail = avail
+        self.max_tries = float('inf') if max_tries is None else max_tries
+        self.deadline = deadline                        # time.time() after which CountTimeout is raised, None -> no limit
+        self.n_tried = 0                                # number of steps taken to try the hands of the players, see _count
+        self.limit = self.max_tries                     # n_tried above which CountTooLarge is raised
+        self.possible = True                            # False if no deal at all can agree with the players
+        constrained = []
+        free_takes = []
+        self.n_players = len(players)
+        self.free_ids = []                              # ids of the players who may have any of the available cards
+        for player_id, (n_take, may_have, groups) in enumerate(players):
+            may_have &= avail
+            groups = tuple(group & may_have for group in groups)
+            if n_take < 0 or n_take > may_have.bit_count() or not all(groups):
+                self.possible = False
+            elif n_take == 0:
+                if groups:                              # a full hand without a card of a selection group
+                    self.possible = False
+            elif groups or may_have != avail:
+                constrained.append((n_take, may_have, groups, player_id))
+            else:                                       # the player may have any of the available cards
+                free_takes.append(n_take)
+                self.free_ids.append(player_id)
+
+        # split the available cards into classes of swappable cards
+        all_groups = [group for _, _, groups, _ in constrained for group in groups]
+        class_ids = {}
+        self.class_masks = []                           # mask of the cards of every class - List(Int)
+        for i in iter_bits(avail):
+            bit = 1 << i
+            key = (tuple(bool(may_have & bit) for _, may_have, _, _ in constrained),
+                   tuple(bool(group & bit) for group in all_groups))
+            if key not in class_ids:
+                class_ids[key] = len(self.class_masks)
+                self.class_masks.append(0)
+            self.class_masks[class_ids[key]] |= bit
+
+        self.class_key = {                              # bit of a card -> its key, see count_solutions
+            1 << i: 1 << (c * 8) for c, class_mask in enumerate(self.class_masks) for i in iter_bits(class_mask)}
+        self.class_sizes = tuple(class_mask.bit_count() for class_mask in self.class_masks)
+        self._by_classes = {}                           # key of the classes of a solution -> count, see count_solution
+
+        def classes_of(mask):                           # mask of the ids of the classes with cards in the mask-input
+            return sum(1 << c for c, class_mask in enumerate(self.class_masks) if class_mask & mask)
+
+        # Resolve the most constrained players first so bad choices are cut
+        # off early, the players without constraints are counted in closed
+        # form once every constrained player has taken their cards.
+        constrained.sort(key=lambda p: (p[1].bit_count() - p[0], -len(p[2])))
+        self.players = [
+            (n_take, list(iter_bits(classes_of(may_have))), tuple(classes_of(group) for group in groups))
+            for n_take, may_have, groups, _ in constrained
+        ]
+        self.player_ids = [player_id for _, _, _, player_id in constrained]
+        self.free_takes = free_takes
+        self._choices = {}                              # (player, cards left) -> hands to sample from, see sample()
+        self.free_take = sum(free_takes)
+        self.free_count = factorial(self.free_take)     # multinomial coefficient of dealing to the free players
+        for n_take in free_takes:
+            self.free_count //= factorial(n_take)
+
+        n = len(constrained)
+        all_classes = (1 << len(self.class_masks)) - 1
+        self.suffix_take = [self.free_take] * (n + 1)   # number of cards players i.. still have to take
+        self.suffix_classes = [all_classes if free_takes else 0] * (n + 1)  # mask of classes players i.. may take from
+        self.suffix_groups = [()] * (n + 1)             # selection groups of players i..
+        for i in range(n - 1, -1, -1):
+            n_take, classes, groups = self.players[i]
+            self.suffix_take[i] = self.suffix_take[i + 1] + n_take
+            self.suffix_classes[i] = self.suffix_classes[i + 1] | sum(1 << c for c in classes)
+            self.suffix_groups[i] = groups + self.suffix_groups[i + 1]
+        self._memo = [{} for _ in range(n)]
+        self.n_visited = 0                              # number of (player, cards left) states counted
+        self._estimate = None                           # estimate_steps, once it is asked for
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @limit.setter
+    def limit(self, limit):
+        self._limit = limit
+        self._stop = limit if self.deadline is None else min(limit, self.n_tried + CHECK_STEPS)     # n_tried at which "check_stop" is called
+
+    def budget(self, max_tries, deadline=None):
+        # Allows max_tries more steps from now on (None -> no limit), until the deadline if one is given.
+        self.deadline = deadline
+        self.limit = float('inf') if max_tries is None else self.n_tried + max_tries
+
+    def check_stop(self):
+        # Called when n_tried passes _stop, which is at most CHECK_STEPS steps away when there is a deadline.
+        if self.n_tried > self._limit:
+            raise CountTooLarge(self.n_tried)
+        if time.time() > self.deadline:
+            raise CountTimeout(self.n_tried)
+        self._stop = min(self._limit, self.n_tried + CHECK_STEPS)
+
+    def estimate_steps(self):
+        # return - an upper bound of the steps of counting the deals of every available card, see _count - Int
+        if self._estimate is None:
+            sizes = self.class_sizes
+            states = 1                                  # (cards left in every class) player i can start from, at most
+            steps = 0
+            for i, (n_take, classes, _) in enumerate(self.players):
+                ways = [1] + [0] * n_take               # ways[t] - hands of t cards from the classes so far
+                nodes = 1                               # calls of "take" for one state
+                for c in classes:
+                    new = [0] * (n_take + 1)
+                    for t, n in enumerate(ways):
+                        if n:
+                            for x in range(min(sizes[c], n_take - t) + 1):
+                                new[t + x] += n
+                    ways = new
+                    nodes += sum(ways)
+                steps += states * nodes
+                n_left = 1                              # every number of cards left in the classes of the players after i
+                for c, size in enumerate(sizes):
+                    if self.suffix_classes[i + 1] >> c & 1:
+                        n_left *= size + 1
+                states = min(states * max(ways[n_take], 1), n_left)
+            self._estimate = steps
+        return self._estimate
+
+    def count(self, rest):
+        """
+        Number of deals of the rest-input mask of cards to the players, every
+        card of rest must be dealt.
+        """
+        if not self.possible or rest & ~self.avail:     # nobody can take a card outside of avail
+            return 0
+        return self._count(0, tuple((rest & class_mask).bit_count() for class_mask in self.class_masks))
+
+    def count_solution(self, solution):
+        """
+        Number of deals of the available cards when the solution-input mask
+        is the solution.
+        """
+        return self.count_solutions((solution,))[0]
+
+    def count_solutions(self, solutions):
+        # solutions - masks of candidate solutions - [Int]
+        # return - count_solution of every solution - [Int]
+        # The count only depends on how many cards of the solution are in
+        # every class, which is looked up by a key with 8 bits per class (a
+        # solution has less than 256 cards), so the thousands of candidates
+        # of a large deck are cheap to count again.
+        if not self.possible:
+            return [0] * len(solutions)
+        if self.estimate_steps() > ESTIMATE_SLACK * (self._limit - self.n_tried):
+            raise CountTooLarge(self.n_tried)
+        by_classes = self._by_classes
+        counts = []
+        for key in self.solution_keys(solutions):
+            count = by_classes.get(key)
+            if count is None:
+                left = tuple(size - (key >> (c * 8) & 255) for c, size in enumerate(self.class_sizes))
+                count = by_classes[key] = self._count(0, left)
+            counts.append(count)
+        return counts
+
+    def known_counts(self, solutions):
+        # return - count_solutions of the solutions counted already, None for the others - [Int]
+        if not self.possible:
+            return [0] * len(solutions)
+        by_classes = self._by_classes
+        return [by_classes.get(key) for key in self.solution_keys(solutions)]
+
+    def solution_keys(self, solutions):
+        # return - the key of the classes of every solution, the solutions with the same key have the same count - [Int]
+        class_key = self.class_key
+        avail = self.avail
+        keys = []
+        for solution in solutions:
+            cards = solution & avail
+            key = 0
+            while cards:
+                bit = cards & -cards
+                key += class_key[bit]
+                cards ^= bit
+            keys.append(key)
+        return keys
+
+    def sample(self, rest, rng):
+        """
+        Draw one of the deals of the rest-input mask of cards, every deal
+        with the same probability.
+        rng - random.Random to draw with
+        return - mask of the cards of every player by id, None if there is no deal - [Int]
+        """
+        if not self.count(rest):
+            return None
+        hands = [0] * self.n_players
+        class_cards = [list(iter_bits(rest & class_mask)) for class_mask in self.class_masks]
+        left = tuple(len(cards) for cards in class_cards)
+        for i, player_id in enumerate(self.player_ids):
+            choices = self._choices.get((i, left))
+            if choices is None:
+                choices = self._choices[i, left] = self._list_choices(i, left)
+            cum_counts, takes = choices
+            x = rng.random() * cum_counts[-1]
+            take = takes[bisect_right(cum_counts, x)]
+            for c, n_take in enumerate(take):           # which cards of a class does not matter, pick at random
+                if n_take:
+                    cards = class_cards[c]
+                    rng.shuffle(cards)
+                    for j in cards[:n_take]:
+                        hands[player_id] |= 1 << j
+                    del cards[:n_take]
+            left = tuple(n_left - n_take for n_left, n_take in zip(left, take))
+        cards = [j for class_ in class_cards for j in class_]
+        rng.shuffle(cards)
+        start = 0
+        for player_id, n_take in zip(self.free_ids, self.free_takes):
+            for j in cards[start:start + n_take]:
+                hands[player_id] |= 1 << j
+            start += n_take
+        return hands
+
+    def _list_choices(self, i, left):
+        # return - (running total of the number of deals, cards taken from every class) of every hand player i can take - ([Int], [(Int)])
+        n_take, classes, groups = self.players[i]
+        rest = list(left)
+        taken = [0] * len(left)
+        cum_counts = []
+        takes = []
+
+        def take(k, n_take, weight, taken_classes):
+            if n_take == 0:
+                for group in groups:
+                    if not group & taken_classes:
+                        return
+                count = weight * self._count(i + 1, tuple(rest))
+                if count:
+                    cum_counts.append((cum_counts[-1] if cum_counts else 0) + count)
+                    takes.append(tuple(taken))
+                return
+            if k == len(classes):
+                return
+            c = classes[k]
+            n_left = rest[c]
+            for x in range(min(n_left, n_take), -1, -1):
+                rest[c] = n_left - x
+                taken[c] = x
+                take(k + 1, n_take - x, weight * comb(n_left, x), taken_classes | (1 << c if x else 0))
+            rest[c] = n_left
+            taken[c] = 0
+
+        take(0, n_take, 1, 0)
+        return cum_counts, takes
+
+    def _count(self, i, left):
+        # i - index of the next player in self.players to take cards
+        # left - number of cards left in every class - (Int)
+        if sum(left) != self.suffix_take[i]:
+            return 0                                    # some card would be left over
+        if i == len(self.players):
+            return self.free_count
+        memo = self._memo[i]
+        count = memo.get(left)
+        if count is not None:
+            return count
+        self.n_visited += 1
+        nonempty = sum(1 << c for c, n_left in enumerate(left) if n_left)
+        if nonempty & ~self.suffix_classes[i]:          # nobody is left to take some card
+            memo[left] = 0
+            return 0
+        for group in self.suffix_groups[i]:             # a later player can not get a card of one of their groups
+            if not group & nonempty:
+                memo[left] = 0
+                return 0
+
+        n_take, classes, groups = self.players[i]
+        rest = list(left)
+        count = 0
+
+        def take(k, n_take, weight, taken):
+            # take n_take more cards from the classes k.. of the player
+            nonlocal count
+            self.n_tried += 1
+            if self.n_tried > self._stop:
+                self.check_stop()
+            if n_take == 0:
+                for group in groups:
+                    if not group & taken:               # the player has none of the cards of the group
+                        return
+                count += weight * self._count(i + 1, tuple(rest))
+                return
+            if sum(rest[c] for c in classes[k:]) < n_take:
+                return
+            c = classes[k]
+            n_left = rest[c]
+            for x in range(min(n_left, n_take), -1, -1):
+                rest[c] = n_left - x
+                take(k + 1, n_take - x, weight * comb(n_left, x), taken | (1 << c if x else 0))
+            rest[c] = n_left
+
+        take(0, n_take, 1, 0)
+        memo[left] = count
+        return count
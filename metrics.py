@@ -0,0 +1,286 @@
+"""
+Counters, latency histograms and a trace of events for the players.
+
+Nothing is measured until a player is instrumented: instrument(player)
+puts timed wrappers of its handlers and of update/filter_solutions/
+count_solutions (the counting of the candidates, in a DealCounter or
+the count_pool) on the instance, and uninstrument(player) takes them off
+again, so a player that is not instrumented runs its own methods without
+any check. The counters AI01 keeps anyway (fail_count, suggest_count,
+propagation steps, deals tried by the DealCounters) are plain ints on the
+player, added to the metrics when its game is done.
+
+Every timed call is also an event in a bounded ring buffer while tracing
+is on (the oldest events are dropped when it is full), and a TraceWriter
+thread writes the buffer out in bulk as JSON lines, off the hot path.
+
+The entry points (playerproxy.main, asyncproxy.main, daemon.main) turn
+all of this on when the PLAYER_METRICS environment variable is set to a
+path prefix, and then a running bot answers to
+
+    kill -USR1 <pid>    write a snapshot of the metrics to <prefix>.metrics.json
+    kill -USR2 <pid>    start profiling, the next time stop and write <prefix>.prof
+
+The snapshot takes the lock of the metrics, which the thread the signal
+interrupts may hold, so the signal handler only asks the TraceWriter for
+it and the snapshot is written at the next flush (within a second).
+"""
+import collections
+import cProfile
+import json
+import os
+import signal
+import threading
+import time
+
+SECTIONS = ('update', 'filter_solutions', 'count_solutions')     # AI01 methods timed besides the handlers
+ENV_VAR = 'PLAYER_METRICS'
+
+
+class Histogram:
+    """
+    Latencies in nanoseconds, counted in power of two buckets: bucket b
+    holds the latencies below 2**b ns and not below 2**(b - 1) ns.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * 64
+        self.total = 0                      # sum of the latencies - Int (ns)
+        self.max = 0
+
+    @property
+    def count(self):
+        return sum(self.buckets)
+
+    def add(self, ns):
+        self.buckets[ns.bit_length()] += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def percentile(self, p):
+        # return - upper bound of the bucket of the p-th percentile latency - Int (ns)
+        rank = -(-p * self.count // 100)
+        seen = 0
+        for b, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(1 << b, self.max)
+        return self.max
+
+    def summary(self):
+        n = self.count
+        return {
+            'n': n,
+            'mean_ms': self.total / n / 1e6 if n else 0.0,
+            'p50_ms': self.percentile(50) / 1e6,
+            'p99_ms': self.percentile(99) / 1e6,
+            'max_ms': self.max / 1e6,
+        }
+
+
+class Metrics:
+    """
+    The updates take no lock, they are a few hundred ns on the path of
+    every message. When handlers run in the threads of an executor (see
+    daemon.py) the GIL can switch threads in the middle of one, so a count
+    may rarely be lost there; the events themselves never are, appending
+    to a deque is atomic.
+    """
+
+    def __init__(self, ring_size=1 << 16):
+        self.counters = {}                  # name -> total - {String: Int}
+        self.histograms = {}                # name -> Histogram of its latencies
+        self.events = collections.deque(maxlen=ring_size)   # (perf_counter_ns, *fields) of the latest events
+        self.n_events = 0                   # events put in the ring buffer, written or not
+        self.n_written = 0                  # events taken out of it by "drain"
+        self.tracing = True                 # if the timed calls are put in the ring buffer
+        self.clock_offset = time.time_ns() - time.perf_counter_ns()     # perf_counter_ns -> time_ns
+        self.lock = threading.Lock()        # only for new histograms and snapshots
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def histogram(self, name):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            return histogram
+
+    def observe(self, name, ns):
+        self.histogram(name).add(ns)
+
+    def event(self, *fields):
+        if self.tracing:
+            self.events.append((time.perf_counter_ns(), *fields))
+            self.n_events += 1
+
+    def drain(self):
+        # return - the events in the ring buffer, which is left empty - [Tuple]
+        events = []
+        pop = self.events.popleft
+        try:
+            while True:
+                events.append(pop())
+        except IndexError:
+            pass
+        self.n_written += len(events)
+        offset = self.clock_offset
+        return [(t + offset, *fields) for t, *fields in events]
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'time': time.time(),
+                'tracing': self.tracing,
+                'counters': dict(self.counters),
+                'histograms': {name: h.summary() for name, h in sorted(self.histograms.items())},
+                'events': {
+                    'recorded': self.n_events,
+                    'written': self.n_written,
+                    'buffered': len(self.events),
+                    'dropped': self.n_events - self.n_written - len(self.events),
+                },
+            }
+
+
+METRICS = Metrics()                         # shared by every player of the process unless told otherwise
+
+
+def timed(metrics, name, func, player_name):
+    perf_counter_ns = time.perf_counter_ns
+    add = metrics.histogram(name).add
+    append = metrics.events.append
+
+    def wrapper(*args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            ns = perf_counter_ns() - start
+            add(ns)
+            if metrics.tracing:
+                append((start, player_name, name, ns))
+                metrics.n_events += 1
+    return wrapper
+
+
+def instrument(player, metrics=METRICS):
+    # Times the handlers and SECTIONS of player, until "uninstrument".
+    if '_plain_handlers' in vars(player):
+        return
+    player._plain_handlers = dict(player._handlers)
+    for cmd, handler in player._plain_handlers.items():
+        player._handlers[cmd] = timed(metrics, 'handle_' + cmd, handler, player.name)
+    done = player._handlers['done']
+
+    def handle_done(*args):                 # the counters of the game go in once it is over
+        try:
+            return done(*args)
+        finally:
+            metrics.count('games')
+            for name, n in player.counters().items():
+                metrics.count(name, n)
+    player._handlers['done'] = handle_done
+    for name in SECTIONS:
+        if hasattr(player, name):
+            setattr(player, name, timed(metrics, name, getattr(player, name), player.name))
+
+
+def uninstrument(player):
+    plain = vars(player).pop('_plain_handlers', None)
+    if plain is None:
+        return
+    player._handlers.update(plain)
+    for name in SECTIONS:
+        vars(player).pop(name, None)
+
+
+def write_snapshot(path, metrics=METRICS):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(metrics.snapshot(), f, indent=2)
+    os.replace(tmp, path)                   # a reader never sees half a snapshot
+
+
+class TraceWriter(threading.Thread):
+    """
+    Writes the events of the ring buffer to path every interval seconds, as
+    one JSON list per line: [time ns, player, handler or section, ns], a
+    snapshot to snapshot_path (if any) at the flush after request_snapshot
+    and a last one when it is stopped.
+    """
+
+    def __init__(self, path, metrics=METRICS, interval=1.0, snapshot_path=None):
+        super().__init__(name='trace-writer', daemon=True)
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.metrics = metrics
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.snapshot_requested = False     # set by request_snapshot, which a signal handler may call
+
+    def run(self):
+        with open(self.path, 'a') as f:
+            while not self.stopped.wait(self.interval):
+                self.flush(f)
+            self.flush(f)
+
+    def request_snapshot(self):
+        # Takes no lock, so it is safe in a signal handler.
+        self.snapshot_requested = True
+
+    def flush(self, f):
+        events = self.metrics.drain()
+        if events:
+            f.write(''.join(json.dumps(e) + '\n' for e in events))
+            f.flush()
+        if self.snapshot_requested and self.snapshot_path:
+            self.snapshot_requested = False
+            write_snapshot(self.snapshot_path, self.metrics)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        if self.snapshot_path:
+            write_snapshot(self.snapshot_path, self.metrics)
+
+
+class Profiler:
+    """Toggles a cProfile.Profile of the thread that calls "toggle"."""
+
+    def __init__(self, path):
+        self.path = path
+        self.profile = None
+
+    def toggle(self):
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        else:
+            self.profile.disable()
+            self.profile.dump_stats(self.path)
+            self.profile = None
+
+
+def install_signals(prefix, writer):
+    # SIGUSR1 -> writer.request_snapshot, SIGUSR2 -> Profiler.toggle, where there are such signals
+    if not hasattr(signal, 'SIGUSR1'):
+        return None
+    profiler = Profiler(prefix + '.prof')
+    signal.signal(signal.SIGUSR1, lambda signum, frame: writer.request_snapshot())
+    signal.signal(signal.SIGUSR2, lambda signum, frame: profiler.toggle())
+    return profiler
+
+
+def from_env(metrics=METRICS):
+    # Starts a TraceWriter and installs the signals when PLAYER_METRICS is set.
+    # return - the started TraceWriter, None if the players are not to be instrumented - TraceWriter
+    prefix = os.environ.get(ENV_VAR)
+    if not prefix:
+        return None
+    writer = TraceWriter(prefix + '.trace.jsonl', metrics, snapshot_path=prefix + '.metrics.json')
+    install_signals(prefix, writer)
+    writer.start()
+    return writer
@@ -0,0 +1,66 @@
+"""
+Time budgets of the moves of a player.
+
+The server gives a seat a limited time to answer, and late in a game the
+counts of the candidates can take longer than that. A handler with a
+budget sets the "deadline" of the player to time.time() + budget while it
+runs, and AI01 keeps to it:
+
+- its DealCounters stop counting at the deadline (dealcount.CountTimeout),
+  filter_solutions keeps the counts finished by then and the candidates
+  they removed, the other candidates keep their old counts, which are no
+  longer exact (counts_exact), and are counted again in the next move;
+- suggest falls back from the planner to the greedy suggestion and accuse
+  only accuses when the solution is certain once the time is up.
+
+The rules of "update" are not cut off, they only deduce what is sure and
+are quick, so a move can still take a bit longer than its budget.
+
+    PLAYER_MOVE_BUDGET=<seconds>                        budget of every handler
+    PLAYER_MOVE_BUDGET=suggest=0.5,accuse=0.2,*=1       by command, * for the commands not given
+
+The player counts its moves with a budget, the moves that took longer
+anyway, the counts cut off and the moves that fell back to a heuristic,
+all of them counters of the game (see metrics.py).
+"""
+import os
+import time
+
+ENV_VAR = 'PLAYER_MOVE_BUDGET'
+
+
+def parse(text):
+    # return - seconds of every command, '*' for the commands not given - {String: Float}
+    budgets = {}
+    for item in text.split(','):
+        cmd, sep, seconds = item.strip().rpartition('=')
+        budgets[cmd if sep else '*'] = float(seconds)
+    return budgets
+
+
+def budgeted(player, handler, seconds):
+    # return - the handler with player.deadline set while it runs and its overruns counted
+    def wrapper(*args):
+        player.deadline = time.time() + seconds
+        try:
+            return handler(*args)
+        finally:
+            player.budgeted_moves += 1      # after the handler, "reset" sets the counters to 0
+            if time.time() > player.deadline:
+                player.move_overruns += 1
+            player.deadline = None
+    return wrapper
+
+
+def install(player, handlers, budgets):
+    # Puts the budgets on the handlers of player, by command.
+    for cmd, handler in handlers.items():
+        seconds = budgets.get(cmd, budgets.get('*'))
+        if seconds is not None:
+            handlers[cmd] = budgeted(player, handler, seconds)
+
+
+def from_env():
+    # return - the budgets PLAYER_MOVE_BUDGET sets, None if it is not set - {String: Float}
+    text = os.environ.get(ENV_VAR)
+    return parse(text) if text else None
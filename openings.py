@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Precomputed opening table.
+
+Until the first suggestion of a game all that a player knows is its own
+hand, and the cards of a card type are all alike but for being in the
+hand or not. So the state after "reset" is the same for every hand of a
+seat but for the names of the cards: the same number of deals for every
+candidate solution without a card of the hand (the template of the seat),
+and the best first suggestion only depends on how many cards of every
+type the hand has (its shape). For every type it is either a card of the
+hand or one that is not, which is all the table keeps.
+
+The table is a JSON file, made by
+
+    python openings.py build [-o openings.json] [--worlds N] [--deck 6x6x9] [--players 3-6]
+
+and read the first time a player asks for it. It is keyed by the number
+of cards of every type (the names do not matter), and ignored altogether
+when its VERSION is not this one, so the players compute what it misses.
+"""
+import argparse
+import json
+import math
+import os
+
+from cards import DEFAULT_DECK
+
+VERSION = 1                                 # bump when a change of the planner changes the best openings
+PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openings.json')
+
+
+def deck_key(deck):
+    return 'x'.join(str(len(names)) for names in deck.categories)
+
+
+def hand_shape(deck, hand):
+    # hand - mask of the cards of the hand - Int
+    # return - number of cards of the hand of every card type - (Int)
+    return tuple((hand & mask).bit_count() for mask in deck.type_masks)
+
+
+def hand_sizes(deck, player_count):
+    # return - number of cards dealt to every player, in dealing order - [Int]
+    n = deck.n_dealt
+    return [n // player_count + (i < n % player_count) for i in range(player_count)]
+
+
+def make_template(deck, player_count, player_id):
+    # return - the number of cards of every player, and of deals in which any
+    # one candidate solution without a card of the hand is the solution - {String: ...}
+    sizes = hand_sizes(deck, player_count)
+    deals = math.factorial(deck.n_dealt - sizes[player_id])
+    for i, size in enumerate(sizes):
+        if i != player_id:
+            deals //= math.factorial(size)
+    return {'n_cards': sizes, 'deals': deals}
+
+
+class OpeningTable:
+    def __init__(self, path=PATH):
+        self.path = path
+        self.decks = None                   # deck_key -> {'templates': ..., 'openings': ...} read from path
+        self.templates = {}                 # (deck, player_count, player_id) -> template, including the computed ones
+
+    def load(self):
+        self.decks = {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == VERSION:
+            self.decks = data.get('decks', {})
+
+    def template(self, deck, player_count, player_id):
+        # return - the template of the seat, see make_template - {String: ...}
+        key = (deck, player_count, player_id)
+        template = self.templates.get(key)
+        if template is None:
+            if self.decks is None:
+                self.load()
+            table = self.decks.get(deck_key(deck), {}).get('templates', {})
+            template = table.get('{}:{}'.format(player_count, player_id)) \
+                or make_template(deck, player_count, player_id)
+            self.templates[key] = template
+        return template
+
+    def opening(self, deck, player_count, player_id, shape):
+        # return - {'own': if the card of every type is from the hand, 'gain': bits}, None if it is not in the table
+        if self.decks is None:
+            self.load()
+        table = self.decks.get(deck_key(deck), {}).get('openings', {})
+        return table.get('{}:{}:{}'.format(player_count, player_id, ','.join(map(str, shape))))
+
+
+OPENINGS = OpeningTable()                   # shared by every player of the process
+
+
+def shapes(deck, size):
+    # yield - every hand shape of size cards, in which every type keeps a card out of the hand
+    def rec(t, left):
+        if t == len(deck.categories):
+            if not left:
+                yield ()
+            return
+        for n in range(min(left, len(deck.categories[t]) - 1) + 1):
+            for rest in rec(t + 1, left - n):
+                yield (n, *rest)
+    yield from rec(0, size)
+
+
+def best_opening(deck, player_count, player_id, shape, n_worlds, rng):
+    # return - the opening of a hand of shape, as OpeningTable.opening - {String: ...}
+    import numpy as np
+    import planner
+    from AIPlayer import AI01
+    hand = [names[i] for names, n in zip(deck.categories, shape) for i in range(n)]
+    ai = AI01('build')
+    ai.reset(player_count, player_id, hand, deck)
+    owners, world_solutions, weights = planner.sample_worlds(ai, n_worlds, rng)
+    scores = planner.score_suggestions(owners, world_solutions, weights, player_id, player_count, deck)
+    # All the suggestions with the same pattern of own and other cards are
+    # worth the same, their mean score is a better estimate than any one.
+    patterns = np.array([[name in hand for name in sg] for sg in deck.suggestions])
+    keys = patterns @ (1 << np.arange(len(deck.categories)))
+    means = np.bincount(keys, scores) / np.maximum(np.bincount(keys), 1)
+    best = int(means.argmax())
+    return {'own': [bool(best >> t & 1) for t in range(len(deck.categories))], 'gain': float(means[best])}
+
+
+def build(deck, player_counts, n_worlds, seed=0):
+    import random
+    rng = random.Random(seed)
+    templates, openings = {}, {}
+    for player_count in player_counts:
+        for player_id in range(player_count):
+            templates['{}:{}'.format(player_count, player_id)] = make_template(deck, player_count, player_id)
+            size = hand_sizes(deck, player_count)[player_id]
+            for shape in shapes(deck, size):
+                key = '{}:{}:{}'.format(player_count, player_id, ','.join(map(str, shape)))
+                openings[key] = best_opening(deck, player_count, player_id, shape, n_worlds, rng)
+    return {'templates': templates, 'openings': openings}
+
+
+def main():
+    from referee import parse_deck
+    parser = argparse.ArgumentParser(description='build the opening table')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('build')
+    p.add_argument('-o', '--output', default=PATH)
+    p.add_argument('--worlds', type=int, default=20000, help='worlds to score every opening over')
+    p.add_argument('--deck', default=None, help='cards of every type, as in 9x9x12 (default: cards.CARDS)')
+    p.add_argument('--players', default='3-6', help='player counts, as in 3-6')
+    args = parser.parse_args()
+
+    deck = parse_deck(args.deck) if args.deck else DEFAULT_DECK
+    low, _, high = args.players.partition('-')
+    data = {'version': VERSION, 'worlds': args.worlds, 'decks': {}}
+    try:
+        with open(args.output) as f:
+            old = json.load(f)
+        if old.get('version') == VERSION:   # keep the other decks
+            data['decks'] = old['decks']
+    except (OSError, ValueError):
+        pass
+    data['decks'][deck_key(deck)] = build(deck, range(int(low), int(high or low) + 1), args.worlds)
+    with open(args.output, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+"""
+Brute-force oracle and differential harness for what the players deduce.
+
+The Oracle takes the messages of one seat literally and nothing more: the
+players a suggestion passed do not have its cards, the disprover has the
+card shown or else one of the cards, a wrong accusation is not the
+solution, and every player has as many cards as the deal gives them. It
+finds out what is true in every deal that agrees with that by searching
+the deals themselves, one candidate solution and one hand after the other
+(no rule of AIPlayer.py is used): a deal for every candidate, then for
+every card a player has in all the deals found so far a deal where they do
+not have it, and for every card they have in none a deal where they do. A
+question no deal answers is a deduction. The search stops with
+TooManyDeals after max_steps steps, which early in larger games it does.
+
+The harness plays seeded games, records the messages of one seat, replays
+them to every variant (see tournament.py) and after every message that
+tells something (reset, suggestion, accusation) compares what the variant
+knows with the oracle:
+
+    violations      the player knows something some deal contradicts (a
+                    card of a player, a card a player does not have, a
+                    card of the solution or a candidate it dropped), or
+                    the actual deal of the game does (or the player
+                    raises, which ends the replay of the game)
+    missed          the oracle knows it and the player does not, one per
+                    card of a player and per card of the solution, with
+                    the candidates the player still has apart
+    solver ms       the time of the handlers of those messages and of
+                    reading the knowledge of the player, so a player that
+                    deduces when it is asked (batchsolver.BatchPlayer) pays
+                    for it as well
+
+and reports the missed deductions per millisecond of solver time next to
+them, so a faster variant that deduces less shows.
+
+    python oracle.py [--games N] [--config 4:3x3x4] [--max-steps N] [-o out.json] [VARIANT...]
+
+The configurations are CONFIGS unless given (player count and cards of
+every type, cards.CARDS without them). The oracle checks a sample of the
+messages of the larger ones. Run it with PYTHONHASHSEED=0 to play the
+same games every time. It exits with 1 if there is any violation.
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+import time
+
+from benchmark import NullMessager, TranscriptRecorder
+from cards import DEFAULT_DECK, get_deck, iter_bits, make_deck
+from referee import Game
+from tournament import variant
+
+MAX_STEPS = 200000                          # steps of the search of the deals after a message at most
+INFORMATION = ('reset', 'suggestion', 'accusation')     # the messages that tell the player something
+CONFIGS = [                                 # (player_count, cards of every type or None, games, part of the messages checked)
+    (3, (3, 3, 4), 20, 1.0),
+    (4, (3, 3, 4), 20, 1.0),
+    (3, None, 10, 1.0),
+    (4, None, 5, 0.5),
+    (6, None, 5, 0.5),
+]
+MAX_EXAMPLES = 20                           # violations reported in full
+
+
+class TooManyDeals(Exception):
+    """Raised by Oracle.knowledge after max_steps steps of searching."""
+
+
+class Knowledge:
+    def __init__(self, must, may, solutions):
+        self.must = must                    # cards every player has in every deal - [Int]
+        self.may = may                      # cards every player has in some deal - [Int]
+        self.solutions = solutions          # solution of some deal - {Int}
+        self.solution = 0                   # cards in every one of them - Int
+        if solutions:
+            self.solution = -1
+            for solution in solutions:
+                self.solution &= solution
+
+
+class Oracle:
+    def __init__(self, deck=DEFAULT_DECK):
+        self.deck = get_deck(deck)
+        self.steps = 0                      # of the last "knowledge"
+
+    def message(self, msg):
+        # Takes in what the v1 message msg to the seat says.
+        deck = self.deck
+        cmd, *args = msg.split()
+        if cmd == 'reset':
+            player_count, player_id, *names = args
+            n = int(player_count)
+            player_id = int(player_id)
+            hand = deck.mask(names)
+            self.n_cards = [deck.n_dealt // n + (i < deck.n_dealt % n) for i in range(n)]
+            self.has = [0] * n                          # cards every player was seen to have
+            self.allowed = [deck.all_cards] * n         # cards every player may have
+            self.groups = [[] for _ in range(n)]        # cards of the suggestions every player disproved unseen
+            self.wrong = set()                          # wrong accusations
+            self.has[player_id] = self.allowed[player_id] = hand
+        elif cmd == 'suggestion':
+            card = None
+            if not args[-1].isdigit() and args[-1] != '-':
+                *args, card = args
+            player_id, *names, disprover = args
+            player_id = int(player_id)
+            n = len(self.n_cards)
+            cards = deck.mask(names)
+            end = player_id if disprover == '-' else int(disprover)
+            i = (player_id + 1) % n
+            while i != end:                             # the players it passed
+                self.allowed[i] &= ~cards
+                i = (i + 1) % n
+            if disprover != '-':
+                if card:
+                    self.has[end] |= 1 << deck.index[card]
+                else:
+                    self.groups[end].append(cards)
+        elif cmd == 'accusation':
+            *names, is_win = args[1:]
+            if is_win == '-':
+                self.wrong.add(deck.mask(names))
+
+    def candidates(self):
+        taken = 0
+        for hand in self.has:
+            taken |= hand
+        return [solution for solution in self.deck.solutions if not solution & taken and solution not in self.wrong]
+
+    def knowledge(self, max_steps=MAX_STEPS):
+        # return - Knowledge of the deals that agree with the messages so far
+        # raises TooManyDeals when that takes more than max_steps steps
+        self.steps = 0
+        self.max_steps = max_steps
+        n = len(self.n_cards)
+        must = [self.deck.all_cards] * n
+        may = [0] * n
+        solutions = set()
+
+        def add(solution, hands):
+            solutions.add(solution)
+            for i, hand in enumerate(hands):
+                must[i] &= hand
+                may[i] |= hand
+
+        for solution in self.candidates():
+            hands = self.find(solution, self.has, self.allowed)
+            if hands is not None:
+                add(solution, hands)
+        live = sorted(solutions)
+        for i in range(n):
+            for c in iter_bits(self.allowed[i] & ~self.has[i]):
+                bit = 1 << c
+                if may[i] & bit and not must[i] & bit:  # the deals found so far answer it
+                    continue
+                if must[i] & bit:                       # a deal without the card
+                    allowed = list(self.allowed)
+                    allowed[i] &= ~bit
+                    found = self.search(live, self.has, allowed)
+                else:                                   # a deal with it
+                    has = list(self.has)
+                    has[i] |= bit
+                    found = self.search(live, has, self.allowed)
+                if found is not None:
+                    add(*found)
+        return Knowledge(must, may, solutions)
+
+    def search(self, solutions, has, allowed):
+        # return - (solution, hands) of a deal with one of the solutions, None if there is none
+        for solution in solutions:
+            hands = self.find(solution, has, allowed)
+            if hands is not None:
+                return solution, hands
+        return None
+
+    def find(self, solution, has, allowed):
+        # has, allowed - cards every player has and may have
+        # return - the hand of every player in a deal with the solution, None if there is none - [Int]
+        n_cards = self.n_cards
+        groups = self.groups
+        taken = 0
+        for i, hand in enumerate(has):
+            if hand & taken or hand & ~allowed[i] or hand & solution or hand.bit_count() > n_cards[i]:
+                return None
+            taken |= hand
+        free = self.deck.all_cards & ~solution & ~taken
+        order = sorted(range(len(has)), key=lambda i: (allowed[i] & free).bit_count() + has[i].bit_count() - n_cards[i])
+        suffix = [0] * (len(order) + 1)                 # cards the players order[k:] may have
+        for k in range(len(order) - 1, -1, -1):
+            suffix[k] = suffix[k + 1] | allowed[order[k]] & free
+        if free & ~suffix[0]:
+            return None
+        hands = list(has)
+
+        def deal(k, free):
+            self.steps += 1
+            if self.steps > self.max_steps:
+                raise TooManyDeals(self.steps)
+            if k == len(order):
+                return not free
+            i = order[k]
+            need = n_cards[i] - hands[i].bit_count()
+            options = free & allowed[i]
+            forced = free & ~suffix[k + 1]              # cards no later player may have
+            if forced & ~options or forced.bit_count() > need:
+                return False
+            base = hands[i] | forced
+            options &= ~forced
+            need -= forced.bit_count()
+            open_groups = [group for group in groups[i] if not group & base]
+            for group in open_groups:
+                if not group & options:
+                    return False
+            bits = [1 << c for c in iter_bits(options)]
+            for combo in itertools.combinations(bits, need):
+                hand = base | sum(combo)
+                for group in open_groups:
+                    if not group & hand:
+                        break
+                else:
+                    hands[i] = hand
+                    if deal(k + 1, free & ~hand):
+                        return True
+            hands[i] = has[i]
+            return False
+
+        return hands if deal(0, free) else None
+
+
+def knowledge_of(player):
+    # return - (must_have, must_have | may_have of every player, cards found in the solution,
+    #           candidate solutions or None if the player has none) of player - ([Int], [Int], Int, {Int})
+    if hasattr(player, 'possible_solutions'):   # AIPlayer.AI01
+        solution = 0
+        for card in player.cards:
+            if card.in_solution:
+                solution |= card.bit
+        return ([p.must_have for p in player.players], [p.must_have | p.may_have for p in player.players],
+                solution, set(player.possible_solutions))
+    players, solution = player.knowledge()      # batchsolver.BatchPlayer
+    return [must for must, _ in players], [must | may for must, may in players], solution, None
+
+
+def record_game(player_class, player_count, seed, seat, deck=DEFAULT_DECK):
+    # return - the messages seat receives in the game dealt under seed, and its referee.GameResult
+    players = [player_class('p{}'.format(i)) for i in range(player_count)]
+    for i, player in enumerate(players):
+        player.rng = random.Random('{}:{}'.format(seed, i))
+    recorder = TranscriptRecorder(players[seat])
+    players[seat] = recorder
+    result = Game(players, seed=seed, deck=deck).play()
+    return recorder.messages, result
+
+
+class Stats:
+    FIELDS = ('messages', 'checked', 'skipped', 'violations', 'truth_violations',
+              'missed_has', 'missed_not', 'missed_solution', 'extra_candidates', 'solver_ns', 'oracle_steps')
+
+    def __init__(self):
+        for name in self.FIELDS:
+            setattr(self, name, 0)
+        self.examples = []                  # the first violations - [String]
+
+    def violation(self, what, n=1, truth=False):
+        if truth:
+            self.truth_violations += n
+        else:
+            self.violations += n
+        if len(self.examples) < MAX_EXAMPLES:
+            self.examples.append(what)
+
+    def summary(self):
+        summary = {name: getattr(self, name) for name in self.FIELDS}
+        missed = self.missed_has + self.missed_not + self.missed_solution
+        summary['solver_ms'] = self.solver_ns / 1e6
+        summary['missed'] = missed
+        summary['missed_per_ms'] = missed / (self.solver_ns / 1e6) if self.solver_ns else 0.0
+        summary['examples'] = self.examples
+        return summary
+
+
+def check_game(player_class, messages, result, deck, stats, sample=1.0, rng=None, max_steps=MAX_STEPS, name=''):
+    # Replays the messages of a seat to a new player_class player and compares what
+    # it knows after every message of INFORMATION with the oracle and the actual deal.
+    deck = get_deck(deck)
+    rng = rng or random.Random()
+    player = player_class('oracle')
+    player.messager = NullMessager()
+    player.deck = deck
+    oracle = Oracle(deck)
+    true_solution = deck.mask(result.solution)
+    true_hands = [deck.mask(hand) for hand in result.hands]
+    names = deck.names
+
+    def cards(mask):
+        return ' '.join(names[i] for i in iter_bits(mask))
+
+    perf_counter_ns = time.perf_counter_ns
+    for k, msg in enumerate(messages):
+        cmd, *args = msg.split()
+        start = perf_counter_ns()
+        try:
+            player._handlers[cmd](*args)
+        except Exception as e:              # an assert of a player that knows something wrong, the rest of the game is lost
+            stats.violation('{} #{} [{}]: {!r}'.format(name, k, msg, e), truth=True)
+            return
+        if cmd not in INFORMATION:
+            continue
+        must, possible, solution, candidates = knowledge_of(player)
+        stats.solver_ns += perf_counter_ns() - start
+        stats.messages += 1
+        oracle.message(msg)
+        where = '{} #{} [{}]'.format(name, k, msg)
+
+        for i, hand in enumerate(true_hands):           # the actual deal, whatever the oracle can do
+            if must[i] & ~hand or hand & ~possible[i]:
+                stats.violation('{}: player {} has {}, known {} / {}'.format(
+                    where, i, cards(hand), cards(must[i]), cards(possible[i])), truth=True)
+        if solution & ~true_solution or candidates is not None and true_solution not in candidates:
+            stats.violation('{}: the solution {} is not a candidate'.format(where, cards(true_solution)), truth=True)
+
+        if rng.random() >= sample:
+            continue
+        try:
+            known = oracle.knowledge(max_steps)
+        except TooManyDeals:
+            stats.skipped += 1
+            continue
+        finally:
+            stats.oracle_steps += oracle.steps
+        stats.checked += 1
+        for i in range(len(must)):
+            wrong = (must[i] & ~known.must[i]) | (known.may[i] & ~possible[i])
+            if wrong:
+                stats.violation('{}: player {} cards {} known wrong'.format(where, i, cards(wrong)), wrong.bit_count())
+            stats.missed_has += (known.must[i] & ~must[i]).bit_count()
+            stats.missed_not += (possible[i] & ~known.may[i]).bit_count()
+        if solution & ~known.solution:
+            stats.violation('{}: solution cards {} known wrong'.format(where, cards(solution & ~known.solution)),
+                            (solution & ~known.solution).bit_count())
+        stats.missed_solution += (known.solution & ~solution).bit_count()
+        if candidates is not None:
+            dropped = known.solutions - candidates
+            if dropped:
+                stats.violation('{}: candidates {} dropped'.format(where, [cards(sol) for sol in dropped]), len(dropped))
+            stats.extra_candidates += len(candidates - known.solutions)
+
+
+def run(specs, configs=CONFIGS, games=None, max_steps=MAX_STEPS, seed=0):
+    # return - {config name: {variant spec: Stats.summary()}}
+    results = {}
+    recorder_class = variant(specs[0])
+    for player_count, sizes, n_games, sample in configs:
+        deck = DEFAULT_DECK if sizes is None else make_deck(sizes)
+        config = '{}p-{}'.format(player_count, 'x'.join(map(str, sizes)) if sizes else 'default')
+        stats = {spec: Stats() for spec in specs}
+        for g in range(n_games if games is None else games):
+            game_seed = '{}:{}'.format(seed, g)
+            seat = g % player_count
+            messages, result = record_game(recorder_class, player_count, game_seed, seat, deck)
+            for spec in specs:              # every variant checks the same messages
+                check_game(variant(spec), messages, result, deck, stats[spec], sample,
+                           random.Random(game_seed), max_steps, '{} game {}'.format(config, g))
+        results[config] = {spec: s.summary() for spec, s in stats.items()}
+    return results
+
+
+def print_report(results):
+    print('{:<16}{:<28}{:>8}{:>8}{:>7}{:>7}{:>8}{:>8}{:>10}{:>11}'.format(
+        'config', 'variant', 'checked', 'skipped', 'viol', 'truth', 'missed', 'extra', 'solver ms', 'missed/ms'))
+    for config, by_spec in results.items():
+        for spec, s in by_spec.items():
+            print('{:<16}{:<28}{checked:>8}{skipped:>8}{violations:>7}{truth_violations:>7}{missed:>8}'
+                  '{extra_candidates:>8}{solver_ms:>10.0f}{missed_per_ms:>11.3f}'.format(config, spec[-27:], **s))
+    for config, by_spec in results.items():
+        for spec, s in by_spec.items():
+            for line in s['examples']:
+                print('VIOLATION', spec, line)
+
+
+def parse_config(text):
+    # text - '<players>:<cards of every type>' as in '4:3x3x4', or '<players>' for cards.CARDS - String
+    players, _, sizes = text.partition(':')
+    return int(players), tuple(int(size) for size in sizes.split('x')) if sizes else None, 10, 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='check what the players deduce against a brute-force oracle')
+    parser.add_argument('variants', nargs='*', default=['AIPlayer:AI01'], help='see tournament.py')
+    parser.add_argument('--games', type=int, help='games of every configuration')
+    parser.add_argument('--config', action='append', type=parse_config, help='players:cards, as in 4:3x3x4')
+    parser.add_argument('--max-steps', type=int, default=MAX_STEPS)
+    parser.add_argument('--seed', default=0)
+    parser.add_argument('-o', '--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+    results = run(args.variants, args.config or CONFIGS, args.games, args.max_steps, args.seed)
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if any(s['violations'] or s['truth_violations'] for by_spec in results.values()
+                      for s in by_spec.values()) else 0)
+
+
+if __name__ == '__main__':
+    main()
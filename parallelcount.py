@@ -0,0 +1,136 @@
+"""
+Counting the candidate solutions in a pool of processes.
+
+Late in a game filter_solutions counts every candidate that is left, and
+when the counts do not share much of their work this is the slowest part
+of a turn. A CountPool first counts them in the player's own DealCounter
+with a few steps (local_tries), which is enough for almost every turn, and
+only when that is not enough gives the candidates with a different count
+to the worker processes, a chunk each, together with the knowledge of the
+players as DealCounter takes it (a few ints per player, not the state of
+the player). A worker keeps its counters in a countcache.CounterCache, so
+its chunks of the same knowledge share their memo.
+
+With a deadline the pool waits that long for the chunks (or until the
+deadline of the counter, see movebudget.py, if that comes first), and the
+workers stop at it too, in the middle of a count (see DealCounter), so no
+chunk keeps a worker busy past it: the candidates that were not counted
+by then are given back as None, which the player takes as "not known".
+
+AI01 counts in the pool of its class attribute count_pool, which is set
+from the environment:
+
+    PLAYER_COUNT_WORKERS=<n>        count in a pool of n processes (0 -> one per core)
+    PLAYER_COUNT_DEADLINE=<seconds> deadline of every count, none if not set
+"""
+import concurrent.futures
+import os
+import time
+
+from countcache import CounterCache
+from dealcount import CountTimeout, CountTooLarge
+
+WORKERS_VAR = 'PLAYER_COUNT_WORKERS'
+DEADLINE_VAR = 'PLAYER_COUNT_DEADLINE'
+STOP_GRACE = 0.05                       # seconds to wait past the deadline for the running chunks to stop
+
+_cache = None                               # CounterCache of the worker process
+
+
+def count_chunk(players, avail, solutions, max_tries, deadline):
+    # Runs in a worker: counts the solutions one after the other until the deadline,
+    # which also stops the count that is running then.
+    # return - (counts of the first solutions, steps taken, if max_tries was not enough) - ([Int], Int, Boolean)
+    global _cache
+    if _cache is None:
+        _cache = CounterCache()
+    with _cache.lend(players, avail, max_tries, deadline) as (counter, _):
+        n_tried = counter.n_tried
+        counts = []
+        overflow = False
+        try:
+            for solution in solutions:
+                counts.append(counter.count_solution(solution))
+        except CountTooLarge:
+            overflow = True
+        except CountTimeout:                # the counts finished by then are given back
+            pass
+        return counts, counter.n_tried - n_tried, overflow
+
+
+class CountPool:
+    def __init__(self, workers=None, deadline=None, local_tries=20000, chunks_per_worker=4):
+        self.workers = workers or os.cpu_count() or 1   # processes of the pool
+        self.deadline = deadline                # seconds a count may take at most (None -> no limit)
+        self.local_tries = local_tries          # steps to count in the calling process first
+        self.chunks_per_worker = chunks_per_worker      # more, smaller chunks even out the work and give more partial results
+        self.executor = None                    # made by the first count that needs it
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+    def count_solutions(self, counter, players, avail, solutions):
+        # counter - DealCounter of the players and avail, the counts of the workers are memoized in it too
+        # players, avail - the knowledge of the counter, see AI01.get_knowledge
+        # return - (count of every solution, None for the ones the deadline cut off,
+        #          steps the workers took, the ones of counter are in counter.n_tried) - ([Int], Int)
+        # raises CountTooLarge when a worker takes more steps than the counter has left
+        n_tried = counter.n_tried
+        limit = counter.limit
+        counter.limit = min(limit, n_tried + self.local_tries)
+        try:
+            return counter.count_solutions(solutions), 0
+        except CountTooLarge:
+            if counter.n_tried > limit:
+                raise
+        finally:
+            counter.limit = limit
+
+        by_classes = counter._by_classes
+        keys = counter.solution_keys(solutions)
+        missing = {}                            # key -> a solution of the key, of every key that was not counted
+        for solution, key in zip(solutions, keys):
+            if key not in by_classes and key not in missing:
+                missing[key] = solution
+        max_tries = None if limit == float('inf') else limit - counter.n_tried
+        deadline = None if self.deadline is None else time.time() + self.deadline
+        if counter.deadline is not None:        # the deadline of the player's move comes first
+            deadline = counter.deadline if deadline is None else min(deadline, counter.deadline)
+        n_chunks = min(len(missing), self.workers * self.chunks_per_worker)
+        representatives = list(missing.values())
+        chunks = [representatives[i::n_chunks] for i in range(n_chunks)]
+        executor = self.get_executor()
+        futures = {executor.submit(count_chunk, players, avail, chunk, max_tries, deadline): chunk for chunk in chunks}
+        done, not_done = concurrent.futures.wait(
+            futures, None if deadline is None else max(0.0, deadline - time.time()))
+        running = [future for future in not_done if not future.cancel()]   # cancel only drops the chunks not started
+        if running:                             # the others stop at the deadline, with the counts finished by then
+            done |= concurrent.futures.wait(running, STOP_GRACE).done
+        n_tried = 0
+        overflow = False
+        key_of = dict(zip(solutions, keys))
+        for future in done:
+            counts, tried, chunk_overflow = future.result()
+            n_tried += tried
+            overflow |= chunk_overflow
+            for solution, count in zip(futures[future], counts):
+                by_classes[key_of[solution]] = count
+        if overflow:
+            raise CountTooLarge(n_tried)
+        return [by_classes.get(key) for key in keys], n_tried
+
+
+def from_env():
+    # return - the CountPool set by PLAYER_COUNT_WORKERS, None to count in the process of the player - CountPool
+    workers = os.environ.get(WORKERS_VAR)
+    if workers is None:
+        return None
+    deadline = os.environ.get(DEADLINE_VAR)
+    return CountPool(int(workers), float(deadline) if deadline else None)
@@ -0,0 +1,177 @@
+"""
+Information gain suggestion planner.
+
+Scores every possible suggestion by how much its outcome (who disproves
+it and with which card) is expected to tell about the solution, over a
+set of sampled worlds, each one a candidate solution with a consistent deal
+of the unknown cards. All the scoring is done with NumPy arrays of
+suggestions x worlds.
+
+The planner is off unless AI01.plan_worlds is set (200 is a good value),
+because of what it costs. With 200 worlds it saves about a tenth of the
+turns of a game at 3 players and a third at 6 (11.6 against 12.9, 13.9
+against 19.5 turns in referee.py self-play). But a planned suggestion
+takes about 40 ms, and the states it leads to are slower to count:
+handle_suggestion goes from at most about 10 ms to a p99 of about 230 ms
+and a max of about 600 ms at 6 players. Self-play runs 4.6 games/s
+against 72 at 3 players, and 0.24 against 10 at 6. Set plan_worlds
+together with a budget for suggest (see below) when latency matters.
+
+When the move of the player has a deadline (see movebudget.py) only as
+many worlds as the last plan of the deck says can be sampled and scored
+in half the time left are drawn (MIN_WORLDS the first time), until halfway
+to the deadline at most, and with less time than MIN_WORLDS worlds take
+there is no plan.
+"""
+import random
+import time
+
+import numpy as np
+
+from cards import DEFAULT_DECK, iter_bits
+from dealcount import CountTooLarge
+from sampler import DealSampler
+
+MAX_BINS = 1 << 24                                      # bincount over at most this many bins, np.unique beyond
+MIN_WORLDS = 20                                         # fewer worlds than this are not worth scoring
+PLAN_OVERHEAD = 25                                      # time a plan takes besides its worlds, in worlds
+_suggestion_cards = {}                                  # cards.Deck -> its suggestion_cards
+_world_seconds = {}                                     # cards.Deck -> seconds per world of the last plan, sampling and scoring, see PLAN_OVERHEAD
+
+
+def suggestion_cards(deck=DEFAULT_DECK):
+    # return - the card indexes of every suggestion of deck.suggestions - suggestions x types array
+    cards = _suggestion_cards.get(deck)
+    if cards is None:
+        cards = _suggestion_cards[deck] = np.array(
+            [[deck.index[name] for name in sg] for sg in deck.suggestions], dtype=np.intp).reshape(
+            len(deck.suggestions), len(deck.categories))
+    return cards
+
+
+def sample_worlds(ai, n_worlds, rng=None, stop=None):
+    # Draw n_worlds worlds from what ai knows: a candidate solution by its
+    # probability and then a deal of the unknown cards that agrees with it,
+    # fewer if the time.time()-input stop comes first.
+    # return - (owner of every card in every world, -1 for the solution,
+    #           candidate of every world, probability of every world) - (worlds x cards array, [Int], worlds array)
+    rng = rng or random.Random()
+    solutions = list(ai.possible_solutions)
+    probabilities = ai.solution_probabilities()
+    n_cards = len(ai.cards)
+    known = np.full(len(ai.cards), -1, dtype=np.int8)
+    for player in ai.players:
+        for i in iter_bits(player.must_have):
+            known[i] = player.id
+    if not probabilities:
+        return np.empty((0, n_cards), dtype=np.int8), [], np.empty(0)
+
+    knowledge, avail = ai.get_knowledge()
+    masks = solutions
+    picks = rng.choices(range(len(solutions)), [probabilities.get(sol, 0) for sol in solutions], k=n_worlds)
+    owners, world_solutions, weights = [], [], []
+    draws = None
+    if ai.counts_exact:                                 # draw every deal of a candidate with the same probability
+        with ai.get_counter() as counter:
+            n_tried = counter.n_tried
+            try:
+                draws = []
+                for k in picks:
+                    if stop is not None and time.time() > stop:
+                        break
+                    draws.append((k, counter.sample(avail & ~masks[k], rng), 1))
+            except CountTooLarge:
+                draws = None
+            ai.deals_tried += counter.n_tried - n_tried
+    if draws is None:                                   # or weigh the deals of the importance sampler
+        sampler = DealSampler(knowledge, avail, masks, rng)
+        draws = ((k, *sampler.draw(k)) for k in picks)
+    for k, hands, weight in draws:
+        if stop is not None and time.time() > stop:
+            break
+        if not hands or not weight:
+            continue
+        world = known.copy()
+        for player_id, hand in enumerate(hands):
+            for i in iter_bits(hand):
+                world[i] = player_id
+        owners.append(world)
+        world_solutions.append(k)
+        weights.append(weight)
+    if not owners:
+        return np.empty((0, n_cards), dtype=np.int8), [], np.empty(0)
+    weights = np.array(weights, dtype=float)
+    return np.array(owners), world_solutions, weights / weights.sum()
+
+
+def entropies(keys, weights, n_keys):
+    # keys - outcome of every world for every suggestion, below n_keys - worlds x suggestions array
+    # weights - probability of every world - worlds array
+    # return - entropy of the outcome of every suggestion, in bits - suggestions array
+    n_worlds, n_suggestions = keys.shape
+    flat = (np.arange(n_suggestions, dtype=np.int64) * n_keys + keys).ravel()
+    w = np.broadcast_to(weights[:, None], keys.shape).ravel()
+    if n_suggestions * n_keys <= MAX_BINS:
+        p = np.bincount(flat, w, n_suggestions * n_keys)
+        rows = np.repeat(np.arange(n_suggestions), n_keys)
+    else:                                               # too many bins, only count the keys that occur
+        flat, inverse = np.unique(flat, return_inverse=True)
+        p = np.bincount(inverse.ravel(), w)
+        rows = flat // n_keys
+    p = p / weights.sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return -np.bincount(rows, np.where(p > 0, p * np.log2(p), 0), n_suggestions)
+
+
+def score_suggestions(owners, world_solutions, weights, player_id, player_count, deck=DEFAULT_DECK):
+    # owners - owner of every card in every world, -1 for the solution - worlds x cards array
+    # world_solutions - index of the candidate solution of every world - [Int]
+    # weights - probability of every world - worlds array
+    # return - expected information about the solution of every suggestion in deck.suggestions, in bits - suggestions array
+    cards = suggestion_cards(deck)
+    n_suggestions, n_types = cards.shape
+    if not len(world_solutions):
+        return np.zeros(n_suggestions)
+    # Players are asked in turn after the suggester, who can not disprove.
+    # distance[p] is how many players are asked before player p, and
+    # player_count for the suggester and the solution.
+    distance = np.empty(player_count + 1, dtype=np.int8)
+    distance[:player_count] = (np.arange(player_count) - player_id - 1) % player_count
+    distance[player_id] = distance[-1] = player_count   # index -1 is the solution
+    held = distance[owners[:, cards]]                   # worlds x suggestions x types
+    first = held.min(axis=2).astype(np.int64)
+    shown = held.argmin(axis=2)                         # the disprover is taken to show the first card they hold
+    n_outcomes = n_types * player_count + 1
+    outcome = np.where(first == player_count, n_outcomes - 1, first * n_types + shown)
+
+    # I(solution; outcome) = H(outcome) + H(solution) - H(outcome, solution), H(solution) is the same for all
+    _, solutions = np.unique(np.asarray(world_solutions), return_inverse=True)
+    n_solutions = solutions.max() + 1
+    p_solution = np.bincount(solutions, weights, n_solutions) / weights.sum()
+    h_solution = -(p_solution[p_solution > 0] * np.log2(p_solution[p_solution > 0])).sum()
+    return (entropies(outcome, weights, n_outcomes) + h_solution
+            - entropies(outcome * n_solutions + solutions[:, None], weights, n_outcomes * n_solutions))
+
+
+def plan(ai, n_worlds=200, rng=None):
+    # return - the suggestion with the highest expected information gain and its score,
+    #          (None, 0.0) if the deadline of the move leaves no time to plan - ((String), Float)
+    rng = rng or random.Random()
+    deck = ai.game_deck
+    stop = None
+    start = time.time()
+    if ai.deadline is not None:
+        stop = (start + ai.deadline) / 2                # halfway to the deadline
+        if deck in _world_seconds:
+            n_worlds = min(n_worlds, int((ai.deadline - start) / 2 / _world_seconds[deck]) - PLAN_OVERHEAD)
+        else:                                           # the first plan of the deck, to time it
+            n_worlds = min(n_worlds, MIN_WORLDS)
+        if n_worlds < MIN_WORLDS:
+            return None, 0.0
+    owners, world_solutions, weights = sample_worlds(ai, n_worlds, rng, stop)
+    scores = score_suggestions(owners, world_solutions, weights, ai.player.id, len(ai.players), deck)
+    if len(world_solutions):
+        _world_seconds[deck] = (time.time() - start) / (len(world_solutions) + PLAN_OVERHEAD)
+    best = scores.max()
+    ties = np.flatnonzero(scores >= best - 1e-9)        # break ties at random so the opponents learn less
+    return deck.suggestions[ties[rng.randrange(len(ties))]], float(best)
@@ -1,14 +1,28 @@
 import socket
+import types
+
+import protocol2
 
 class Player:
-    def __init__(self, name, addr, messager_class):
+    protocol = 1                            # protocol asked for in the 'alive' message, protocol2.VERSION to opt in to v2 (see protocol2.py)
+
+    def __init__(self, name, addr=None, messager_class=None):
+        # addr and messager_class may be left out when the player is driven
+        # in-process (see referee.py) instead of through a socket.
         self.name = name
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect(addr)
-        self._logfile = open(name + '.log', 'w')
+        self.messager = None
+        if addr is not None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.connect(addr)
+            self.messager = messager_class(sock)
+        self._logfile = None                # opened by the first log() call that writes
         self._verbosity = 0
-        self.messager = messager_class(sock)
-        self._handlers = {
+        self.transcript = None              # transcript.GameRecorder of the messages, None if they are not recorded
+        self._handlers = self.make_handlers()
+        self.prepare()
+
+    def make_handlers(self):
+        return {
             'reset': self.handle_reset,
             'suggest': self.handle_suggest,
             'suggestion': self.handle_suggestion,
@@ -17,7 +31,21 @@ class Player:
             'accusation': self.handle_accusation,
             'done': self.handle_done,
         }
-        self.prepare()
+
+    def __getstate__(self):
+        # A player is pickled without its connection, log file, recorder and
+        # handlers (nor the wrappers metrics.instrument puts on it), so the
+        # state of a game can be saved in a transcript and replayed later.
+        return {name: value for name, value in self.__dict__.items()
+                if name not in ('messager', '_logfile', 'transcript', '_handlers', '_plain_handlers')
+                and not isinstance(value, types.FunctionType)}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.messager = None
+        self._logfile = None
+        self.transcript = None
+        self._handlers = self.make_handlers()
 
     def set_verbosity(self, v):
         self._verbosity = v
@@ -36,9 +64,14 @@ class Player:
     def suggest(self):
         raise NotImplementedError
 
-    def handle_suggestion(self, player_id, c1, c2, c3, disprove_player_id, card=None):
-        player_id = int(player_id)
-        self.suggestion(int(player_id), [c1, c2, c3],
+    def handle_suggestion(self, player_id, *args):
+        # args - the names of the suggested cards (one per card type), then the
+        # id of the disproving player or '-', then the card shown if any
+        card = None
+        if not args[-1].isdigit() and args[-1] != '-':      # card names are never numbers
+            *args, card = args
+        *cards, disprove_player_id = args
+        self.suggestion(int(player_id), cards,
             *(() if disprove_player_id == '-' else (int(disprove_player_id), card)))
         self.send('ok')
 
@@ -59,8 +92,9 @@ class Player:
     def accuse(self):
         raise NotImplementedError
 
-    def handle_accusation(self, player_id, c1, c2, c3, is_win):
-        self.accusation(int(player_id), [c1, c2, c3], is_win == '+')
+    def handle_accusation(self, player_id, *args):
+        *cards, is_win = args
+        self.accusation(int(player_id), cards, is_win == '+')
         self.send('ok')
 
     def accusation(self):
@@ -68,7 +102,8 @@ class Player:
 
     def handle_done(self):
         self.done()
-        self._logfile.flush()
+        if self._logfile is not None:
+            self._logfile.flush()
         self.send('dead')
         self.messager.close()
         self._quit = True
@@ -76,19 +111,34 @@ class Player:
     def done(self):
         pass
 
+    def counters(self):
+        # return - the counters of the game to add to the metrics when it is done (see metrics.py) - {String: Int}
+        return {}
+
     def send(self, msg):
         if self._verbosity > 0:
             self.log('send:[{}]'.format(msg))
+        if self.transcript is not None:
+            self.transcript.send(msg)
         self.messager.send(msg)
 
     def prepare(self):
         pass
 
+    def hello(self):
+        # return - the first message to the server - String
+        return protocol2.HELLO.format(self.name) if self.protocol >= 2 else '{} alive'.format(self.name)
+
     def run(self):
-        self.send('{} alive'.format(self.name))
+        self.send(self.hello())
         self._quit = False
-        while not self._quit:
-            msg = self.messager.recv()
+        msg = self.messager.recv()
+        if self.protocol >= 2 and msg == protocol2.ACCEPT:
+            self.run_v2()
+            return
+        while True:
+            if self.transcript is not None:
+                self.transcript.recv(msg)
             cmd, *args = msg.split()
             if cmd in self._handlers:
                 if self._verbosity > 0:
@@ -96,18 +146,54 @@ class Player:
                 self._handlers[cmd](*args)
             else:
                 self.log('unknown command:', cmd, 'msg:', msg)
+            if self._quit:
+                break
+            msg = self.messager.recv()
+
+    def run_v2(self):
+        # Plays the games of a v2 connection one after the other, until the server closes it.
+        session = protocol2.Session(lambda game: self, max_games=1)
+        messager = self.messager
+        while True:
+            try:
+                frame = messager.recv()
+            except EOFError:
+                break
+            if not frame:                   # LineMessager at the end of the stream
+                break
+            answer = session.handle(frame)
+            if answer is not None:
+                messager.send(answer)
+        messager.close()
 
     def log(self, *args, **kwargs):
         if self._verbosity == 0:
             return
+        if self._logfile is None:
+            self._logfile = open(self.name + '.log', 'w')
         print(*args, file=self._logfile, **kwargs)
 
     def __del__(self):
-        self._logfile.close()
+        if self._logfile is not None:
+            self._logfile.close()
 
 def main(player_class, messager_class):
     import sys
+    import metrics
+    import transcript
     name = sys.argv[1]
     port = int(sys.argv[2])
+    writer = metrics.from_env()             # PLAYER_METRICS=<prefix> times the handlers
+    transcripts = transcript.from_env()     # PLAYER_TRANSCRIPT=<path> records the games
     player = player_class(name, ('localhost', port), messager_class)
-    player.run()
+    if writer is not None:
+        metrics.instrument(player)
+    if transcripts is not None:
+        player.transcript = transcripts.recorder(player)
+    try:
+        player.run()
+    finally:
+        if writer is not None:
+            writer.stop()
+        if transcripts is not None:
+            transcripts.close()
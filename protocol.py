@@ -1,4 +1,6 @@
+import collections
 import socket
+import struct
 
 class Messager:
     def __init__(self, sock):
@@ -29,14 +31,79 @@ class LineMessager(Messager):
 
 
 class BufMessager(Messager):
-    BUFSIZE = 512
+    """
+    Newline framed messager with its own buffering.
+
+    Received bytes go into one reusable buffer and are split into messages,
+    the complete messages after the first are kept for the next recv calls.
+    Sent messages are collected and written with one sendall when the
+    messager waits for the next message (the peer answers only after it got
+    them), when the messager is closed or when enough bytes are collected.
+    """
+    BUFSIZE = 4096                          # bytes read from the socket at most per recv_into
+    SEND_LIMIT = 16384                      # bytes collected before send writes them out anyway
 
     def __init__(self, sock):
         super().__init__(sock)
+        self._rbuf = bytearray(self.BUFSIZE)
+        self._rview = memoryview(self._rbuf)
+        self._pending = bytearray()         # received bytes of a message that is not complete yet
+        self._messages = collections.deque()
+        self._wbuf = bytearray()
 
     def send(self, msg):
-        self.sock.sendall(msg.encode())
+        self._wbuf += self.frame(msg.encode())
+        if len(self._wbuf) >= self.SEND_LIMIT:
+            self.flush()
+
+    def flush(self):
+        if self._wbuf:
+            self.sock.sendall(self._wbuf)
+            self._wbuf.clear()
 
     def recv(self):
-        msg = self.sock.recv(self.BUFSIZE).decode()
-        return msg
+        self.flush()
+        messages = self._messages
+        while not messages:
+            n = self.sock.recv_into(self._rview)
+            if not n:
+                raise EOFError('connection closed by peer')
+            self._pending += self._rview[:n]
+            self.split()
+        return messages.popleft()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            super().close()
+
+    def frame(self, data):
+        return data + b'\n'
+
+    def split(self):
+        # move the complete messages of self._pending to self._messages
+        *lines, rest = self._pending.split(b'\n')
+        self._messages.extend(line.decode().rstrip('\r') for line in lines)
+        self._pending = bytearray(rest)
+
+
+class PrefixMessager(BufMessager):
+    """BufMessager framing every message with its length as 4 big-endian bytes."""
+    HEADER = struct.Struct('>I')
+
+    def frame(self, data):
+        return self.HEADER.pack(len(data)) + data
+
+    def split(self):
+        pending = self._pending
+        size = self.HEADER.size
+        start = 0
+        while len(pending) - start >= size:
+            length, = self.HEADER.unpack_from(pending, start)
+            if len(pending) - start - size < length:
+                break
+            start += size
+            self._messages.append(pending[start:start + length].decode())
+            start += length
+        del pending[:start]
@@ -0,0 +1,173 @@
+"""
+Protocol v2.
+
+v2 is opt-in (Player.protocol = 2, v1 is the default). Such a player asks
+for it with its first message, '<name> alive v2' instead of
+'<name> alive' (the name stays the first word, and a v1 server only looks
+at that). A server that speaks v2 answers 'v2' before anything else, any
+other first message is v1 and the player goes on in v1.
+
+In v2 a message is any number of commands separated by ';', so a server
+can send all the news of a turn and the next question in one message, and
+every command starts with the id of its game, so one connection can carry
+many games. Cards are given by their index in the deck (cards.CARDS for
+the default deck), the notifications get no answer:
+
+    <game> r <player_count> <player_id> <card>...       reset
+    <game> n <player> <card>... [<disprover> [<card>]]  suggestion, one card of every card type of the deck,
+                                                        disproved by disprover (showing card to this player)
+    <game> x <player> <card>... +|-                     accusation, right or wrong
+    <game> e                                            done, the game is over
+
+and the player answers every question, all the answers to the commands of
+a message together in one message, in the same order:
+
+    <game> s                    ->  <game> s <card> <card> <card>       suggest
+    <game> d <player> <card>... ->  <game> d <card>                     disprove
+    <game> a                    ->  <game> a [<card> <card> <card>]     accuse, no cards for no accusation
+
+Every command is handled by the v1 handler of the player, called with the
+v1 message it stands for, so the transcripts, metrics and logs of a game
+are the same whichever protocol it was played in; the answers the v1
+handlers send are turned into v2 ones ('ok' and 'dead' are dropped). A
+command with an unknown op is logged and ignored, as in v1.
+"""
+from cards import DEFAULT_DECK, get_deck
+
+VERSION = 2
+HELLO = '{} alive v2'                       # first message of a player that speaks v2
+ACCEPT = 'v2'                               # first message of a server that does
+
+COMMANDS = {                                # v2 op -> v1 command
+    'r': 'reset',
+    'n': 'suggestion',
+    'x': 'accusation',
+    'e': 'done',
+    's': 'suggest',
+    'd': 'disprove',
+    'a': 'accuse',
+}
+ANSWERS = {                                 # first word of a v1 answer -> v2 op, None to drop it
+    'ok': None,
+    'dead': None,
+    'suggest': 's',
+    'show': 'd',
+    'accuse': 'a',
+    '-': 'a',
+}
+
+
+class Replies:
+    """Messager of a player while it handles a v2 command."""
+
+    def __init__(self):
+        self.messages = []
+        self.closed = False
+
+    def send(self, msg):
+        self.messages.append(msg)
+
+    def close(self):
+        self.closed = True
+
+
+def deck_of(player):
+    return get_deck(getattr(player, 'deck', None) or DEFAULT_DECK)
+
+
+def to_v1(deck, op, args):
+    # return - the v1 command and arguments of a v2 command - (String, [String])
+    names = deck.names
+    if op == 'r':
+        return 'reset', args[:2] + [names[int(card)] for card in args[2:]]
+    if op == 'n':
+        n_types = len(deck.categories)
+        cards = [names[int(card)] for card in args[1:1 + n_types]]
+        rest = args[1 + n_types:]
+        if not rest:
+            return 'suggestion', [args[0], *cards, '-']
+        if len(rest) == 1:
+            return 'suggestion', [args[0], *cards, rest[0]]
+        return 'suggestion', [args[0], *cards, rest[0], names[int(rest[1])]]
+    if op == 'x':
+        return 'accusation', [args[0], *(names[int(card)] for card in args[1:-1]), args[-1]]
+    if op == 'd':
+        return 'disprove', [args[0], *(names[int(card)] for card in args[1:])]
+    return COMMANDS[op], args
+
+
+def to_v2(deck, game, msg):
+    # return - the v2 answer of a v1 one, None if v2 has none - String
+    word, *names = msg.split()
+    op = ANSWERS.get(word)
+    if op is None:
+        return None
+    index = deck.index
+    return ' '.join([game, op, *(str(index[name]) for name in names)])
+
+
+class Session:
+    """
+    The games of a v2 connection: new_player(game id) gives the player of
+    every new game, and "handle" one message from the server. A Player
+    plays one game at a time (see Player.run_v2), so its session has
+    max_games=1 and the commands of another game are logged and ignored
+    until the one it plays is done.
+    """
+
+    def __init__(self, new_player, max_games=None):
+        self.new_player = new_player
+        self.max_games = max_games          # games played at the same time at most, None -> no limit
+        self.players = {}                   # game id -> player of every game being played
+        self.finished = []                  # ids of the games that ended since the last "handle"
+
+    def log(self, game, *args):
+        # Logs to the player of the game, or to every player if the game is not played.
+        player = self.players.get(game)
+        for player in [player] if player is not None else self.players.values():
+            player.log(*args)
+
+    def player_for(self, game, command):
+        # return - the player of the game, None if it is one game too many
+        player = self.players.get(game)
+        if player is None:
+            if self.max_games is not None and len(self.players) >= self.max_games:
+                self.log(game, 'game', game, 'while', *self.players, 'is played, ignored:', command)
+                return None
+            player = self.players[game] = self.new_player(game)
+        return player
+
+    def handle(self, frame):
+        # return - the message to answer with, None if there is nothing to answer - String
+        answers = []
+        self.finished.clear()
+        for command in frame.split(';'):
+            game, op, *args = command.split()
+            if op not in COMMANDS:
+                self.log(game, 'unknown command:', op, 'msg:', command)
+                continue
+            player = self.player_for(game, command)
+            if player is None:
+                continue
+            deck = deck_of(player)
+            cmd, args = to_v1(deck, op, args)
+            msg = ' '.join([cmd, *args])
+            if player.transcript is not None:
+                player.transcript.recv(msg)
+            if player._verbosity > 0:
+                player.log('recv:[{}]'.format(msg))
+            messager = player.messager
+            player.messager = replies = Replies()
+            try:
+                player._handlers[cmd](*args)
+            finally:
+                player.messager = messager
+            for reply in replies.messages:
+                answer = to_v2(deck_of(player), game, reply)
+                if answer is not None:
+                    answers.append(answer)
+            if cmd == 'done':
+                player._quit = False        # the connection goes on with the other games
+                del self.players[game]
+                self.finished.append(game)
+        return ';'.join(answers) or None
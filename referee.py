@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+"""
+In-process game engine.
+
+Deals the cards of a deck (cards.CARDS by default) under a seed and drives
+playerproxy.Player objects by calling reset/suggest/suggestion/disprove/
+accuse/accusation/done on them directly, the same calls their handle_*
+methods make for messages from the server, so no socket, server or extra
+process is needed.
+
+    python referee.py [games [players [seed [deck [trivial]]]]]
+
+The engine itself plays thousands of games a second: with TrivialPlayer
+(the 'trivial' argument) about 2600 games/s at 3 players and 1300 at 6 on
+the default deck, around 10 us a turn. Self-play of AI01 is bound by the
+player, about 100 games/s at 3 players and 14 at 6.
+"""
+import random
+
+from cards import DEFAULT_DECK, get_deck, make_deck
+from playerproxy import Player
+
+
+class RuleError(Exception):
+    def __init__(self, player_id, msg):
+        super().__init__('player {}: {}'.format(player_id, msg))
+        self.player_id = player_id          # id of the player who broke the rules - Int
+
+
+class GameResult:
+    def __init__(self, solution, hands):
+        self.solution = solution            # names of the cards in the solution - [String]
+        self.hands = hands                  # names of the cards dealt to every player - [[String]]
+        self.winner = None                  # id of the player who made the right accusation - Int or None
+        self.turns = 0                      # number of suggestions made in the game - Int
+        self.suggestions = [0] * len(hands) # number of suggestions made by every player - [Int]
+        self.eliminated = []                # ids of the players who made a wrong accusation, in order - [Int]
+
+    def __repr__(self):
+        return 'GameResult(winner={}, turns={})'.format(self.winner, self.turns)
+
+
+class Game:
+    MAX_TURNS = 1000                        # a game with more suggestions than this is stopped without a winner
+
+    def __init__(self, players, seed=None, deck=DEFAULT_DECK):
+        # players - the players of the game in dealing order - [Player]
+        # seed - seed of the deal - any value random.Random accepts
+        # deck - cards.Deck or the names of the cards of every card type - ((String))
+        deck = get_deck(deck)
+        self.players = players
+        self.deck = deck.categories
+        self.reset_args = () if deck is DEFAULT_DECK else (deck,)   # players that only know the default deck are not given it
+        self.rng = random.Random(seed)
+
+    def deal(self):
+        solution = [self.rng.choice(names) for names in self.deck]
+        rest = [name for names in self.deck for name in names if name not in solution]
+        self.rng.shuffle(rest)
+        n = len(self.players)
+        hands = [rest[i::n] for i in range(n)]      # player 0 gets the first card, as AI01.reset assumes
+        return solution, hands
+
+    def play(self):
+        solution, hands = self.deal()
+        result = GameResult(solution, hands)
+        players = self.players
+        n = len(players)
+        hand_sets = [set(hand) for hand in hands]
+        for i, player in enumerate(players):
+            player.reset(n, i, list(hands[i]), *self.reset_args)
+
+        alive = set(range(n))                       # ids of the players who may still suggest and accuse
+        i = 0
+        while alive and result.turns < self.MAX_TURNS:
+            if i in alive:
+                self.turn(i, result, hand_sets, alive)
+                if result.winner is not None:
+                    break
+            i = (i + 1) % n
+
+        for player in players:
+            player.done()
+        return result
+
+    def turn(self, i, result, hand_sets, alive):
+        players = self.players
+        n = len(players)
+        cards = self.check_cards(i, players[i].suggest())
+        result.turns += 1
+        result.suggestions[i] += 1
+
+        for k in range(1, n):                       # the first player after the suggester with one of the cards disproves
+            j = (i + k) % n
+            if hand_sets[j].intersection(cards):
+                shown = players[j].disprove(i, list(cards))
+                if shown not in cards or shown not in hand_sets[j]:
+                    raise RuleError(j, 'can not show {!r} for {}'.format(shown, cards))
+                break
+        else:
+            j = shown = None
+
+        for k, player in enumerate(players):        # only the suggester sees the card
+            if j is None:
+                player.suggestion(i, list(cards))
+            else:
+                player.suggestion(i, list(cards), j, shown if k == i else None)
+
+        accusation = players[i].accuse()
+        if accusation:
+            accusation = self.check_cards(i, accusation)
+            is_win = accusation == result.solution
+            if is_win:
+                result.winner = i
+            else:
+                alive.discard(i)
+                result.eliminated.append(i)
+            for player in players:
+                player.accusation(i, list(accusation), is_win)
+
+    def check_cards(self, player_id, cards):
+        # return - the cards-input as a list if it has one card of every type - [String]
+        cards = list(cards)
+        if len(cards) != len(self.deck) or not all(
+                name in names for name, names in zip(cards, self.deck)):
+            raise RuleError(player_id, 'not one card of every type: {}'.format(cards))
+        return cards
+
+
+class TrivialPlayer(Player):
+    """
+    Crosses out the cards it holds or is shown and suggests at random from
+    the others, which is about the least a player can do and still end a
+    game. It costs next to nothing, so its self-play times the engine alone.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.rng = random.Random(name)
+
+    def reset(self, player_count, player_id, cards, deck=DEFAULT_DECK):
+        self.hand = set(cards)
+        self.unseen = [[name for name in names if name not in self.hand]   # names of the cards of every type that may be the solution - [[String]]
+                       for names in get_deck(deck).categories]
+
+    def suggest(self):
+        return [self.rng.choice(names) for names in self.unseen]
+
+    def suggestion(self, player_id, cards, disprove_player_id=None, card=None):
+        if card is not None:
+            for names in self.unseen:
+                if card in names:
+                    names.remove(card)
+
+    def disprove(self, suggest_player_id, cards):
+        return next(name for name in cards if name in self.hand)
+
+    def accuse(self):
+        if all(len(names) == 1 for names in self.unseen):
+            return [names[0] for names in self.unseen]
+
+    def accusation(self, player_id, cards, is_win):
+        pass
+
+
+def self_play(player_class, player_count, n_games, seed=0, deck=DEFAULT_DECK):
+    # Play n_games games between player_count instances of player_class,
+    # yielding the GameResult of every game. Game k is dealt under the seed
+    # '<seed>:<k>', so a run can be repeated or continued from any game.
+    players = [player_class('p{}'.format(i)) for i in range(player_count)]
+    for k in range(n_games):
+        yield Game(players, seed='{}:{}'.format(seed, k), deck=deck).play()
+
+
+def parse_deck(text):
+    # text - number of cards of every card type, as in '9x9x12' - String
+    return make_deck(int(size) for size in text.split('x'))
+
+
+def main():
+    import sys
+    import time
+    from AIPlayer import AI01
+    n_games = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    player_count = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    deck = parse_deck(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_DECK
+    player_class = TrivialPlayer if len(sys.argv) > 5 and sys.argv[5] == 'trivial' else AI01
+    start = time.perf_counter()
+    wins = [0] * player_count
+    turns = 0
+    for result in self_play(player_class, player_count, n_games, seed, deck):
+        if result.winner is not None:
+            wins[result.winner] += 1
+        turns += result.turns
+    elapsed = time.perf_counter() - start
+    print('games: {} players: {} deck: {} seconds: {:.2f} games/s: {:.1f}'.format(
+        n_games, player_count, deck, elapsed, n_games / elapsed))
+    print('wins by seat:', wins, 'suggestions per game: {:.2f}'.format(turns / n_games))
+
+
+if __name__ == '__main__':
+    main()
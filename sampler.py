@@ -0,0 +1,123 @@
+import random
+import time
+
+from cards import iter_bits
+
+
+class DealSampler:
+    """
+    Estimates how likely every candidate solution is by sampling deals.
+
+    players   - one (n_take, may_have, selection_groups) tuple per player id,
+                as for dealcount.DealCounter
+    avail     - mask of the cards that have no known owner and are not known
+                to be in the solution
+    solutions - masks of the candidate solutions
+
+    A sample picks a candidate and deals the rest of the available cards one
+    at a time, each to a random player who may have it and still has room,
+    and weighs the deal by the number of choices made on the way (zero if it
+    got stuck or broke a selection group). The mean weight of the samples of
+    a candidate is an unbiased estimate of the number of deals in which it
+    is the solution, so the estimates keep getting better the longer the
+    sampler runs, and estimate() can be called again to refine them.
+
+    The time budget of estimate() is checked after every sample, so with
+    thousands of candidates it may stop within a round: the rounds start
+    at a random candidate and go on where the last one stopped, and the
+    candidates that have no sample yet are given the mean weight of all
+    the samples.
+    """
+
+    def __init__(self, players, avail, solutions, rng=None):
+        self.avail = avail
+        self.solutions = list(solutions)
+        self.rng = rng or random.Random()
+        self.takes = [max(0, n_take) for n_take, _, _ in players]
+        self.groups = [[group & may_have & avail for group in groups] for _, may_have, groups in players]
+        self.owners = {}                    # card index -> ids of the players who may have the card
+        for i in iter_bits(avail):
+            self.owners[i] = [p for p, (_, may_have, _) in enumerate(players) if may_have >> i & 1]
+        self.order = sorted(self.owners, key=lambda i: len(self.owners[i]))    # most constrained cards are dealt first
+        self.possible = all(n_take >= 0 for n_take, _, _ in players) and all(
+            all(groups) for groups in self.groups)
+        self.weights = [0] * len(self.solutions)    # sum of the sample weights of every candidate
+        self.counts = [0] * len(self.solutions)     # number of samples of every candidate
+        self.n_samples = 0
+        self.next = self.rng.randrange(len(self.solutions)) if self.solutions else 0   # candidate "estimate" samples next
+
+    def draw(self, k):
+        # Deal the cards left by candidate k.
+        # return - (mask of the cards of every player, weight of the deal) - ([Int], Int)
+        rest = self.avail & ~self.solutions[k]
+        if not self.possible or rest.bit_count() != sum(self.takes):
+            return None, 0
+        left = list(self.takes)
+        hands = [0] * len(left)
+        weight = 1
+        choice = self.rng.choice
+        for i in self.order:
+            if not rest >> i & 1:
+                continue
+            owners = [p for p in self.owners[i] if left[p]]
+            if not owners:
+                return None, 0
+            p = choice(owners)
+            weight *= len(owners)
+            left[p] -= 1
+            hands[p] |= 1 << i
+        for hand, groups in zip(hands, self.groups):
+            for group in groups:
+                if not hand & group:
+                    return None, 0
+        return hands, weight
+
+    def sample(self, k):
+        hands, weight = self.draw(k)
+        self.weights[k] += weight
+        self.counts[k] += 1
+        self.n_samples += 1
+        return hands, weight
+
+    def estimate(self, rounds=None, time_budget=None):
+        # Sample every candidate once per round, for the given number of rounds
+        # (one if neither is given) and at most until time_budget seconds have
+        # passed (at least one sample).
+        # return - estimated probability of every candidate - [Float]
+        n_solutions = len(self.solutions)
+        if not n_solutions:
+            return []
+        perf_counter = time.perf_counter
+        deadline = None if time_budget is None else perf_counter() + time_budget
+        if rounds is not None:
+            n_left = n_solutions * rounds               # samples left to take
+        else:
+            n_left = n_solutions if deadline is None else float('inf')
+        k = self.next
+        while n_left > 0:
+            self.sample(k)
+            n_left -= 1
+            k = k + 1 if k + 1 < n_solutions else 0
+            if deadline is not None and perf_counter() >= deadline:
+                break
+        self.next = k
+        return self.probabilities()
+
+    def probabilities(self):
+        sampled = self.n_samples and sum(self.weights) / self.n_samples    # mean weight, for the candidates without samples
+        means = [w / c if c else sampled for w, c in zip(self.weights, self.counts)]
+        total = sum(means)
+        if not total:
+            return [0.0] * len(means)
+        return [mean / total for mean in means]
+
+    def worlds(self, n):
+        # Draw n weighted deals over random candidates, the weights include
+        # the number of candidates so they can be mixed with each other.
+        # yield - (index of the candidate, cards of every player, weight) - (Int, [Int], Int)
+        n_solutions = len(self.solutions)
+        for _ in range(n):
+            k = self.rng.randrange(n_solutions)
+            hands, weight = self.sample(k)
+            if weight:
+                yield k, hands, weight * n_solutions
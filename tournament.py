@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""
+Tournament runner for player variants.
+
+    python tournament.py run -o results.jsonl [--games N] [--players 4] [--workers 0] VARIANT...
+    python tournament.py report results.jsonl
+
+A variant is a Player subclass, with some of its class attributes set:
+
+    AIPlayer:AI01
+    AIPlayer:AI01,accuse_threshold=0.5,plan_worlds=200
+    AIPlayer:AI01,suggest=suggest1      (set to the name of another attribute, it is that one)
+
+Game g of a run is deal g // V (V variants) dealt under the seed
+'<seed>:<deal>' as in referee.self_play, with seat i played by variant
+(i + g) % V, so every deal is played in every rotation of the variants
+over the seats and the luck of the deal and of the seat cancels out. The
+rng of the players (see AI01.rng) is seeded by the game and the seat too,
+and the workers get a fixed hash seed, so a game plays the same every
+time but for the time budgets of the sampler.
+
+The games are played in batches by a pool of processes, and every result
+is a JSON line appended to the results file as soon as its batch is done,
+after a first line with the settings of the tournament. Running again
+with the same settings continues the file: the games in it are skipped
+(a line cut off by a kill is dropped), so a run can be killed at any time
+and --games raised to play more.
+
+The report gives, for every variant, its wins per seat played with a 95%
+confidence interval, the turns of the games it won, its suggestions and
+failed suggestions per game and the time of its calls, then for every two
+variants the p-value of a win share test (do they win as often as their
+number of seats would have it, over the games one of them won) and of a
+Welch test of their turns to solve.
+"""
+import argparse
+import ast
+import concurrent.futures
+import contextlib
+import functools
+import importlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from cards import DEFAULT_DECK
+from referee import Game, RuleError, parse_deck
+
+VERSION = 1
+
+
+@functools.lru_cache(maxsize=None)
+def variant(spec):
+    # spec - 'module:Class[,name=value...]', see the module docstring - String
+    # return - the Player subclass of spec - type
+    module_name, _, rest = spec.partition(':')
+    class_name, *settings = rest.split(',')
+    cls = getattr(importlib.import_module(module_name), class_name)
+    attrs = {}
+    for setting in settings:
+        name, _, text = setting.partition('=')
+        if not hasattr(cls, name):
+            raise ValueError('{} has no attribute {!r}'.format(class_name, name))
+        try:
+            attrs[name] = ast.literal_eval(text)
+        except (ValueError, SyntaxError):   # the name of another attribute
+            attrs[name] = getattr(cls, text)
+    return type(class_name, (cls,), attrs) if attrs else cls
+
+
+class Clocked:
+    """Calls the methods of a player, adding up the time they take."""
+
+    def __init__(self, player):
+        self.player = player
+        self.ns = 0                         # time of all the calls - Int (ns)
+        self.max_ns = 0                     # of the longest one
+        self.calls = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.player, name)
+
+        def call(*args):
+            start = time.perf_counter_ns()
+            try:
+                return method(*args)
+            finally:
+                ns = time.perf_counter_ns() - start
+                self.ns += ns
+                self.calls += 1
+                if ns > self.max_ns:
+                    self.max_ns = ns
+        return call
+
+
+def play_game(settings, g):
+    # return - the result line of game g - {String: ...}
+    specs = settings['variants']
+    n_variants = len(specs)
+    deck = parse_deck(settings['deck']) if settings['deck'] else DEFAULT_DECK
+    seats = [(i + g) % n_variants for i in range(settings['players'])]
+    players = []
+    for i, v in enumerate(seats):           # new players, what they keep across games (as the DealCounters
+        player = variant(specs[v])('v{}-{}'.format(v, i))    # of AI01.count_cache) would make a game depend on the ones before
+        if hasattr(type(player), 'rng'):
+            player.rng = random.Random('{}:{}:{}'.format(settings['seed'], g, i))
+        players.append(Clocked(player))
+    random.seed('{}:{}'.format(settings['seed'], g))     # for the players that draw from the module
+    line = {'game': g, 'seats': seats}
+    try:
+        result = Game(players, seed='{}:{}'.format(settings['seed'], g // n_variants), deck=deck).play()
+    except RuleError as e:
+        line.update(error=str(e), error_seat=e.player_id)
+        return line
+    except Exception as e:                  # one broken game does not stop a night of them
+        line.update(error='{}: {}'.format(type(e).__name__, e), error_seat=None)
+        return line
+    line.update(
+        winner=result.winner,
+        turns=result.turns,
+        suggestions=result.suggestions,
+        eliminated=result.eliminated,
+        fails=[getattr(p.player, 'fail_count', 0) for p in players],
+        ms=[round(p.ns / 1e6, 3) for p in players],
+        calls=[p.calls for p in players],
+        max_ms=[round(p.max_ns / 1e6, 3) for p in players],
+    )
+    return line
+
+
+def play_batch(settings, games):
+    return [play_game(settings, g) for g in games]
+
+
+def open_results(path, settings):
+    # Writes the settings line of a new results file, or checks that they are the ones of the file.
+    # return - the games already in the file - {Int}
+    if not os.path.exists(path) or not os.path.getsize(path):
+        with open(path, 'w') as f:
+            f.write(json.dumps({'tournament': VERSION, 'settings': settings}) + '\n')
+        return set()
+    done = set()
+    with open(path, 'r+b') as f:
+        header = json.loads(f.readline())
+        if header.get('tournament') != VERSION or header.get('settings') != settings:
+            raise SystemExit('{} holds another tournament: {}'.format(path, header.get('settings')))
+        end = f.tell()
+        for line in f:
+            if not line.endswith(b'\n'):    # cut off by a kill
+                break
+            done.add(json.loads(line)['game'])
+            end += len(line)
+        f.truncate(end)
+    return done
+
+
+@contextlib.contextmanager
+def child_environ(name, value):
+    # Sets the environment variable, unless it is set, for the processes started in the with block only:
+    # the process itself read its environment when it started, and it is taken back at the end.
+    if name in os.environ:
+        yield
+        return
+    os.environ[name] = value
+    try:
+        yield
+    finally:
+        del os.environ[name]
+
+
+def run(settings, n_games, path, workers=0, batch_size=50):
+    done = open_results(path, settings)
+    todo = [g for g in range(n_games) if g not in done]
+    batches = (todo[i:i + batch_size] for i in range(0, len(todo), batch_size))
+    workers = workers or os.cpu_count() or 1
+    context = multiprocessing.get_context('spawn')
+    start = time.perf_counter()
+    n_played = 0
+    # The players iterate over sets of names, so the workers are started
+    # with the same hash seed for the games to play the same in every run.
+    with child_environ('PYTHONHASHSEED', '0'), open(path, 'a') as f, \
+            concurrent.futures.ProcessPoolExecutor(workers, context) as executor:
+        pending = set()
+        while True:
+            while len(pending) < 2 * workers:          # a few batches ahead, not the whole run
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                pending.add(executor.submit(play_batch, settings, batch))
+            if not pending:
+                break
+            finished, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                lines = future.result()
+                f.write(''.join(json.dumps(line, separators=(',', ':')) + '\n' for line in lines))
+                n_played += len(lines)
+            f.flush()
+            elapsed = time.perf_counter() - start
+            print('\r{} of {} games, {:.1f} games/s'.format(
+                len(done) + n_played, n_games, n_played / elapsed), end='', file=sys.stderr)
+    print(file=sys.stderr)
+
+
+class Stats:
+    """Running count, mean and variance (Welford)."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        d = x - self.mean
+        self.mean += d / self.n
+        self.m2 += d * (x - self.mean)
+
+    @property
+    def var(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+
+def p_value(z):
+    # return - two-sided p-value of a standard normal z - Float
+    return math.erfc(abs(z) / math.sqrt(2))
+
+
+def wilson(wins, n, z=1.96):
+    # return - 95% confidence interval of the win rate wins / n - (Float, Float)
+    if not n:
+        return 0.0, 1.0
+    p = wins / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return center - half, center + half
+
+
+def report(path, out=sys.stdout):
+    with open(path) as f:
+        settings = json.loads(f.readline())['settings']
+        specs = settings['variants']
+        n = len(specs)
+        seats = [0] * n                     # seats played by every variant
+        wins = [0] * n
+        games = [0] * n                     # games with a seat of every variant
+        turns = [Stats() for _ in range(n)]             # turns of the games every variant won
+        suggestions = [0] * n
+        fails = [0] * n
+        ms = [0.0] * n
+        calls = [0] * n
+        max_ms = [0.0] * n
+        errors = [0] * n
+        share = [[[0, 0.0, 0.0] for _ in range(n)] for _ in range(n)]   # [a][b] -> [wins of a, expected, variance] over games a or b won
+        n_games = n_unsolved = 0
+        for text in f:
+            if not text.endswith('\n'):
+                break
+            line = json.loads(text)
+            n_games += 1
+            seat_variants = line['seats']
+            if 'error' in line:
+                if line['error_seat'] is not None:
+                    errors[seat_variants[line['error_seat']]] += 1
+                continue
+            for v in set(seat_variants):
+                games[v] += 1
+            for i, v in enumerate(seat_variants):
+                seats[v] += 1
+                suggestions[v] += line['suggestions'][i]
+                fails[v] += line['fails'][i]
+                ms[v] += line['ms'][i]
+                calls[v] += line['calls'][i]
+                max_ms[v] = max(max_ms[v], line['max_ms'][i])
+            winner = line['winner']
+            if winner is None:
+                n_unsolved += 1
+                continue
+            w = seat_variants[winner]
+            wins[w] += 1
+            turns[w].add(line['turns'])
+            counts = [seat_variants.count(v) for v in range(n)]
+            for a in range(n):
+                for b in range(n):
+                    if a != b and counts[a] and counts[b] and w in (a, b):
+                        p = counts[a] / (counts[a] + counts[b])
+                        s = share[a][b]
+                        s[0] += w == a
+                        s[1] += p
+                        s[2] += p * (1 - p)
+
+    print('{} games, {} players, {} without a winner, seed {}, deck {}'.format(
+        n_games, settings['players'], n_unsolved, settings['seed'], settings['deck'] or 'default'), file=out)
+    for v, spec in enumerate(specs):
+        low, high = wilson(wins[v], seats[v])
+        print('[{}] {}'.format(v, spec), file=out)
+        print('    wins per seat {:.4f} ({:.4f}-{:.4f}), turns to solve {:.2f}, suggestions per game {:.2f}, '
+              'failed {:.1%}, {:.3f} ms per call (max {:.1f} ms){}'.format(
+                  wins[v] / seats[v] if seats[v] else 0.0, low, high, turns[v].mean,
+                  suggestions[v] / games[v] if games[v] else 0.0, fails[v] / suggestions[v] if suggestions[v] else 0.0,
+                  ms[v] / calls[v] if calls[v] else 0.0, max_ms[v],
+                  ', {} errors'.format(errors[v]) if errors[v] else ''), file=out)
+    for a in range(n):
+        for b in range(a + 1, n):
+            won, expected, var = share[a][b]
+            z_share = (won - expected) / math.sqrt(var) if var else 0.0
+            ta, tb = turns[a], turns[b]
+            se = math.sqrt(ta.var / ta.n + tb.var / tb.n) if ta.n and tb.n else 0.0
+            z_turns = (ta.mean - tb.mean) / se if se else 0.0
+            print('[{}] vs [{}]: wins {:+.1f} over the expected {:.1f} (p={:.3g}), turns to solve {:+.2f} (p={:.3g})'.format(
+                a, b, won - expected, expected, p_value(z_share), ta.mean - tb.mean, p_value(z_turns)), file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='tournament between player variants')
+    commands = parser.add_subparsers(dest='command', required=True)
+    p = commands.add_parser('run', help='play (or go on playing) a tournament')
+    p.add_argument('variants', nargs='+', help="as in 'AIPlayer:AI01,accuse_threshold=0.5'")
+    p.add_argument('-o', '--output', required=True, help='results file, continued if it exists')
+    p.add_argument('-g', '--games', type=int, default=1000, help='games the results file is to have')
+    p.add_argument('-p', '--players', type=int, default=4)
+    p.add_argument('-w', '--workers', type=int, default=0, help='processes (0 -> one per core)')
+    p.add_argument('-s', '--seed', type=int, default=0)
+    p.add_argument('--deck', default=None, help='cards of every type, as in 9x9x12 (default: cards.CARDS)')
+    p.add_argument('--batch', type=int, default=50, help='games per batch of a worker')
+    p = commands.add_parser('report', help='report the results of a tournament')
+    p.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        for spec in args.variants:          # fail now rather than in the workers
+            variant(spec)
+        settings = {'variants': args.variants, 'players': args.players, 'seed': args.seed, 'deck': args.deck}
+        run(settings, args.games, args.output, args.workers, args.batch)
+        report(args.output)
+    else:
+        report(args.path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+"""
+Compact binary game transcripts.
+
+A transcript file holds every message a player received and sent in any
+number of games. It starts with MAGIC and is only ever appended to, one
+whole game at a time:
+
+    game header     GAME_HEADER: b'GAME', block size, records size,
+                    messages, turns, checkpoints, meta size
+    meta            JSON: player name, deck (null for cards.CARDS)
+    turns           TURN for the 'suggestion' message that ends every turn
+    checkpoints     CHECKPOINT for every state checkpoint
+    records         one record per message, see encode
+    blobs           zlib compressed pickles of the player at the checkpoints
+
+The offsets in the turn and checkpoint tables are relative to the first
+record (the blob offsets to the first blob). The offset of every game is
+appended to <path>.idx once the game is written, and a reader scans the
+games the index misses (a crash between the two writes) by their headers.
+
+Reading memory-maps the file, so a game, a turn or a message is found
+from the indexes without decoding what comes before it, and state_at
+rebuilds the player at any message from the last checkpoint before it.
+
+    python transcript.py info games.trn
+    python transcript.py show games.trn GAME [START [STOP]]
+    python transcript.py convert games.trn transcripts/*.txt
+"""
+import array
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+import threading
+import zlib
+
+from cards import DEFAULT_DECK, get_deck
+
+MAGIC = b'CLTR\x01'
+GAME_HEADER = struct.Struct('<4sIIIHHI')
+TURN = struct.Struct('<II')                 # message index, record offset
+CHECKPOINT = struct.Struct('<IIII')         # message index, record offset, blob offset, blob size
+SENT = 0x80                                 # bit of the first byte of a record that was sent by the player
+COMMANDS = (None, 'reset', 'suggest', 'suggestion', 'disprove', 'accuse', 'accusation',
+            'done', 'ok', 'show', 'dead', '-')  # opcode -> first word of the message, 0 is a raw message
+OPCODES = {cmd: i for i, cmd in enumerate(COMMANDS) if cmd}
+SMALL_INT = 0xE0                            # tokens: card indexes below this, then the ints 0 to 15,
+DASH, PLUS, LITERAL = 0xF0, 0xF1, 0xFF      # '-', '+' and a varint size and that many bytes of UTF-8
+WORDS = {**{str(n): SMALL_INT + n for n in range(16)}, '-': DASH, '+': PLUS}    # the tokens that are not cards
+
+
+def token_index(deck):
+    # return - the token of every word with one, for the games of deck - {String: Int}
+    return {**{name: i for i, name in enumerate(deck.names[:SMALL_INT])}, **WORDS}
+
+
+def token_table(deck):
+    # return - the word of every token of deck, None for LITERAL and the unused ones - [String]
+    table = [None] * 256
+    for word, token in token_index(deck).items():
+        table[token] = word
+    return table
+
+
+def put_varint(out, n):
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def get_varint(buf, pos):
+    # return - the varint at pos and the position after it - (Int, Int)
+    n = shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def encode(out, msg, sent, index):
+    # Appends the record of msg to out: the opcode of its first word (with
+    # SENT), the varint size of the rest and one token per word of the rest.
+    # index - token_index of the deck of the game - {String: Int}
+    cmd, _, rest = msg.partition(' ')
+    opcode = OPCODES.get(cmd)
+    payload = bytearray()
+    if opcode is not None and rest:
+        for word in rest.split(' '):
+            token = index.get(word)
+            if token is not None:
+                payload.append(token)
+            else:
+                data = word.encode()
+                payload.append(LITERAL)
+                put_varint(payload, len(data))
+                payload += data
+    elif opcode is None or msg != cmd:      # not a known command (or a message with odd spaces)
+        opcode = 0
+        payload += msg.encode()
+    out.append(opcode | (SENT if sent else 0))
+    put_varint(out, len(payload))
+    out += payload
+
+
+def decode(buf, pos, table):
+    # return - if the record at pos was sent, its message and the position after it - (Boolean, String, Int)
+    head = buf[pos]
+    size, pos = get_varint(buf, pos + 1)
+    end = pos + size
+    opcode = head & ~SENT
+    if not opcode:
+        return bool(head & SENT), bytes(buf[pos:end]).decode(), end
+    payload = buf[pos:end]
+    if LITERAL not in payload:
+        words = [table[b] for b in payload]
+    else:
+        words = []
+        while pos < end:
+            b = buf[pos]
+            if b == LITERAL:
+                n, pos = get_varint(buf, pos + 1)
+                words.append(bytes(buf[pos:pos + n]).decode())
+                pos += n
+            else:
+                words.append(table[b])
+                pos += 1
+    return bool(head & SENT), ' '.join([COMMANDS[opcode], *words]), end
+
+
+class TranscriptWriter:
+    """
+    Appends games to a transcript file. The recorders of all the players
+    of a process can share one writer, a game is written as one block
+    once it is done.
+    """
+
+    def __init__(self, path, checkpoint_every=8):
+        # checkpoint_every - turns between the checkpoints of the state of the player (0 -> none)
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.lock = threading.Lock()
+        new = not os.path.exists(path) or not os.path.getsize(path)
+        self.file = open(path, 'ab')
+        self.index = open(path + '.idx', 'ab')
+        if new:
+            self.file.write(MAGIC)
+            self.file.flush()
+
+    def recorder(self, player):
+        return GameRecorder(self, player)
+
+    def write_game(self, block):
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(block)
+            self.file.flush()
+            self.index.write(struct.pack('<Q', offset))
+            self.index.flush()
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+
+class GameRecorder:
+    """
+    Records the messages of one player, game after game: recv before the
+    message is handled (taking a checkpoint when one is due, the state
+    then is the state after every message before it) and send for every
+    message the player sends. The game is written when the player says
+    'dead'. The 'reset' message is only recorded once it is handled (at
+    the next message either way), when the deck of the game is known.
+    """
+
+    def __init__(self, writer, player):
+        self.writer = writer
+        self.player = player
+        self.records = None                 # records of the game being played, None between games
+        self.checkpoints = []               # (message index, record offset, pickled state) of the game
+        self.reset = None                   # 'reset' message not recorded yet
+
+    def begin(self):
+        player = self.player
+        deck = get_deck(getattr(player, 'game_deck', None) or getattr(player, 'deck', None) or DEFAULT_DECK)
+        self.deck = deck
+        self.index = token_index(deck)
+        self.records = bytearray()
+        self.n_messages = 0
+        self.turns = []
+        self.checkpoints = []
+
+    def begin_game(self):
+        # Starts the game of the 'reset' message received last, once the player handled it.
+        if self.reset is not None:
+            msg, self.reset = self.reset, None
+            self.begin()
+            self.add(msg, False)
+
+    def recv(self, msg):
+        if msg.startswith('reset '):
+            self.reset = msg
+            self.records = None
+            return
+        self.begin_game()
+        if self.records is None:
+            return
+        if msg.startswith('suggestion '):
+            every = self.writer.checkpoint_every
+            if every and self.turns and len(self.turns) % every == 0:
+                state = zlib.compress(pickle.dumps(self.player, pickle.HIGHEST_PROTOCOL))
+                self.checkpoints.append((self.n_messages, len(self.records), state))
+            self.turns.append((self.n_messages, len(self.records)))
+        self.add(msg, False)
+
+    def send(self, msg):
+        self.begin_game()
+        if self.records is None:
+            return
+        self.add(msg, True)
+        if msg == 'dead':
+            self.writer.write_game(self.block())
+            self.records = None
+
+    def add(self, msg, sent):
+        encode(self.records, msg, sent, self.index)
+        self.n_messages += 1
+
+    def block(self):
+        deck = self.deck
+        meta = json.dumps({
+            'player': self.player.name,
+            'deck': None if deck is DEFAULT_DECK else deck.categories,
+        }).encode()
+        tables = bytearray(meta)
+        for turn in self.turns:
+            tables += TURN.pack(*turn)
+        blobs = bytearray()
+        for message, offset, state in self.checkpoints:
+            tables += CHECKPOINT.pack(message, offset, len(blobs), len(state))
+            blobs += state
+        size = len(tables) + len(self.records) + len(blobs)
+        return GAME_HEADER.pack(b'GAME', size, len(self.records), self.n_messages,
+                                len(self.turns), len(self.checkpoints), len(meta)) + tables + self.records + blobs
+
+
+class Game:
+    """One game of a memory-mapped transcript, nothing is decoded until asked for."""
+
+    def __init__(self, buf, offset):
+        magic, size, records_size, self.n_messages, n_turns, n_checkpoints, meta_size = \
+            GAME_HEADER.unpack_from(buf, offset)
+        if magic != b'GAME':
+            raise ValueError('no game at offset {}'.format(offset))
+        pos = offset + GAME_HEADER.size
+        meta = json.loads(bytes(buf[pos:pos + meta_size]))
+        pos += meta_size
+        self.buf = buf
+        self.player = meta['player']
+        self.deck = get_deck(meta['deck']) if meta['deck'] else DEFAULT_DECK
+        self.turns = [TURN.unpack_from(buf, pos + i * TURN.size) for i in range(n_turns)]
+        pos += n_turns * TURN.size
+        self.checkpoints = [CHECKPOINT.unpack_from(buf, pos + i * CHECKPOINT.size) for i in range(n_checkpoints)]
+        pos += n_checkpoints * CHECKPOINT.size
+        self.records = pos                  # offset of the first record in buf
+        self.blobs = pos + records_size     # offset of the first blob in buf
+        self.end = offset + GAME_HEADER.size + size
+        self.table = token_table(self.deck)
+
+    def __len__(self):
+        return self.n_messages
+
+    def seek(self, start, marks):
+        # return - the (message index, record offset) of marks-input closest before start - (Int, Int)
+        best = (0, 0)
+        for mark in marks:
+            if mark[0] > start:
+                break
+            best = mark[:2]
+        return best
+
+    def messages(self, start=0, stop=None, origin=None):
+        # Yields (sent, message) for the messages from index start to stop,
+        # decoding from the last turn before start (or from origin).
+        stop = self.n_messages if stop is None else min(stop, self.n_messages)
+        i, pos = origin or self.seek(start, self.turns)
+        pos += self.records
+        buf, table = self.buf, self.table
+        while i < stop:
+            sent, msg, pos = decode(buf, pos, table)
+            if i >= start:
+                yield sent, msg
+            i += 1
+
+    def received(self):
+        # return - the messages the player received, as Player.run got them - [String]
+        return [msg for sent, msg in self.messages() if not sent]
+
+    def state_at(self, index, player_class=None, messager=None):
+        # return - the player after it handled every message it received before the index-th message - Player
+        # player_class - class of the player to replay into when there is no checkpoint before index, AI01 by default
+        i, pos, blob, size = 0, 0, None, 0
+        for checkpoint in self.checkpoints:
+            if checkpoint[0] > index:
+                break
+            i, pos, blob, size = checkpoint
+        if blob is not None:
+            start = self.blobs + blob
+            player = pickle.loads(zlib.decompress(self.buf[start:start + size]))
+        else:
+            if player_class is None:
+                from AIPlayer import AI01 as player_class
+            player = player_class(self.player)
+            player.deck = self.deck
+        player.messager = messager or Outbox()
+        for sent, msg in self.messages(i, index, origin=(i, pos)):
+            if not sent:
+                cmd, *args = msg.split()
+                player._handlers[cmd](*args)
+        return player
+
+
+class Outbox:
+    """Messager of a replayed player, keeps what it sends."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+    def close(self):
+        pass
+
+
+class TranscriptReader:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buf[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a transcript file'.format(path))
+        self.offsets = self.load_index()    # offset of every game in the file - array('Q')
+
+    def load_index(self):
+        offsets = array.array('Q')
+        try:
+            with open(self.path + '.idx', 'rb') as f:
+                data = f.read()
+            offsets.frombytes(data[:len(data) // offsets.itemsize * offsets.itemsize])
+        except FileNotFoundError:
+            pass
+        while offsets and offsets[-1] + GAME_HEADER.size > len(self.buf):
+            offsets.pop()                   # an index longer than the file, keep what can be read
+        pos = Game(self.buf, offsets[-1]).end if offsets else len(MAGIC)
+        while pos + GAME_HEADER.size <= len(self.buf):      # the games written after the index
+            size = GAME_HEADER.unpack_from(self.buf, pos)[1]
+            end = pos + GAME_HEADER.size + size
+            if end > len(self.buf):                         # a game cut short by a crash
+                break
+            offsets.append(pos)
+            pos = end
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, k):
+        return Game(self.buf, self.offsets[k])
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield Game(self.buf, offset)
+
+    def close(self):
+        self.buf.close()
+        self.file.close()
+
+
+def from_env(checkpoint_every=8):
+    # return - a TranscriptWriter to the file PLAYER_TRANSCRIPT names, None if it is not set - TranscriptWriter
+    path = os.environ.get('PLAYER_TRANSCRIPT')
+    return TranscriptWriter(path, checkpoint_every) if path else None
+
+
+def main():
+    cmd, path, *args = sys.argv[1:]
+    if cmd == 'convert':                    # text transcripts of benchmark.py, received messages only
+        from playerproxy import Player
+        writer = TranscriptWriter(path, checkpoint_every=0)
+        for name in args:
+            recorder = writer.recorder(Player(os.path.basename(name)))
+            with open(name) as f:
+                for line in f:
+                    if line.strip():
+                        recorder.recv(line.rstrip('\n'))
+            recorder.send('dead')
+        writer.close()
+        return
+    reader = TranscriptReader(path)
+    if cmd == 'info':
+        n_messages = sum(len(game) for game in reader)
+        print('games: {} messages: {} bytes: {} ({:.1f} per message)'.format(
+            len(reader), n_messages, len(reader.buf), len(reader.buf) / max(n_messages, 1)))
+    elif cmd == 'show':
+        game = reader[int(args[0])]
+        start = int(args[1]) if len(args) > 1 else 0
+        stop = int(args[2]) if len(args) > 2 else None
+        print('player: {} deck: {} messages: {} turns: {} checkpoints: {}'.format(
+            game.player, game.deck, len(game), len(game.turns), len(game.checkpoints)))
+        for i, (sent, msg) in enumerate(game.messages(start, stop), start):
+            print('{:>5} {} {}'.format(i, '>' if sent else '<', msg))
+
+
+if __name__ == '__main__':
+    main()